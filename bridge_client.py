@@ -6,12 +6,35 @@ Used by GLaDOS and Claudius for messaging, tasks, projects, and git operations.
 """
 
 import os
+import copy
 import json
+import time
+import mimetypes
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional, Dict, List, Any
 from dataclasses import dataclass
 from datetime import datetime
 
+try:
+    import orjson  # optional: faster JSON decoding of large inbox/task payloads
+except ImportError:
+    orjson = None
+
+try:
+    from requests_toolbelt import MultipartEncoder  # optional: streams uploads from disk
+except ImportError:
+    MultipartEncoder = None
+
+
+def _decode(response: requests.Response) -> Dict[str, Any]:
+    if not response.content:
+        return {}
+    return orjson.loads(response.content) if orjson else response.json()
+
 
 @dataclass
 class BridgeConfig:
@@ -24,35 +47,105 @@ class BridgeConfig:
             self.api_key = os.environ.get("AGENT_BRIDGE_API_KEY")
         if not self.api_key:
             raise ValueError("API key required. Set AGENT_BRIDGE_API_KEY env var.")
-    
-    @property
-    def headers(self) -> Dict[str, str]:
-        return {
+        # Built once; the config isn't modified after construction
+        self._headers = {
             "x-api-key": self.api_key,
             "Content-Type": "application/json"
         }
+    
+    @property
+    def headers(self) -> Dict[str, str]:
+        return self._headers
 
 
 class AgentBridgeClient:
     """Client for Agent Bridge v5.0.0+ collaboration platform."""
     
+    CACHE_TTL = 60          # seconds idempotent GETs are served from memory
+    CACHE_MAXSIZE = 256
+    
     def __init__(self, config: Optional[BridgeConfig] = None):
         self.config = config or BridgeConfig()
+        self._base = self.config.base_url.rstrip("/")
+        self._get_cache: Dict[tuple, tuple] = {}  # (endpoint, params) -> (expires_at, result)
+        self._validators: Dict[tuple, tuple] = {}  # (url, params) -> (conditional headers, last body)
+        self._cache_lock = threading.Lock()
         self.session = requests.Session()
         self.session.headers.update(self.config.headers)
+        # Keep-alive pool shared by every call on this client; sized so
+        # concurrent callers get their own connection instead of queueing.
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=16,
+            # raise_on_status=False: once retries run out, hand back the last
+            # response so raise_for_status() raises HTTPError, not RetryError
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                              raise_on_status=False)
+        )
+        # Mounted on the bridge prefix so all bridge traffic shares this one pool
+        self.session.mount(self._base, adapter)
     
     def _request(self, method: str, endpoint: str, **kwargs) -> Dict[str, Any]:
         """Make authenticated request to bridge API."""
-        url = f"{self.config.base_url}{endpoint}"
+        url = f"{self._base}/{endpoint.lstrip('/')}"
+        stored = None
+        if method == "GET":
+            # Conditional GET: revalidate with the last ETag/Last-Modified seen for this URL
+            key = (url, tuple(sorted((kwargs.get("params") or {}).items())))
+            stored = self._validators.get(key)
+            if stored:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), **stored[0]}
         response = self.session.request(method, url, **kwargs)
+        if stored and response.status_code == 304:
+            return copy.deepcopy(stored[1])  # callers may mutate what they get back
         response.raise_for_status()
-        return response.json() if response.content else {}
+        result = _decode(response)
+        if method == "GET":
+            validators = {}
+            if response.headers.get("ETag"):
+                validators["If-None-Match"] = response.headers["ETag"]
+            if response.headers.get("Last-Modified"):
+                validators["If-Modified-Since"] = response.headers["Last-Modified"]
+            with self._cache_lock:
+                if validators:
+                    self._validators[key] = (validators, copy.deepcopy(result))
+                    while len(self._validators) > self.CACHE_MAXSIZE:
+                        del self._validators[next(iter(self._validators))]
+                else:
+                    self._validators.pop(key, None)
+        return result
+    
+    def _cached_get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """GET through a short-lived in-process cache (for rarely changing listings)."""
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        now = time.monotonic()
+        with self._cache_lock:
+            hit = self._get_cache.get(key)
+        # Hand out copies so a caller mutating its result can't change what later callers see
+        if hit and hit[0] > now:
+            return copy.deepcopy(hit[1])
+        result = self._request("GET", endpoint, params=params)
+        with self._cache_lock:
+            self._get_cache[key] = (now + self.CACHE_TTL, copy.deepcopy(result))
+            if len(self._get_cache) > self.CACHE_MAXSIZE:
+                for k in [k for k, (exp, _) in self._get_cache.items() if exp <= now]:
+                    del self._get_cache[k]
+                while len(self._get_cache) > self.CACHE_MAXSIZE:
+                    del self._get_cache[next(iter(self._get_cache))]
+        return result
+    
+    def _invalidate(self, prefix: str):
+        """Drop cached GETs whose endpoint starts with prefix."""
+        with self._cache_lock:
+            for k in [k for k in self._get_cache if k[0].startswith(prefix)]:
+                del self._get_cache[k]
     
     # ==================== Messaging ====================
     
-    def inbox(self) -> Dict[str, Any]:
-        """Check inbox for unread messages."""
-        return self._request("GET", "/inbox")
+    def inbox(self, since: Optional[float] = None) -> Dict[str, Any]:
+        """Check inbox for unread messages, optionally only those newer than `since`."""
+        params = {"since": since} if since else None
+        return self._request("GET", "/inbox", params=params)
     
     def send_dm(self, to: str, content: str) -> Dict[str, Any]:
         """Send direct message to another agent."""
@@ -70,6 +163,10 @@ class AgentBridgeClient:
         """Mark message as read."""
         return self._request("POST", f"/inbox/{message_id}/read")
     
+    def mark_read_batch(self, message_ids: List[str]) -> Dict[str, Any]:
+        """Mark several messages as read in one request."""
+        return self._request("POST", "/inbox/read", json={"ids": list(message_ids)})
+    
     # ==================== Tasks ====================
     
     def list_tasks(self, **filters) -> Dict[str, Any]:
@@ -133,7 +230,7 @@ class AgentBridgeClient:
     
     def list_projects(self) -> Dict[str, Any]:
         """List all projects with progress %."""
-        return self._request("GET", "/projects")
+        return self._cached_get("/projects")
     
     def get_project(self, project_id: str) -> Dict[str, Any]:
         """Get project details with tasks, milestones, repos, members."""
@@ -147,22 +244,24 @@ class AgentBridgeClient:
         members: Optional[List[str]] = None
     ) -> Dict[str, Any]:
         """Create a new project."""
-        return self._request("POST", "/projects", json={
+        result = self._request("POST", "/projects", json={
             "name": name,
             "description": description,
             "tags": tags or [],
             "members": members or []
         })
+        self._invalidate("/projects")
+        return result
     
     # ==================== Agent Git ====================
     
     def list_repos(self) -> Dict[str, Any]:
         """List shared git repositories."""
-        return self._request("GET", "/git/repos")
+        return self._cached_get("/git/repos")
     
     def get_repo(self, repo_name: str) -> Dict[str, Any]:
         """Get repository details."""
-        return self._request("GET", f"/git/repos/{repo_name}")
+        return self._cached_get(f"/git/repos/{repo_name}")
     
     def commit_files(
         self,
@@ -176,11 +275,14 @@ class AgentBridgeClient:
         
         files: List of {"path": str, "content": str, "action": "add|modify|delete"}
         """
-        return self._request("POST", f"/git/repos/{repo_name}/commit", json={
+        result = self._request("POST", f"/git/repos/{repo_name}/commit", json={
             "message": message,
             "branch": branch,
             "files": files
         })
+        # Repo details, tree and the repo listing (commit counts) are now stale
+        self._invalidate("/git/repos")
+        return result
     
     def read_file(self, repo_name: str, path: str, branch: str = "main") -> str:
         """Read file content from repository."""
@@ -189,12 +291,13 @@ class AgentBridgeClient:
     
     def get_tree(self, repo_name: str, branch: str = "main") -> Dict[str, Any]:
         """Get file tree of repository."""
-        return self._request("GET", f"/git/repos/{repo_name}/tree", params={"branch": branch})
+        return self._cached_get(f"/git/repos/{repo_name}/tree", params={"branch": branch})
     
     # ==================== File Sharing ====================
     
     def list_files(self) -> Dict[str, Any]:
         """List shared files."""
+        # Not cached: other agents' uploads should show up immediately
         return self._request("GET", "/files")
     
     def upload_file(
@@ -204,31 +307,50 @@ class AgentBridgeClient:
         description: Optional[str] = None
     ) -> Dict[str, Any]:
         """Upload file to bridge."""
+        name = os.path.basename(file_path)
         with open(file_path, "rb") as f:
-            files = {"file": (os.path.basename(file_path), f)}
             data = {}
             if conversation_id:
                 data["conversation_id"] = conversation_id
             if description:
                 data["description"] = description
             
-            url = f"{self.config.base_url}/files/upload"
-            response = self.session.post(url, files=files, data=data)
+            url = f"{self._base}/files/upload"
+            if MultipartEncoder is not None:
+                # Streams the body from the file handle instead of buffering it in memory
+                mime = mimetypes.guess_type(name)[0] or "application/octet-stream"
+                encoder = MultipartEncoder(fields={**data, "file": (name, f, mime)})
+                response = self.session.post(url, data=encoder, headers={"Content-Type": encoder.content_type})
+            else:
+                # Drop the session's JSON Content-Type so requests sets the multipart boundary
+                response = self.session.post(url, files={"file": (name, f)}, data=data,
+                                             headers={"Content-Type": None})
             response.raise_for_status()
-            return response.json()
+            return _decode(response)
 
 
 # ==================== Convenience Functions ====================
 
+_CLIENT: Optional[AgentBridgeClient] = None
+
+
+def _client() -> AgentBridgeClient:
+    """Module-level client so repeated helper calls reuse one connection pool."""
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = AgentBridgeClient()
+    return _CLIENT
+
+
 def quick_send(to: str, content: str) -> Dict[str, Any]:
     """Quick send DM using env API key."""
-    client = AgentBridgeClient()
+    client = _client()
     return client.send_dm(to, content)
 
 
 def quick_inbox() -> List[Dict[str, Any]]:
     """Quick check inbox using env API key."""
-    client = AgentBridgeClient()
+    client = _client()
     result = client.inbox()
     return result.get("messages", [])
 
@@ -241,13 +363,17 @@ def heartbeat_check() -> Dict[str, Any]:
     - Open tasks
     - Projects
     """
-    client = AgentBridgeClient()
-    return {
-        "inbox": client.inbox(),
-        "my_tasks": client.my_active_tasks(),
-        "open_tasks": client.list_tasks(status="open"),
-        "projects": client.list_projects()
+    client = _client()
+    calls = {
+        "inbox": client.inbox,
+        "my_tasks": client.my_active_tasks,
+        "open_tasks": lambda: client.list_tasks(status="open"),
+        "projects": client.list_projects
     }
+    # The four GETs are independent — fan them out over the pooled session
+    with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+        futures = {key: ex.submit(fn) for key, fn in calls.items()}
+        return {key: f.result() for key, f in futures.items()}
 
 
 if __name__ == "__main__":
@@ -10,15 +10,27 @@ This prevents flywheel effects when two agents both have auto-reply.
 
 import os
 import sys
-import time
 import json
+import time
+import signal
 import logging
 import subprocess
-import urllib.request
-import urllib.error
+import collections
+import tempfile
+import threading
+import queue
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 
-load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+load_dotenv(os.path.join(BASE_DIR, '.env'))
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,42 +44,97 @@ BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN", "")
 TELEGRAM_CHAT_ID = "-1001426819337"
 
 DETECT_INTERVAL = 60       # Check for new messages every 60 seconds
+MAX_DETECT_INTERVAL = 300  # Back off to at most 5 minutes while the inbox stays quiet
 REPLY_INTERVAL = 1800      # Spawn agent to reply every 30 minutes
+REPLY_TIMEOUT = 120        # Kill a reply agent that runs longer than this
+
+TELEGRAM_MAX_CHARS = 4000  # Telegram's hard limit is 4096; leave room for HTML
+NOTIFIED_MAX = 10_000      # Cap on remembered notified IDs (oldest evicted first)
+NOTIFIED_TTL = 7 * 86400   # Forget notified IDs after a week
+NOTIFY_QUEUE_MAX = 100     # Telegram batches waiting to be sent before new ones are dropped
+
+# notified_ids survives restarts: a compact JSON snapshot plus an append-only
+# log of IDs added since, so a crash loses nothing and a restart doesn't re-ping
+NOTIFIED_FILE = os.path.join(BASE_DIR, "watcher_notified.json")
+NOTIFIED_LOG = os.path.join(BASE_DIR, "watcher_notified.log")
+NOTIFIED_LOG_MAX = 2 * NOTIFIED_MAX  # Log lines before it's folded into a fresh snapshot
 
 # Track state
 pending_messages = []       # Messages detected but not yet replied to
-notified_ids = set()        # Message IDs we've already sent Telegram pings for
+pending_ids = set()         # IDs in pending_messages, for O(1) membership checks
+notified_ids = collections.OrderedDict()  # Message ID -> time we sent its Telegram ping (LRU)
 last_reply_time = 0         # Last time we spawned an agent to reply
+last_seen_ts = None         # Newest message timestamp fetched; later polls only ask for newer ones
+_running_agents = []        # (Popen, started_at, messages, stdout_file, stderr_file) still running
+_notified_log_lines = 0     # Lines appended to NOTIFIED_LOG since the last snapshot
+notify_queue = queue.Queue(maxsize=NOTIFY_QUEUE_MAX)  # Telegram texts for the notifier thread
+
+
+# Keep-alive sessions for both the local bridge and api.telegram.org.
+# Transient failures are retried with backoff inside the adapter; 4xx auth
+# errors surface immediately. GETs are idempotent, so they also retry 5xx
+# and dropped connections. POSTs (mark-read, Telegram sends) only retry when
+# the request never reached the server: connect errors and 429 rate limits.
+RETRY = Retry(
+    total=5,
+    backoff_factor=0.5,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True
+)
+POST_RETRY = Retry(
+    total=5,
+    read=0,
+    backoff_factor=0.5,
+    status_forcelist=[429],
+    allowed_methods=["POST"],
+    respect_retry_after_header=True
+)
+
+
+def _session(retry):
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry))
+    session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4, max_retries=retry))
+    return session
+
+
+SESSION = _session(RETRY)
+POST_SESSION = _session(POST_RETRY)
+
 
+def _loads(resp):
+    return orjson.loads(resp.content) if orjson else resp.json()
 
-def http_get(url, headers=None):
-    req = urllib.request.Request(url, headers=headers or {})
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.loads(resp.read().decode())
+
+def http_get(url, headers=None, params=None):
+    resp = SESSION.get(url, headers=headers, params=params, timeout=10)
+    resp.raise_for_status()
+    return _loads(resp)
 
 
 def http_post(url, data=None, headers=None):
-    body = json.dumps(data or {}).encode()
-    req = urllib.request.Request(
-        url,
-        data=body,
-        headers={"Content-Type": "application/json", **(headers or {})},
-        method="POST"
-    )
-    with urllib.request.urlopen(req, timeout=10) as resp:
-        return json.loads(resp.read().decode())
+    if orjson:
+        resp = POST_SESSION.post(url, data=orjson.dumps(data or {}), timeout=10,
+                                 headers={"Content-Type": "application/json", **(headers or {})})
+    else:
+        resp = POST_SESSION.post(url, json=data or {}, headers=headers, timeout=10)
+    resp.raise_for_status()
+    return _loads(resp)
 
 
-def check_inbox():
+def check_inbox(since=None):
     return http_get(
         f"{BRIDGE_URL}/inbox",
-        headers={"x-api-key": CLAUDIUS_KEY}
+        headers={"x-api-key": CLAUDIUS_KEY},
+        params={"since": since} if since else None
     )
 
 
-def mark_read(msg_id):
-    http_post(
-        f"{BRIDGE_URL}/inbox/{msg_id}/read",
+def mark_read(msg_ids):
+    return http_post(
+        f"{BRIDGE_URL}/inbox/read",
+        {"ids": list(msg_ids)},
         headers={"x-api-key": CLAUDIUS_KEY}
     )
 
@@ -81,18 +148,59 @@ def send_telegram(text):
     })
 
 
+_NOTIF_TMPL = "\U0001f4e8 <b>Agent Bridge — Message from {sender}:</b>\n\n{preview}"
+
+
+def preview(content):
+    return content if len(content) <= 500 else f"{content[:497]}..."
+
+
+def notify_new_messages(messages):
+    """Send one Telegram ping for a poll's new messages, split only if over the size limit."""
+    sections = [
+        _NOTIF_TMPL.format(sender=msg["from_agent"], preview=preview(msg["content"]))
+        for msg in messages
+    ]
+    separator = "\n\n---\n\n"
+    batches, current = [], ""
+    for section in sections:
+        if current and len(current) + len(separator) + len(section) > TELEGRAM_MAX_CHARS:
+            batches.append(current)
+            current = section
+        else:
+            current = f"{current}{separator}{section}" if current else section
+    if current:
+        batches.append(current)
+    for text in batches:
+        try:
+            notify_queue.put_nowait(text)
+        except queue.Full:
+            logging.error("Telegram queue full — dropping notification")
+
+
+def notify_worker():
+    """Send queued Telegram notifications so a slow send never delays the next inbox poll."""
+    while True:
+        text = notify_queue.get()
+        try:
+            send_telegram(text)
+        except Exception as e:
+            logging.error("Telegram notification failed: %s", e)
+        finally:
+            notify_queue.task_done()
+
+
 def spawn_agent_reply(messages):
     """Spawn a local OpenClaw agent to reply to accumulated bridge messages."""
-    msg_summary = []
-    senders = set()
+    # Group by sender in one pass so each sender appears once in the prompt
+    by_sender = collections.defaultdict(list)
     for msg in messages:
-        sender = msg["from_agent"]
-        content = msg["content"]
-        senders.add(sender)
-        msg_summary.append(f"From {sender}: {content}")
+        by_sender[msg["from_agent"]].append(msg["content"])
 
-    messages_text = "\n\n---\n\n".join(msg_summary)
-    sender_list = ", ".join(senders)
+    messages_text = "\n\n---\n\n".join(
+        f"From {sender}:\n" + "\n\n".join(contents) for sender, contents in by_sender.items()
+    )
+    sender_list = ", ".join(by_sender)
 
     prompt = f"""You have unread messages on your Agent Bridge from: {sender_list}
 
@@ -121,40 +229,170 @@ IMPORTANT:
 - Send one reply per sender, combining responses if they sent multiple messages
 - After sending, confirm what you sent"""
 
+    # Output goes to temp files rather than pipes so a chatty agent can't fill
+    # the pipe buffer and stall while nobody is reading it.
+    out, err = tempfile.TemporaryFile(mode="w+"), tempfile.TemporaryFile(mode="w+")
     try:
-        result = subprocess.run(
+        proc = subprocess.Popen(
             ["openclaw", "agent", "--local", "--session-id", "bridge-auto-reply", "--message", prompt],
-            capture_output=True,
-            text=True,
-            timeout=120
+            stdout=out,
+            stderr=err,
+            text=True
         )
-        logging.info("Agent spawn result: %s", result.returncode)
-        if result.returncode != 0:
-            logging.error("Agent stderr: %s", result.stderr[-500:] if result.stderr else "none")
-        if result.stdout:
-            output = result.stdout.strip()
-            logging.info("Agent output: %s", output[-800:] if len(output) > 800 else output)
-        return result.returncode == 0
-    except subprocess.TimeoutExpired:
-        logging.error("Agent spawn timed out")
-        return False
     except Exception as e:
         logging.error("Agent spawn failed: %s", e)
+        out.close()
+        err.close()
         return False
+    _running_agents.append((proc, time.time(), list(messages), out, err))
+    return True
+
+
+def handle_completion(returncode, messages, out, err):
+    """Log a finished reply agent and mark its messages read, or re-queue them on failure."""
+    out.seek(0)
+    err.seek(0)
+    stdout, stderr = out.read(), err.read()
+    out.close()
+    err.close()
+    logging.info("Agent spawn result: %s", returncode)
+    if returncode != 0:
+        logging.error("Agent stderr: %s", stderr[-500:] if stderr else "none")
+    if stdout:
+        output = stdout.strip()
+        logging.info("Agent output: %s", output[-800:] if len(output) > 800 else output)
+
+    if returncode == 0:
+        try:
+            result = mark_read([msg["id"] for msg in messages])
+            logging.info("Marked %d message(s) as read", result.get("updated", 0))
+        except Exception as e:
+            logging.error("Failed to mark %d message(s) as read: %s", len(messages), e)
+    else:
+        logging.warning(
+            "Agent reply failed — keeping %d message(s) pending for retry",
+            len(messages)
+        )
+        for msg in messages:
+            if msg["id"] not in pending_ids:
+                pending_messages.append(msg)
+                pending_ids.add(msg["id"])
+
+
+def reap_agents():
+    """Collect finished reply agents and kill any that overran REPLY_TIMEOUT."""
+    for entry in list(_running_agents):
+        proc, started, messages, out, err = entry
+        rc = proc.poll()
+        if rc is not None:
+            _running_agents.remove(entry)
+            handle_completion(rc, messages, out, err)
+        elif time.time() - started > REPLY_TIMEOUT:
+            logging.error("Agent spawn timed out")
+            proc.kill()  # reaped (as a failure) on the next pass
+
+
+def remember_notified(msg_id):
+    global _notified_log_lines
+    now = time.time()
+    notified_ids[msg_id] = now
+    if len(notified_ids) > NOTIFIED_MAX:
+        notified_ids.popitem(last=False)
+    try:
+        with open(NOTIFIED_LOG, "a") as f:
+            f.write(f"{now:.0f} {msg_id}\n")
+    except OSError as e:
+        logging.warning("Could not persist notified id: %s", e)
+    else:
+        _notified_log_lines += 1
+        # Long-running watchers would otherwise grow the log forever
+        if _notified_log_lines > NOTIFIED_LOG_MAX:
+            save_notified()
+
+
+def load_notified():
+    """Restore notified_ids from the snapshot and log, dropping entries older than NOTIFIED_TTL."""
+    entries = {}
+    try:
+        with open(NOTIFIED_FILE) as f:
+            entries.update(json.load(f))
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable %s: %s", NOTIFIED_FILE, e)
+    try:
+        with open(NOTIFIED_LOG) as f:
+            for line in f:
+                ts, _, msg_id = line.strip().partition(" ")
+                if msg_id:
+                    try:
+                        entries[msg_id] = float(ts)
+                    except ValueError:
+                        continue  # torn write from a crash
+    except FileNotFoundError:
+        pass
+
+    cutoff = time.time() - NOTIFIED_TTL
+    notified_ids.clear()
+    for msg_id, ts in sorted(entries.items(), key=lambda kv: kv[1])[-NOTIFIED_MAX:]:
+        if ts >= cutoff:
+            notified_ids[msg_id] = ts
+    save_notified()
+
+
+def save_notified():
+    """Write a compact snapshot of notified_ids and truncate the append log."""
+    global _notified_log_lines
+    tmp = NOTIFIED_FILE + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            json.dump(notified_ids, f)
+        os.replace(tmp, NOTIFIED_FILE)
+        open(NOTIFIED_LOG, "w").close()
+        _notified_log_lines = 0
+    except OSError as e:
+        logging.warning("Could not save notified ids: %s", e)
+
+
+def handle_sigterm(signum, frame):
+    save_notified()
+    sys.exit(0)
 
 
 def main():
-    global pending_messages, notified_ids, last_reply_time
+    global pending_messages, pending_ids, notified_ids, last_reply_time, last_seen_ts
 
     logging.info(
         "Agent Bridge Inbox Watcher starting — detect every %ds, reply every %ds...",
         DETECT_INTERVAL, REPLY_INTERVAL
     )
 
+    load_notified()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    threading.Thread(target=notify_worker, name="telegram-notify", daemon=True).start()
+    logging.info("Restored %d notified message id(s)", len(notified_ids))
+
+    current_interval = DETECT_INTERVAL
+
     while True:
+        new_messages = []
         try:
-            data = check_inbox()
+            reap_agents()
+
+            # The first poll after startup fetches the whole unread inbox so messages
+            # notified before a restart but never replied to go back into pending.
+            first_poll = last_seen_ts is None
+            data = check_inbox(since=last_seen_ts)
             messages = data.get("messages", [])
+            if messages:
+                last_seen_ts = max(m["timestamp"] for m in messages)
+            elif first_poll:
+                last_seen_ts = 0
+            if first_poll:
+                for msg in messages:
+                    if msg["id"] in notified_ids and msg["id"] not in pending_ids:
+                        pending_messages.append(msg)
+                        pending_ids.add(msg["id"])
 
             # --- IMMEDIATE: Telegram notification for any new messages ---
             new_messages = [m for m in messages if m["id"] not in notified_ids]
@@ -162,58 +400,53 @@ def main():
             if new_messages:
                 for msg in new_messages:
                     logging.info("New message from %s: %s", msg["from_agent"], msg["content"][:120])
-                    notified_ids.add(msg["id"])
+                    remember_notified(msg["id"])
 
                     # Add to pending queue if not already there
-                    if not any(p["id"] == msg["id"] for p in pending_messages):
+                    if msg["id"] not in pending_ids:
                         pending_messages.append(msg)
+                        pending_ids.add(msg["id"])
 
-                # Send Telegram ping immediately
-                for msg in new_messages:
-                    content = msg["content"]
-                    preview = content if len(content) <= 500 else content[:497] + "..."
-                    notification = (
-                        f"\U0001f4e8 <b>Agent Bridge — Message from {msg['from_agent']}:</b>\n\n"
-                        f"{preview}"
-                    )
-                    try:
-                        send_telegram(notification)
-                    except Exception as e:
-                        logging.error("Telegram notification failed: %s", e)
+                # Queue the Telegram ping immediately (one request per poll)
+                notify_new_messages(new_messages)
 
             # --- BATCHED: Auto-reply every REPLY_INTERVAL ---
             now = time.time()
-            if pending_messages and (now - last_reply_time) >= REPLY_INTERVAL:
+            if pending_messages and not _running_agents and (now - last_reply_time) >= REPLY_INTERVAL:
                 logging.info(
                     "Reply interval reached — spawning agent for %d pending message(s)",
                     len(pending_messages)
                 )
 
-                success = spawn_agent_reply(pending_messages)
-
-                if success:
-                    # Mark all as read
-                    for msg in pending_messages:
-                        try:
-                            mark_read(msg["id"])
-                            logging.info("Marked %s as read", msg["id"][:8])
-                        except Exception as e:
-                            logging.error("Failed to mark %s as read: %s", msg["id"][:8], e)
+                # Runs in the background; reap_agents() marks them read when it finishes
+                if spawn_agent_reply(pending_messages):
                     pending_messages = []
-                    last_reply_time = now
+                    pending_ids = set()
                 else:
                     logging.warning(
                         "Agent spawn failed — keeping %d message(s) pending for retry",
                         len(pending_messages)
                     )
-                    last_reply_time = now  # Don't retry immediately
+                last_reply_time = now  # Don't retry immediately
 
-        except urllib.error.URLError as e:
-            logging.error("Bridge connection error: %s", e)
+        except requests.exceptions.RequestException as e:
+            logging.error("Bridge request failed: %s", e)
         except Exception as e:
             logging.error("Unexpected error: %s", e)
 
-        time.sleep(DETECT_INTERVAL)
+        # Adaptive polling: double the wait after each quiet poll, reset on activity
+        if new_messages:
+            current_interval = DETECT_INTERVAL
+        else:
+            current_interval = min(current_interval * 2, MAX_DETECT_INTERVAL)
+        sleep_for = current_interval
+        if pending_messages:
+            # Don't let back-off push the batched reply past its wall-clock deadline
+            until_reply = last_reply_time + REPLY_INTERVAL - time.time()
+            sleep_for = min(sleep_for, max(until_reply, DETECT_INTERVAL))
+        if _running_agents:
+            sleep_for = min(sleep_for, DETECT_INTERVAL)  # reap promptly
+        time.sleep(sleep_for)
 
 
 if __name__ == "__main__":
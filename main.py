@@ -1,21 +1,80 @@
 """Agent Bridge v6 — Multi-agent collaboration platform: messaging, files, projects, tasks, git, presence, reactions"""
-from fastapi import FastAPI, HTTPException, Header, Depends, Request, Response, UploadFile, File, Form, Query
-from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Header, Depends, Request, Response, UploadFile, File, Form, Query, BackgroundTasks
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List
 from datetime import datetime, timezone
-import sqlite3, os, secrets, time, uuid, json, hashlib, mimetypes, shutil, difflib, asyncio, threading
-
-# ── Rate limiting note ────────────────────────────────────────────────────────
-# TODO: Add rate limiting middleware if abuse becomes an issue.
-# Recommended: slowapi (wraps limits library) — 60 req/min per API key.
-# Example: @limiter.limit("60/minute") on each route, keyed by x-api-key header.
-# For uploads specifically: 10/min to prevent disk exhaustion attacks.
+import sqlite3, os, secrets, time, uuid, json, hashlib, mimetypes, shutil, difflib, asyncio, threading, queue, functools
+from contextlib import contextmanager, asynccontextmanager
+from collections import OrderedDict
+import anyio.to_thread
+from urllib.parse import quote
+
+try:
+    import orjson  # serializes the row-dict payloads several times faster than json
+except ImportError:
+    orjson = None
+
+class DefaultResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it's installed."""
+    def render(self, content) -> bytes:
+        if orjson is None:
+            return super().render(content)
+        return orjson.dumps(content)
+
+# Sync handlers (all the DB endpoints) and run_in_threadpool share anyio's
+# default limiter of 40 threads; a burst of inbox polls could take every slot
+# and stall the DB steps of async upload handlers. DB work beyond the reader
+# pool just waits on a connection, so extra threads are cheap.
+THREADPOOL_SIZE = int(os.environ.get("BRIDGE_THREADS", "100"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    yield
+    db_pool.close_all()
+
+app = FastAPI(title="Agent Bridge v5", default_response_class=DefaultResponse, lifespan=lifespan)
+
+# ── Rate limiting ─────────────────────────────────────────────────────────────
+# Fixed one-minute windows per agent, checked in middleware so floods are shed
+# before they touch SQLite or the disk. Only keys already verified (present in
+# _key_cache) get their agent's bucket; anything else, including made-up keys,
+# counts against the client IP, so rotating bogus keys buys no fresh budget. Uploads
+# get a much tighter budget to prevent disk exhaustion. In-memory and
+# per-process, which matches the single-worker deployment.
 # ──────────────────────────────────────────────────────────────────────────────
 
-app = FastAPI(title="Agent Bridge v5")
-
-SERVER_START_TIME = time.time()
+RATE_LIMIT_PER_MIN = int(os.environ.get("BRIDGE_RATE_LIMIT", "120"))
+UPLOAD_RATE_LIMIT_PER_MIN = int(os.environ.get("BRIDGE_UPLOAD_RATE_LIMIT", "10"))
+UPLOAD_PATHS = ("/files/upload", "/send-file")
+RATE_WINDOWS_MAX = 10_000
+_rate_windows: dict = {}  # (client, bucket) -> [window_start, count]
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    known = _key_cache.get(request.headers.get("x-api-key", ""))
+    client = f"agent:{known[0]}" if known else f"ip:{request.client.host if request.client else '?'}"
+    upload = request.url.path in UPLOAD_PATHS
+    limit = UPLOAD_RATE_LIMIT_PER_MIN if upload else RATE_LIMIT_PER_MIN
+    window = int(time.time() // 60) * 60
+    slot = _rate_windows.get((client, upload))
+    if slot is None or slot[0] != window:
+        if len(_rate_windows) > RATE_WINDOWS_MAX:
+            for k in [k for k, v in _rate_windows.items() if v[0] != window]:
+                del _rate_windows[k]
+            if len(_rate_windows) > RATE_WINDOWS_MAX:
+                _rate_windows.clear()  # hard cap; at worst grants a fresh window
+        slot = _rate_windows[(client, upload)] = [window, 0]
+    slot[1] += 1
+    if slot[1] > limit:
+        return JSONResponse({"detail": f"Rate limit exceeded ({limit}/minute)"}, status_code=429,
+                            headers={"Retry-After": str(int(window + 60 - time.time()) + 1)})
+    return await call_next(request)
+
+SERVER_START_TIME = time.time()  # wall clock, reported as started_at
+SERVER_START_MONO = time.monotonic()  # uptime; immune to clock steps
 VERSION = "6.0.0"
 
 # ── SSE Event Bus ─────────────────────────────────────
@@ -63,6 +122,9 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "messages.db")
 FILES_DIR = os.path.join(os.path.dirname(__file__), "files")
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
 os.makedirs(FILES_DIR, exist_ok=True)
+# When set (e.g. "/_bridge_files/"), downloads answer with an X-Accel-Redirect
+# to this internal nginx location and let nginx send the blob itself
+ACCEL_REDIRECT_PREFIX = os.environ.get("BRIDGE_ACCEL_REDIRECT", "")
 SECRET_FILE = os.path.join(os.path.dirname(__file__), "admin_secret.txt")
 ADMIN_SECRET = os.environ.get("BRIDGE_ADMIN_SECRET", "")
 if not ADMIN_SECRET and os.path.exists(SECRET_FILE):
@@ -73,225 +135,486 @@ if not ADMIN_SECRET and os.path.exists(SECRET_FILE):
 
 # No file type restrictions — agents can share anything up to MAX_FILE_SIZE
 
+def _log_hash_backend():
+    """Uploads use hashlib's OpenSSL SHA-256, which is only fast when the CPU has SHA-NI."""
+    import ssl
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+        sha_ni = " sha_ni" in cpuinfo or " sha2" in cpuinfo  # x86 / ARMv8 flag names
+    except OSError:
+        sha_ni = None  # not Linux; can't tell
+    print(f"[agent-bridge] hashlib backend: {ssl.OPENSSL_VERSION}, SHA-NI: {'unknown' if sha_ni is None else sha_ni}")
+    if sha_ni is False:
+        print("[agent-bridge] WARNING: CPU lacks SHA-NI — SHA-256 of large uploads will be CPU-bound")
+
+_log_hash_backend()
+
 # ── Database ─────────────────────────────────────────
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
+# Connections are opened once and reused across requests. WAL lets readers
+# proceed while a single writer commits, so reads get a LIFO pool of their own
+# connections (LIFO keeps the hot ones' page caches warm) and every write goes
+# through one connection behind a lock — writers queue in-process instead of
+# spinning on SQLITE_BUSY. check_same_thread=False because a connection may be
+# handed to a different threadpool worker each request.
+DB_READERS = int(os.environ.get("BRIDGE_DB_READERS", str(os.cpu_count() or 4)))
+
+# Per-connection tuning, applied once when a pooled connection is opened.
+# journal_mode=WAL is persistent and set once in init_db().
+PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",    # WAL: fsync at checkpoints, not every commit
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",     # sorts and temp b-trees stay in RAM
+    "PRAGMA cache_size=-20000",     # 20 MB page cache per pooled connection
+    "PRAGMA mmap_size=268435456",
+)
+
+def _init_pragmas(conn):
+    for p in PRAGMAS:
+        conn.execute(p)
+
+def _open_db():
+    # cached_statements: the default 128 is smaller than this module's set of distinct SQL strings
+    conn = sqlite3.connect(DB_PATH, timeout=10, check_same_thread=False, cached_statements=256)
     conn.row_factory = sqlite3.Row
+    _init_pragmas(conn)
     return conn
 
+def _fetch_dicts(cur) -> list:
+    """fetchall() as plain dicts. Zipping against the column names once per query is
+    cheaper than dict(sqlite3.Row) per row, which matters on the 500-row endpoints."""
+    cols = [c[0] for c in cur.description]
+    cur.row_factory = None
+    return [dict(zip(cols, r)) for r in cur]
+
+class ConnectionPool:
+    """Up to `readers` read connections plus one lock-guarded write connection.
+
+    Both are opened lazily. Uncommitted work is rolled back when a connection
+    is returned, so a handler that raises never leaks a half-done transaction.
+    """
+
+    def __init__(self, readers: int):
+        self.readers = max(1, readers)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._opened = 0
+        self._opened_lock = threading.Lock()
+        self._writer = None
+        self._write_lock = threading.RLock()
+
+    def _borrow(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._opened_lock:
+            grow = self._opened < self.readers
+            if grow:
+                self._opened += 1
+        if not grow:
+            return self._idle.get()
+        try:
+            conn = _open_db()
+            conn.execute("PRAGMA query_only=1")
+            return conn
+        except Exception:
+            with self._opened_lock:
+                self._opened -= 1
+            raise
+
+    @contextmanager
+    def read(self):
+        conn = self._borrow()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    @contextmanager
+    def write(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = _open_db()
+            conn = self._writer
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+
+    @contextmanager
+    def transaction(self):
+        """write() wrapped in BEGIN IMMEDIATE: commits if the block completes, rolls back if it raises."""
+        with self.write() as conn:
+            # Take the write lock up front; a deferred transaction that upgrades
+            # mid-handler can hit SQLITE_BUSY against another process's writer
+            conn.execute("BEGIN IMMEDIATE")
+            yield conn
+            conn.commit()
+
+    def close_all(self):
+        """Close idle readers and the writer at shutdown. Used again, the pool reopens lazily."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._opened_lock:
+                self._opened -= 1
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.execute("PRAGMA optimize")  # refresh planner stats the workload has made stale
+                self._writer.close()
+                self._writer = None
+
+db_pool = ConnectionPool(DB_READERS)
+
 def init_db():
-    conn = get_db()
-    conn.execute("""CREATE TABLE IF NOT EXISTS api_keys (
-        key TEXT PRIMARY KEY, agent_id TEXT NOT NULL, created_at REAL NOT NULL
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS conversations (
-        id TEXT PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL DEFAULT 'group',
-        created_by TEXT, created_at REAL NOT NULL
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS conversation_members (
-        conversation_id TEXT NOT NULL, agent_id TEXT NOT NULL, joined_at REAL NOT NULL,
-        PRIMARY KEY (conversation_id, agent_id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS files (
-        id TEXT PRIMARY KEY, filename TEXT NOT NULL, original_name TEXT NOT NULL,
-        mime_type TEXT, size INTEGER NOT NULL, sha256 TEXT,
-        uploaded_by TEXT NOT NULL, uploaded_at REAL NOT NULL,
-        conversation_id TEXT, message_id TEXT,
-        description TEXT
-    )""")
-    # Projects
-    conn.execute("""CREATE TABLE IF NOT EXISTS projects (
-        id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT DEFAULT '',
-        status TEXT DEFAULT 'active', created_by TEXT NOT NULL,
-        created_at REAL NOT NULL, updated_at REAL NOT NULL,
-        tags TEXT DEFAULT '[]'
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS project_members (
-        project_id TEXT NOT NULL, agent_id TEXT NOT NULL, role TEXT DEFAULT 'member',
-        joined_at REAL NOT NULL, PRIMARY KEY (project_id, agent_id)
-    )""")
-    # Milestones
-    conn.execute("""CREATE TABLE IF NOT EXISTS milestones (
-        id TEXT PRIMARY KEY, project_id TEXT NOT NULL, name TEXT NOT NULL,
-        description TEXT DEFAULT '', due_by REAL, status TEXT DEFAULT 'open',
-        created_at REAL NOT NULL,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    )""")
-    # Tasks with project + milestone + dependencies
-    conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
-        id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT DEFAULT '',
-        status TEXT DEFAULT 'open', priority TEXT DEFAULT 'normal',
-        created_by TEXT NOT NULL, assigned_to TEXT, claimed_by TEXT,
-        tags TEXT DEFAULT '[]', created_at REAL NOT NULL, updated_at REAL NOT NULL,
-        completed_at REAL, due_by REAL, parent_id TEXT,
-        project_id TEXT, milestone_id TEXT, effort_estimate TEXT,
-        FOREIGN KEY (parent_id) REFERENCES tasks(id),
-        FOREIGN KEY (project_id) REFERENCES projects(id),
-        FOREIGN KEY (milestone_id) REFERENCES milestones(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS task_dependencies (
-        task_id TEXT NOT NULL, depends_on TEXT NOT NULL,
-        PRIMARY KEY (task_id, depends_on),
-        FOREIGN KEY (task_id) REFERENCES tasks(id),
-        FOREIGN KEY (depends_on) REFERENCES tasks(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS task_comments (
-        id TEXT PRIMARY KEY, task_id TEXT NOT NULL, agent_name TEXT NOT NULL,
-        content TEXT NOT NULL, created_at REAL NOT NULL,
-        FOREIGN KEY (task_id) REFERENCES tasks(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS task_history (
-        id TEXT PRIMARY KEY, task_id TEXT NOT NULL, agent_name TEXT NOT NULL,
-        action TEXT NOT NULL, details TEXT DEFAULT '', created_at REAL NOT NULL,
-        FOREIGN KEY (task_id) REFERENCES tasks(id)
-    )""")
-    # Agent Git — shared repositories
-    conn.execute("""CREATE TABLE IF NOT EXISTS git_repos (
-        id TEXT PRIMARY KEY, name TEXT UNIQUE NOT NULL, description TEXT DEFAULT '',
-        created_by TEXT NOT NULL, created_at REAL NOT NULL,
-        default_branch TEXT DEFAULT 'main', project_id TEXT,
-        FOREIGN KEY (project_id) REFERENCES projects(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS git_commits (
-        id TEXT PRIMARY KEY, repo_id TEXT NOT NULL, branch TEXT DEFAULT 'main',
-        author TEXT NOT NULL, message TEXT NOT NULL, created_at REAL NOT NULL,
-        parent_id TEXT,
-        FOREIGN KEY (repo_id) REFERENCES git_repos(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS git_files (
-        id TEXT PRIMARY KEY, commit_id TEXT NOT NULL, path TEXT NOT NULL,
-        content TEXT, sha256 TEXT, size INTEGER DEFAULT 0,
-        action TEXT DEFAULT 'add',
-        FOREIGN KEY (commit_id) REFERENCES git_commits(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS git_branches (
-        repo_id TEXT NOT NULL, name TEXT NOT NULL, head_commit TEXT,
-        PRIMARY KEY (repo_id, name),
-        FOREIGN KEY (repo_id) REFERENCES git_repos(id)
-    )""")
-    conn.execute("""CREATE TABLE IF NOT EXISTS pending_registrations (
-        id TEXT PRIMARY KEY, agent_name TEXT NOT NULL UNIQUE,
-        description TEXT DEFAULT '', contact TEXT DEFAULT '',
-        status TEXT DEFAULT 'pending',
-        created_at REAL NOT NULL, reviewed_at REAL,
-        reviewed_by TEXT
-    )""")
-    # Agent profiles — bio, status, avatar
-    conn.execute("""CREATE TABLE IF NOT EXISTS agent_profiles (
-        agent_id TEXT PRIMARY KEY, bio TEXT DEFAULT '', status_message TEXT DEFAULT '',
-        avatar_url TEXT DEFAULT '', metadata TEXT DEFAULT '{}', updated_at REAL NOT NULL
-    )""")
-    # Agent presence — heartbeat-based online/offline tracking
-    conn.execute("""CREATE TABLE IF NOT EXISTS agent_presence (
-        agent_id TEXT PRIMARY KEY, status TEXT DEFAULT 'offline',
-        last_heartbeat REAL NOT NULL, last_active REAL, custom_status TEXT DEFAULT ''
-    )""")
-    # Message reactions — emoji on messages
-    conn.execute("""CREATE TABLE IF NOT EXISTS message_reactions (
-        id TEXT PRIMARY KEY, message_id TEXT NOT NULL, agent_id TEXT NOT NULL,
-        emoji TEXT NOT NULL, created_at REAL NOT NULL,
-        UNIQUE(message_id, agent_id, emoji)
-    )""")
-    # Message pins
-    conn.execute("""CREATE TABLE IF NOT EXISTS pinned_messages (
-        message_id TEXT PRIMARY KEY, conversation_id TEXT NOT NULL,
-        pinned_by TEXT NOT NULL, pinned_at REAL NOT NULL
-    )""")
-    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
-    if "messages" not in tables:
-        conn.execute("""CREATE TABLE messages (
-            id TEXT PRIMARY KEY, conversation_id TEXT, from_agent TEXT NOT NULL,
-            to_agent TEXT, content TEXT NOT NULL, timestamp REAL NOT NULL, read INTEGER DEFAULT 0
+    with db_pool.write() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS api_keys (
+            key TEXT PRIMARY KEY, agent_id TEXT NOT NULL, created_at REAL NOT NULL
         )""")
-    else:
-        cols = [r[1] for r in conn.execute("PRAGMA table_info(messages)").fetchall()]
-        if "conversation_id" not in cols:
-            conn.execute("ALTER TABLE messages ADD COLUMN conversation_id TEXT")
-        if "edited_at" not in cols:
-            conn.execute("ALTER TABLE messages ADD COLUMN edited_at REAL")
-        if "deleted" not in cols:
-            conn.execute("ALTER TABLE messages ADD COLUMN deleted INTEGER DEFAULT 0")
-        if "reply_to" not in cols:
-            conn.execute("ALTER TABLE messages ADD COLUMN reply_to TEXT")
-    # Full-text search index for messages
-    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
-        content, message_id UNINDEXED, from_agent UNINDEXED, conversation_id UNINDEXED,
-        content_rowid='rowid'
-    )""")
-    conn.commit()
-    conn.close()
+        conn.execute("""CREATE TABLE IF NOT EXISTS conversations (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, type TEXT NOT NULL DEFAULT 'group',
+            created_by TEXT, created_at REAL NOT NULL
+        )""")
+        if "dm_key" not in [r[1] for r in conn.execute("PRAGMA table_info(conversations)").fetchall()]:
+            conn.execute("ALTER TABLE conversations ADD COLUMN dm_key TEXT")
+        conn.execute("""CREATE TABLE IF NOT EXISTS conversation_members (
+            conversation_id TEXT NOT NULL, agent_id TEXT NOT NULL, joined_at REAL NOT NULL,
+            PRIMARY KEY (conversation_id, agent_id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS files (
+            id TEXT PRIMARY KEY, filename TEXT NOT NULL, original_name TEXT NOT NULL,
+            mime_type TEXT, size INTEGER NOT NULL, sha256 TEXT,
+            uploaded_by TEXT NOT NULL, uploaded_at REAL NOT NULL,
+            conversation_id TEXT, message_id TEXT,
+            description TEXT
+        )""")
+        # Projects
+        conn.execute("""CREATE TABLE IF NOT EXISTS projects (
+            id TEXT PRIMARY KEY, name TEXT NOT NULL, description TEXT DEFAULT '',
+            status TEXT DEFAULT 'active', created_by TEXT NOT NULL,
+            created_at REAL NOT NULL, updated_at REAL NOT NULL,
+            tags TEXT DEFAULT '[]'
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS project_members (
+            project_id TEXT NOT NULL, agent_id TEXT NOT NULL, role TEXT DEFAULT 'member',
+            joined_at REAL NOT NULL, PRIMARY KEY (project_id, agent_id)
+        )""")
+        # Milestones
+        conn.execute("""CREATE TABLE IF NOT EXISTS milestones (
+            id TEXT PRIMARY KEY, project_id TEXT NOT NULL, name TEXT NOT NULL,
+            description TEXT DEFAULT '', due_by REAL, status TEXT DEFAULT 'open',
+            created_at REAL NOT NULL,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        )""")
+        # Tasks with project + milestone + dependencies
+        conn.execute("""CREATE TABLE IF NOT EXISTS tasks (
+            id TEXT PRIMARY KEY, title TEXT NOT NULL, description TEXT DEFAULT '',
+            status TEXT DEFAULT 'open', priority TEXT DEFAULT 'normal',
+            created_by TEXT NOT NULL, assigned_to TEXT, claimed_by TEXT,
+            tags TEXT DEFAULT '[]', created_at REAL NOT NULL, updated_at REAL NOT NULL,
+            completed_at REAL, due_by REAL, parent_id TEXT,
+            project_id TEXT, milestone_id TEXT, effort_estimate TEXT,
+            FOREIGN KEY (parent_id) REFERENCES tasks(id),
+            FOREIGN KEY (project_id) REFERENCES projects(id),
+            FOREIGN KEY (milestone_id) REFERENCES milestones(id)
+        )""")
+        # Sort key for the priority-ordered task lists, so an index can serve ORDER BY
+        if "priority_rank" not in [r[1] for r in conn.execute("PRAGMA table_xinfo(tasks)").fetchall()]:
+            conn.execute("""ALTER TABLE tasks ADD COLUMN priority_rank INTEGER GENERATED ALWAYS AS (
+                CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 WHEN 'low' THEN 3 END
+            ) VIRTUAL""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS task_dependencies (
+            task_id TEXT NOT NULL, depends_on TEXT NOT NULL,
+            PRIMARY KEY (task_id, depends_on),
+            FOREIGN KEY (task_id) REFERENCES tasks(id),
+            FOREIGN KEY (depends_on) REFERENCES tasks(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS task_comments (
+            id TEXT PRIMARY KEY, task_id TEXT NOT NULL, agent_name TEXT NOT NULL,
+            content TEXT NOT NULL, created_at REAL NOT NULL,
+            FOREIGN KEY (task_id) REFERENCES tasks(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS task_history (
+            id TEXT PRIMARY KEY, task_id TEXT NOT NULL, agent_name TEXT NOT NULL,
+            action TEXT NOT NULL, details TEXT DEFAULT '', created_at REAL NOT NULL,
+            FOREIGN KEY (task_id) REFERENCES tasks(id)
+        )""")
+        # Task tags, one row per (task, tag) so tag filters are index lookups.
+        # tasks.tags keeps the JSON list that clients read.
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'task_tags'").fetchone():
+            conn.execute("""CREATE TABLE task_tags (
+                task_id TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (task_id, tag),
+                FOREIGN KEY (task_id) REFERENCES tasks(id)
+            )""")
+            conn.execute("""INSERT OR IGNORE INTO task_tags (task_id, tag)
+                SELECT t.id, j.value FROM tasks t, json_each(t.tags) j WHERE json_valid(t.tags)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_task_tags_tag ON task_tags(tag)")
+        # Agent Git — shared repositories
+        conn.execute("""CREATE TABLE IF NOT EXISTS git_repos (
+            id TEXT PRIMARY KEY, name TEXT UNIQUE NOT NULL, description TEXT DEFAULT '',
+            created_by TEXT NOT NULL, created_at REAL NOT NULL,
+            default_branch TEXT DEFAULT 'main', project_id TEXT,
+            FOREIGN KEY (project_id) REFERENCES projects(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS git_commits (
+            id TEXT PRIMARY KEY, repo_id TEXT NOT NULL, branch TEXT DEFAULT 'main',
+            author TEXT NOT NULL, message TEXT NOT NULL, created_at REAL NOT NULL,
+            parent_id TEXT,
+            FOREIGN KEY (repo_id) REFERENCES git_repos(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS git_files (
+            id TEXT PRIMARY KEY, commit_id TEXT NOT NULL, path TEXT NOT NULL,
+            content TEXT, sha256 TEXT, size INTEGER DEFAULT 0,
+            action TEXT DEFAULT 'add',
+            FOREIGN KEY (commit_id) REFERENCES git_commits(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS git_branches (
+            repo_id TEXT NOT NULL, name TEXT NOT NULL, head_commit TEXT,
+            PRIMARY KEY (repo_id, name),
+            FOREIGN KEY (repo_id) REFERENCES git_repos(id)
+        )""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS pending_registrations (
+            id TEXT PRIMARY KEY, agent_name TEXT NOT NULL UNIQUE,
+            description TEXT DEFAULT '', contact TEXT DEFAULT '',
+            status TEXT DEFAULT 'pending',
+            created_at REAL NOT NULL, reviewed_at REAL,
+            reviewed_by TEXT
+        )""")
+        # Agent profiles — bio, status, avatar
+        conn.execute("""CREATE TABLE IF NOT EXISTS agent_profiles (
+            agent_id TEXT PRIMARY KEY, bio TEXT DEFAULT '', status_message TEXT DEFAULT '',
+            avatar_url TEXT DEFAULT '', metadata TEXT DEFAULT '{}', updated_at REAL NOT NULL
+        )""")
+        # Agent presence — heartbeat-based online/offline tracking
+        conn.execute("""CREATE TABLE IF NOT EXISTS agent_presence (
+            agent_id TEXT PRIMARY KEY, status TEXT DEFAULT 'offline',
+            last_heartbeat REAL NOT NULL, last_active REAL, custom_status TEXT DEFAULT ''
+        )""")
+        # Message reactions — emoji on messages
+        conn.execute("""CREATE TABLE IF NOT EXISTS message_reactions (
+            id TEXT PRIMARY KEY, message_id TEXT NOT NULL, agent_id TEXT NOT NULL,
+            emoji TEXT NOT NULL, created_at REAL NOT NULL,
+            UNIQUE(message_id, agent_id, emoji)
+        )""")
+        # Message pins
+        conn.execute("""CREATE TABLE IF NOT EXISTS pinned_messages (
+            message_id TEXT PRIMARY KEY, conversation_id TEXT NOT NULL,
+            pinned_by TEXT NOT NULL, pinned_at REAL NOT NULL
+        )""")
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]
+        if "messages" not in tables:
+            conn.execute("""CREATE TABLE messages (
+                id TEXT PRIMARY KEY, conversation_id TEXT, from_agent TEXT NOT NULL,
+                to_agent TEXT, content TEXT NOT NULL, timestamp REAL NOT NULL, read INTEGER DEFAULT 0,
+                edited_at REAL, deleted INTEGER DEFAULT 0, reply_to TEXT
+            )""")
+        else:
+            cols = [r[1] for r in conn.execute("PRAGMA table_info(messages)").fetchall()]
+            if "conversation_id" not in cols:
+                conn.execute("ALTER TABLE messages ADD COLUMN conversation_id TEXT")
+            if "edited_at" not in cols:
+                conn.execute("ALTER TABLE messages ADD COLUMN edited_at REAL")
+            if "deleted" not in cols:
+                conn.execute("ALTER TABLE messages ADD COLUMN deleted INTEGER DEFAULT 0")
+            if "reply_to" not in cols:
+                conn.execute("ALTER TABLE messages ADD COLUMN reply_to TEXT")
+        # Full-text search index for messages
+        conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            content, message_id UNINDEXED, from_agent UNINDEXED, conversation_id UNINDEXED,
+            content_rowid='rowid'
+        )""")
+        # Indexes for the hot predicates: inbox polling, conversation history,
+        # DM lookup, membership joins and file listings
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_msg_conv_ts ON messages(conversation_id, timestamp DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_msg_unread ON messages(conversation_id, timestamp) WHERE read = 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_msg_pair ON messages(from_agent, to_agent, timestamp)")
+        # /messages/all keyset pages; id breaks timestamp ties
+        conn.execute("DROP INDEX IF EXISTS idx_msg_ts")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_msg_ts_id ON messages(timestamp, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_members_agent ON conversation_members(agent_id, conversation_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_conv ON files(conversation_id, uploaded_at DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_uploader ON files(uploaded_by)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_files_size ON files(size DESC)")  # largest_file in stats
+        conn.execute("DROP INDEX IF EXISTS idx_tasks_status")  # superseded by idx_tasks_status_rank
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_rank ON tasks(status, priority_rank, updated_at DESC)")
+        # Task lookups: subtasks, "my tasks", project/milestone rollups, and a
+        # task's comment/history timelines (already in created_at order)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks(parent_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_created_by ON tasks(created_by, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_assigned ON tasks(assigned_to, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_claimed ON tasks(claimed_by, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_project ON tasks(project_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_milestone ON tasks(milestone_id, status)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_task_comments_task ON task_comments(task_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_task_history_task ON task_history(task_id, created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_git_commits_repo ON git_commits(repo_id, branch, created_at DESC)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_git_commits_author ON git_commits(author)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_git_files_commit ON git_files(commit_id)")
+        # One DM per agent pair. Key DMs that predate dm_key (or carry the old,
+        # ambiguous "dm:a:b" key) from their two members, keeping the oldest
+        # where a pair ended up with duplicates. The key must match _dm_key().
+        conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_conv_dm_key ON conversations(dm_key)")
+        conn.execute("UPDATE conversations SET dm_key = NULL WHERE dm_key LIKE 'dm:%'")
+        conn.execute("""
+            WITH pairs AS (
+                SELECT c.id, c.created_at, json_array(MIN(m.agent_id), MAX(m.agent_id)) AS k
+                FROM conversations c JOIN conversation_members m ON m.conversation_id = c.id
+                WHERE c.type = 'dm' AND c.dm_key IS NULL GROUP BY c.id HAVING COUNT(*) = 2
+            ), firsts AS (
+                SELECT id, k FROM (
+                    SELECT id, k, ROW_NUMBER() OVER (PARTITION BY k ORDER BY created_at) AS rn FROM pairs
+                ) WHERE rn = 1 AND k NOT IN (SELECT dm_key FROM conversations WHERE dm_key IS NOT NULL)
+            )
+            UPDATE conversations SET dm_key = (SELECT k FROM firsts WHERE firsts.id = conversations.id)
+            WHERE id IN (SELECT id FROM firsts)""")
+        try:
+            conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_api_keys_agent ON api_keys(agent_id)")
+        except sqlite3.IntegrityError:
+            print("[agent-bridge] WARNING: duplicate agent_id rows in api_keys; unique index not created")
+        # Per-uploader file totals kept current by triggers so stats don't rescan files
+        conn.execute("""CREATE TABLE IF NOT EXISTS file_stats (
+            agent_id TEXT PRIMARY KEY, file_count INTEGER NOT NULL DEFAULT 0, total_size INTEGER NOT NULL DEFAULT 0
+        )""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS files_stats_ai AFTER INSERT ON files BEGIN
+            INSERT INTO file_stats (agent_id, file_count, total_size) VALUES (NEW.uploaded_by, 1, NEW.size)
+            ON CONFLICT(agent_id) DO UPDATE SET file_count = file_count + 1, total_size = total_size + NEW.size;
+        END""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS files_stats_ad AFTER DELETE ON files BEGIN
+            UPDATE file_stats SET file_count = file_count - 1, total_size = total_size - OLD.size
+            WHERE agent_id = OLD.uploaded_by;
+            DELETE FROM file_stats WHERE agent_id = OLD.uploaded_by AND file_count <= 0;
+        END""")
+        # Rebuild once at startup so totals are right for pre-existing rows
+        conn.execute("DELETE FROM file_stats")
+        conn.execute("""INSERT INTO file_stats (agent_id, file_count, total_size)
+            SELECT uploaded_by, COUNT(*), COALESCE(SUM(size), 0) FROM files GROUP BY uploaded_by""")
+        # Message totals for /stats and /status, same scheme: COUNT(*) on messages is a full scan
+        conn.execute("""CREATE TABLE IF NOT EXISTS counters (
+            name TEXT PRIMARY KEY, value INTEGER NOT NULL DEFAULT 0
+        )""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_counters_ai AFTER INSERT ON messages BEGIN
+            UPDATE counters SET value = value + 1 WHERE name = 'messages';
+            UPDATE counters SET value = value + 1 WHERE name = 'unread_messages' AND NEW.read = 0;
+        END""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_counters_ad AFTER DELETE ON messages BEGIN
+            UPDATE counters SET value = value - 1 WHERE name = 'messages';
+            UPDATE counters SET value = value - 1 WHERE name = 'unread_messages' AND OLD.read = 0;
+        END""")
+        conn.execute("""CREATE TRIGGER IF NOT EXISTS messages_counters_au AFTER UPDATE OF read ON messages
+            WHEN (OLD.read = 0) != (NEW.read = 0) BEGIN
+            UPDATE counters SET value = value + (NEW.read = 0) - (OLD.read = 0) WHERE name = 'unread_messages';
+        END""")
+        conn.execute("DELETE FROM counters")
+        conn.execute("""INSERT INTO counters (name, value)
+            SELECT 'messages', COUNT(*) FROM messages
+            UNION ALL SELECT 'unread_messages', COUNT(*) FROM messages WHERE read = 0""")
+        conn.commit()
+        # The planner only prefers these indexes over a scan once it has stats.
+        # Full ANALYZE the first time; afterwards optimize re-analyzes only what changed.
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            conn.execute("PRAGMA optimize")
+        else:
+            conn.execute("ANALYZE")
+
+# DM ids are derived from the sorted agent pair, so the same two agents always
+# map to the same conversation id without a lookup. The pair is encoded as a
+# JSON array (identical to SQLite's json_array) so ids containing separators
+# can't collide: ("x:y", "z") and ("x", "y:z") get different keys.
+DM_NAMESPACE = uuid.UUID("4dcb58a3-5285-43a4-b679-1c99608f3aec")
+
+def _dm_key(a: str, b: str) -> str:
+    return json.dumps([a, b], separators=(",", ":"), ensure_ascii=False)
+
+def _dm_id(a: str, b: str) -> str:
+    return str(uuid.uuid5(DM_NAMESPACE, _dm_key(a, b)))
+
+def find_or_create_dm(conn, agent_a: str, agent_b: str) -> str:
+    a, b = sorted([agent_a, agent_b])
+    key = _dm_key(a, b)
+    now = time.time()
+    # dm_key is UNIQUE: either this creates the DM, or it already exists
+    # (legacy random-id DMs included) and we look it up
+    row = conn.execute("""INSERT INTO conversations (id, name, type, created_by, created_at, dm_key)
+        VALUES (?, ?, 'dm', ?, ?, ?) ON CONFLICT(dm_key) DO NOTHING RETURNING id""",
+        (_dm_id(a, b), f"{a} ↔ {b}", agent_a, now, key)).fetchone()
+    if row is None:
+        # Existing DM: leave membership alone so an agent who left stays out
+        return conn.execute("SELECT id FROM conversations WHERE dm_key = ?", (key,)).fetchone()[0]
+    cid = row[0]
+    # OR IGNORE covers a == b (DM with yourself)
+    conn.executemany("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", [(cid, a, now), (cid, b, now)])
+    return cid
 
 def migrate_legacy():
     """Create DM conversations for legacy point-to-point messages."""
-    conn = get_db()
-    orphans = conn.execute(
-        "SELECT DISTINCT from_agent, to_agent FROM messages WHERE conversation_id IS NULL AND to_agent IS NOT NULL"
-    ).fetchall()
-    for row in orphans:
-        a, b = sorted([row["from_agent"], row["to_agent"]])
-        dm = conn.execute("""
-            SELECT c.id FROM conversations c
-            JOIN conversation_members m1 ON c.id = m1.conversation_id AND m1.agent_id = ?
-            JOIN conversation_members m2 ON c.id = m2.conversation_id AND m2.agent_id = ?
-            WHERE c.type = 'dm'
-        """, (a, b)).fetchone()
-        if dm:
-            cid = dm["id"]
-        else:
-            cid = str(uuid.uuid4())
-            now = time.time()
-            conn.execute("INSERT INTO conversations (id, name, type, created_at) VALUES (?, ?, 'dm', ?)",
-                         (cid, f"{a} ↔ {b}", now))
-            for agent in (a, b):
-                conn.execute("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", (cid, agent, now))
+    with db_pool.write() as conn:
+        orphans = conn.execute(
+            "SELECT DISTINCT from_agent, to_agent FROM messages WHERE conversation_id IS NULL AND to_agent IS NOT NULL"
+        ).fetchall()
+        if not orphans:
+            return
+        # One transaction for the whole migration. Each pair's DM is resolved
+        # once so (a, b) and (b, a) orphans share it, then a single set-based
+        # UPDATE joins every orphan to its DM through a temp pair table.
+        conn.execute("BEGIN IMMEDIATE")
+        created = {}
+        for row in orphans:
+            pair = tuple(sorted([row["from_agent"], row["to_agent"]]))
+            if pair not in created:
+                created[pair] = find_or_create_dm(conn, *pair)
+        conn.execute("CREATE TEMP TABLE pair_to_conv (a TEXT, b TEXT, cid TEXT, PRIMARY KEY (a, b))")
+        conn.executemany("INSERT INTO pair_to_conv VALUES (?, ?, ?)", [(a, b, cid) for (a, b), cid in created.items()])
         conn.execute("""
-            UPDATE messages SET conversation_id = ?
-            WHERE conversation_id IS NULL
-            AND ((from_agent = ? AND to_agent = ?) OR (from_agent = ? AND to_agent = ?))
-        """, (cid, row["from_agent"], row["to_agent"], row["to_agent"], row["from_agent"]))
-    conn.commit()
-    conn.close()
+            UPDATE messages SET conversation_id = p.cid FROM pair_to_conv p
+            WHERE messages.conversation_id IS NULL AND messages.to_agent IS NOT NULL
+            AND p.a = min(messages.from_agent, messages.to_agent) AND p.b = max(messages.from_agent, messages.to_agent)
+        """)
+        conn.execute("DROP TABLE temp.pair_to_conv")
+        conn.commit()
 
 init_db()
 migrate_legacy()
 
 # ── Auth ─────────────────────────────────────────────
 
-def get_agent_id(x_api_key: str = Header(...)):
-    conn = get_db()
-    row = conn.execute("SELECT agent_id FROM api_keys WHERE key = ?", (x_api_key,)).fetchone()
-    conn.close()
+# API key -> (agent_id, expires_at). Keys are never rotated or deleted, so a hit
+# only needs a TTL as a safety net; misses aren't cached so new keys work at once.
+KEY_CACHE_TTL = 60
+_key_cache: dict = {}
+
+def _lookup_agent(api_key: str) -> Optional[str]:
+    now = time.monotonic()
+    hit = _key_cache.get(api_key)
+    if hit and hit[1] > now:
+        return hit[0]
+    with db_pool.read() as conn:
+        row = conn.execute("SELECT agent_id FROM api_keys WHERE key = ?", (api_key,)).fetchone()
     if not row:
-        raise HTTPException(401, "Invalid API key")
+        return None
+    if len(_key_cache) > 1024:
+        _key_cache.clear()
+    _key_cache[api_key] = (row["agent_id"], now + KEY_CACHE_TTL)
     return row["agent_id"]
 
+def get_agent_id(x_api_key: str = Header(...)):
+    agent = _lookup_agent(x_api_key)
+    if not agent:
+        raise HTTPException(401, "Invalid API key")
+    return agent
+
 def optional_agent_id(x_api_key: str = Header(None)):
     """Like get_agent_id but returns None if no key provided (for public read-only endpoints)."""
     if not x_api_key:
         return None
-    conn = get_db()
-    row = conn.execute("SELECT agent_id FROM api_keys WHERE key = ?", (x_api_key,)).fetchone()
-    conn.close()
-    return row["agent_id"] if row else None
-
-def find_or_create_dm(conn, agent_a: str, agent_b: str) -> str:
-    a, b = sorted([agent_a, agent_b])
-    dm = conn.execute("""
-        SELECT c.id FROM conversations c
-        JOIN conversation_members m1 ON c.id = m1.conversation_id AND m1.agent_id = ?
-        JOIN conversation_members m2 ON c.id = m2.conversation_id AND m2.agent_id = ?
-        WHERE c.type = 'dm'
-    """, (a, b)).fetchone()
-    if dm:
-        return dm["id"]
-    cid = str(uuid.uuid4())
-    now = time.time()
-    conn.execute("INSERT INTO conversations (id, name, type, created_by, created_at) VALUES (?, ?, 'dm', ?, ?)",
-                 (cid, f"{a} ↔ {b}", agent_a, now))
-    for agent in (a, b):
-        conn.execute("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", (cid, agent, now))
-    return cid
+    return _lookup_agent(x_api_key)
 
 # ── Models ───────────────────────────────────────────
 
@@ -390,20 +713,43 @@ class ReplyMessage(BaseModel):
     content: str
     reply_to: str  # message ID being replied to
 
-# ── Helpers ──────────────────────────────────────────
+class MarkReadBatch(BaseModel):
+    ids: List[str]
 
-def get_files_stats_data():
-    """Compute file storage stats from disk + DB."""
-    conn = get_db()
-    total_files = conn.execute("SELECT COUNT(*) as c FROM files").fetchone()["c"]
-    total_size = conn.execute("SELECT COALESCE(SUM(size), 0) as s FROM files").fetchone()["s"]
-    largest = conn.execute("SELECT original_name, size, uploaded_by FROM files ORDER BY size DESC LIMIT 1").fetchone()
-    by_agent = conn.execute(
-        "SELECT uploaded_by, COUNT(*) as file_count, COALESCE(SUM(size), 0) as total_size FROM files GROUP BY uploaded_by"
-    ).fetchall()
-    conn.close()
+# ── Helpers ──────────────────────────────────────────
 
-    # Disk usage of the files directory
+def _new_id() -> str:
+    """Random UUID4 string, same format as str(uuid.uuid4()) without building a UUID object."""
+    h = os.urandom(16).hex()
+    return f"{h[:8]}-{h[8:12]}-4{h[13:16]}-{'89ab'[int(h[16], 16) & 3]}{h[17:20]}-{h[20:]}"
+
+_ttl_store: dict = {}  # function qualname -> (expires_at, value)
+_ttl_lock = threading.Lock()
+
+def ttl_cache(seconds: float):
+    """Memoize a no-argument function for `seconds`. Concurrent misses may both compute; either result is fine."""
+    def decorator(fn):
+        key = fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper():
+            now = time.monotonic()
+            with _ttl_lock:
+                hit = _ttl_store.get(key)
+            if hit and hit[0] > now:
+                return hit[1]
+            value = fn()
+            with _ttl_lock:
+                _ttl_store[key] = (now + seconds, value)
+            return value
+
+        wrapper.cache_clear = lambda: _ttl_store.pop(key, None)
+        return wrapper
+    return decorator
+
+@ttl_cache(seconds=5)
+def _disk_info() -> dict:
+    """Disk usage of the files directory."""
     try:
         disk = shutil.disk_usage(FILES_DIR)
         disk_info = {
@@ -414,6 +760,18 @@ def get_files_stats_data():
         }
     except OSError:
         disk_info = {"error": "Could not read disk usage"}
+    return disk_info
+
+@ttl_cache(seconds=5)
+def get_files_stats_data():
+    """Compute file storage stats from the file_stats totals + disk."""
+    with db_pool.read() as conn:
+        by_agent = conn.execute(
+            "SELECT agent_id as uploaded_by, file_count, total_size FROM file_stats"
+        ).fetchall()
+        largest = conn.execute("SELECT original_name, size, uploaded_by FROM files ORDER BY size DESC LIMIT 1").fetchone()
+    total_files = sum(r["file_count"] for r in by_agent)
+    total_size = sum(r["total_size"] for r in by_agent)
 
     return {
         "total_files": total_files,
@@ -421,15 +779,15 @@ def get_files_stats_data():
         "total_size_human": _human_size(total_size),
         "largest_file": dict(largest) if largest else None,
         "files_by_agent": [dict(r) for r in by_agent],
-        "disk": disk_info,
+        "disk": _disk_info(),
     }
 
+_SIZE_UNITS = ("B", "KB", "MB", "GB", "TB")
+
 def _human_size(b: int) -> str:
-    for unit in ("B", "KB", "MB", "GB"):
-        if b < 1024:
-            return f"{b:.1f} {unit}"
-        b /= 1024
-    return f"{b:.1f} TB"
+    # The unit index is just the number of whole 10-bit groups in b
+    i = min(len(_SIZE_UNITS) - 1, max(0, (int(b).bit_length() - 1) // 10))
+    return f"{b / (1 << (10 * i)):.1f} {_SIZE_UNITS[i]}"
 
 # ── Root & Status ─────────────────────────────────────
 
@@ -445,202 +803,219 @@ def root():
         "external_url": "https://claudiusthebot.duckdns.org/bridge",
     }
 
+@ttl_cache(seconds=5)
+def _status_counts() -> dict:
+    """DB aggregates for /status; monitoring polls this, so a few seconds stale is fine."""
+    with db_pool.read() as conn:
+        # Message totals come from the trigger-maintained counters table
+        c = conn.execute("""SELECT
+            (SELECT value FROM counters WHERE name = 'messages') AS total_msgs,
+            (SELECT value FROM counters WHERE name = 'unread_messages') AS unread_msgs,
+            (SELECT COUNT(*) FROM api_keys) AS agent_count,
+            (SELECT COUNT(*) FROM conversations) AS conv_count""").fetchone()
+        # Task stats: one pass over tasks
+        t = conn.execute("""SELECT COUNT(*) AS total,
+            COALESCE(SUM(status = 'open'), 0) AS open,
+            COALESCE(SUM(status = 'in_progress'), 0) AS in_progress,
+            COALESCE(SUM(status = 'done'), 0) AS done
+            FROM tasks""").fetchone()
+
+    counts = {
+        "messages": {
+            "total": c["total_msgs"],
+            "unread": c["unread_msgs"],
+        },
+        "conversations": c["conv_count"],
+        "agents_registered": c["agent_count"],
+        "files": get_files_stats_data(),
+        "tasks": dict(t),
+    }
+    return counts
+
 @app.get("/status")
 def server_status():
     """Server health: version, uptime, message counts, file storage stats."""
-    conn = get_db()
-    total_msgs = conn.execute("SELECT COUNT(*) as c FROM messages").fetchone()["c"]
-    unread_msgs = conn.execute("SELECT COUNT(*) as c FROM messages WHERE read = 0").fetchone()["c"]
-    agent_count = conn.execute("SELECT COUNT(*) as c FROM api_keys").fetchone()["c"]
-    conv_count = conn.execute("SELECT COUNT(*) as c FROM conversations").fetchone()["c"]
-
-    uptime_secs = time.time() - SERVER_START_TIME
-    uptime_h = int(uptime_secs // 3600)
-    uptime_m = int((uptime_secs % 3600) // 60)
-
-    # Task stats
-    task_total = conn.execute("SELECT COUNT(*) as c FROM tasks").fetchone()["c"]
-    task_open = conn.execute("SELECT COUNT(*) as c FROM tasks WHERE status = 'open'").fetchone()["c"]
-    task_in_progress = conn.execute("SELECT COUNT(*) as c FROM tasks WHERE status = 'in_progress'").fetchone()["c"]
-    task_done = conn.execute("SELECT COUNT(*) as c FROM tasks WHERE status = 'done'").fetchone()["c"]
-    conn.close()
+    uptime_secs = time.monotonic() - SERVER_START_MONO
+    uptime_h, rem = divmod(int(uptime_secs), 3600)
 
     return {
         "ok": True,
         "version": VERSION,
         "uptime_seconds": round(uptime_secs),
-        "uptime_human": f"{uptime_h}h {uptime_m}m",
+        "uptime_human": f"{uptime_h}h {rem // 60}m",
         "started_at": SERVER_START_TIME,
-        "messages": {
-            "total": total_msgs,
-            "unread": unread_msgs,
-        },
-        "conversations": conv_count,
-        "agents_registered": agent_count,
-        "files": get_files_stats_data(),
-        "tasks": {
-            "total": task_total,
-            "open": task_open,
-            "in_progress": task_in_progress,
-            "done": task_done,
-        },
+        **_status_counts(),
     }
 
 # ── Conversations API (authenticated) ────────────────
 
+# Shared SQL text for the hottest lookups. sqlite3 caches compiled statements
+# per connection keyed by the SQL string, so every call site using the same
+# constant reuses one prepared statement on a pooled connection.
+Q_IS_MEMBER = "SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?"
+
 @app.post("/conversations")
 def create_conversation(req: ConvCreate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    cid = str(uuid.uuid4())
-    now = time.time()
-    conn.execute("INSERT INTO conversations VALUES (?, ?, 'group', ?, ?)", (cid, req.name, agent_id, now))
-    conn.execute("INSERT INTO conversation_members VALUES (?, ?, ?)", (cid, agent_id, now))
-    for m in (req.members or []):
-        if m != agent_id:
-            conn.execute("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", (cid, m, now))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        cid = _new_id()
+        now = time.time()
+        conn.execute("INSERT INTO conversations (id, name, type, created_by, created_at) VALUES (?, ?, 'group', ?, ?)",
+                     (cid, req.name, agent_id, now))
+        conn.execute("INSERT INTO conversation_members VALUES (?, ?, ?)", (cid, agent_id, now))
+        conn.executemany("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)",
+                         [(cid, m, now) for m in (req.members or []) if m != agent_id])
     return {"ok": True, "id": cid, "name": req.name}
 
 @app.get("/conversations")
 def list_my_conversations(agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    rows = conn.execute("""
-        SELECT c.*, (SELECT COUNT(*) FROM conversation_members WHERE conversation_id = c.id) as member_count,
-            (SELECT COUNT(*) FROM messages WHERE conversation_id = c.id) as message_count
-        FROM conversations c
-        JOIN conversation_members cm ON c.id = cm.conversation_id AND cm.agent_id = ?
-        ORDER BY (SELECT MAX(timestamp) FROM messages WHERE conversation_id = c.id) DESC NULLS LAST
-    """, (agent_id,)).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        # Aggregate members/messages once per table (restricted to this agent's
+        # conversations) instead of three correlated subqueries per row
+        rows = conn.execute("""
+            WITH mine AS (
+                SELECT conversation_id FROM conversation_members WHERE agent_id = ?
+            ), mc AS (
+                SELECT conversation_id, COUNT(*) AS cnt FROM conversation_members
+                WHERE conversation_id IN mine GROUP BY conversation_id
+            ), ms AS (
+                SELECT conversation_id, COUNT(*) AS cnt, MAX(timestamp) AS last_ts FROM messages
+                WHERE conversation_id IN mine GROUP BY conversation_id
+            )
+            SELECT c.*, COALESCE(mc.cnt, 0) as member_count, COALESCE(ms.cnt, 0) as message_count
+            FROM conversations c
+            JOIN mine ON c.id = mine.conversation_id
+            LEFT JOIN mc ON mc.conversation_id = c.id
+            LEFT JOIN ms ON ms.conversation_id = c.id
+            ORDER BY ms.last_ts DESC NULLS LAST
+        """, (agent_id,)).fetchall()
     return [dict(r) for r in rows]
 
 @app.get("/conversations/{conv_id}")
 def get_conversation(conv_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
-    if not conv:
-        raise HTTPException(404, "Not found")
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        raise HTTPException(403, "Not a member")
-    members = [dict(m) for m in conn.execute(
-        "SELECT agent_id, joined_at FROM conversation_members WHERE conversation_id = ?", (conv_id,)).fetchall()]
-    conn.close()
+    with db_pool.read() as conn:
+        conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+        if not conv:
+            raise HTTPException(404, "Not found")
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        members = [dict(m) for m in conn.execute(
+            "SELECT agent_id, joined_at FROM conversation_members WHERE conversation_id = ?", (conv_id,)).fetchall()]
     return {**dict(conv), "members": members}
 
 @app.post("/conversations/{conv_id}/send")
 def send_to_conv(conv_id: str, msg: ConvMessage, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone():
-        raise HTTPException(404, "Not found")
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        raise HTTPException(403, "Not a member")
-    mid = str(uuid.uuid4())
-    ts = time.time()
-    conn.execute("INSERT INTO messages (id, conversation_id, from_agent, content, timestamp) VALUES (?, ?, ?, ?, ?)",
-                 (mid, conv_id, agent_id, msg.content, ts))
-    # Index for full-text search
-    try:
-        conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
-                     (msg.content, mid, agent_id, conv_id))
-    except Exception:
-        pass  # FTS indexing is best-effort
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone():
+            raise HTTPException(404, "Not found")
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        mid = _new_id()
+        ts = time.time()
+        conn.execute("INSERT INTO messages (id, conversation_id, from_agent, content, timestamp) VALUES (?, ?, ?, ?, ?)",
+                     (mid, conv_id, agent_id, msg.content, ts))
+        # Index for full-text search
+        try:
+            conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
+                         (msg.content, mid, agent_id, conv_id))
+        except Exception:
+            pass  # FTS indexing is best-effort
+        _update_presence(conn, agent_id)
     sse_publish("message", {"id": mid, "conversation_id": conv_id, "from": agent_id, "content": msg.content, "timestamp": ts})
     return {"ok": True, "id": mid}
 
 @app.get("/conversations/{conv_id}/messages")
 def get_conv_messages(conv_id: str, limit: int = 100, before: Optional[float] = None,
                       agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        raise HTTPException(403, "Not a member")
-    if before:
-        rows = conn.execute("SELECT * FROM messages WHERE conversation_id = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT ?",
-                            (conv_id, before, limit)).fetchall()
-    else:
-        rows = conn.execute("SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT ?",
-                            (conv_id, limit)).fetchall()
-    conn.close()
-    return [dict(r) for r in reversed(rows)]
+    with db_pool.read() as conn:
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        if before:
+            rows = _fetch_dicts(conn.execute("SELECT * FROM messages WHERE conversation_id = ? AND timestamp < ? ORDER BY timestamp DESC LIMIT ?",
+                                             (conv_id, before, limit)))
+        else:
+            rows = _fetch_dicts(conn.execute("SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT ?",
+                                             (conv_id, limit)))
+    rows.reverse()
+    return rows
 
 @app.post("/conversations/{conv_id}/invite")
 def invite_agent(conv_id: str, req: InviteReq, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
-    if not conv:
-        raise HTTPException(404, "Not found")
-    if conv["type"] == "dm":
-        raise HTTPException(400, "Cannot invite to DM")
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        raise HTTPException(403, "Not a member")
-    conn.execute("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", (conv_id, req.agent_id, time.time()))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+        if not conv:
+            raise HTTPException(404, "Not found")
+        if conv["type"] == "dm":
+            raise HTTPException(400, "Cannot invite to DM")
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        conn.execute("INSERT OR IGNORE INTO conversation_members VALUES (?, ?, ?)", (conv_id, req.agent_id, time.time()))
     return {"ok": True}
 
 @app.post("/conversations/{conv_id}/leave")
 def leave_conv(conv_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    conn.execute("DELETE FROM conversation_members WHERE conversation_id = ? AND agent_id = ?", (conv_id, agent_id))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        conn.execute("DELETE FROM conversation_members WHERE conversation_id = ? AND agent_id = ?", (conv_id, agent_id))
     return {"ok": True}
 
 # ── Legacy DM API (backward compatible) ──────────────
 
 @app.post("/send")
 def send_dm(msg: SendMessage, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    conv_id = find_or_create_dm(conn, agent_id, msg.to)
-    mid = str(uuid.uuid4())
-    ts = time.time()
-    conn.execute("INSERT INTO messages (id, conversation_id, from_agent, to_agent, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
-                 (mid, conv_id, agent_id, msg.to, msg.content, ts))
-    # Index for full-text search
-    try:
-        conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
-                     (msg.content, mid, agent_id, conv_id))
-    except Exception:
-        pass
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        conv_id = find_or_create_dm(conn, agent_id, msg.to)
+        mid = _new_id()
+        ts = time.time()
+        conn.execute("INSERT INTO messages (id, conversation_id, from_agent, to_agent, content, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                     (mid, conv_id, agent_id, msg.to, msg.content, ts))
+        # Index for full-text search
+        try:
+            conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
+                         (msg.content, mid, agent_id, conv_id))
+        except Exception:
+            pass
+        _update_presence(conn, agent_id)
     sse_publish("message", {"id": mid, "conversation_id": conv_id, "from": agent_id, "to": msg.to, "content": msg.content, "timestamp": ts})
     return {"ok": True, "id": mid, "conversation_id": conv_id, "from": agent_id, "to": msg.to}
 
+Q_INBOX_NOSINCE = """SELECT m.* FROM messages m
+    JOIN conversation_members cm ON m.conversation_id = cm.conversation_id AND cm.agent_id = ?
+    WHERE m.from_agent != ? AND m.read = 0
+    ORDER BY m.timestamp ASC LIMIT ?"""
+Q_INBOX_SINCE = """SELECT m.* FROM messages m
+    JOIN conversation_members cm ON m.conversation_id = cm.conversation_id AND cm.agent_id = ?
+    WHERE m.from_agent != ? AND m.read = 0 AND m.timestamp > ?
+    ORDER BY m.timestamp ASC LIMIT ?"""
+
 @app.get("/inbox")
 def get_inbox(since: Optional[float] = None, limit: int = 50, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    q = """SELECT m.* FROM messages m
-           JOIN conversation_members cm ON m.conversation_id = cm.conversation_id AND cm.agent_id = ?
-           WHERE m.from_agent != ? AND m.read = 0"""
-    params: list = [agent_id, agent_id]
-    if since:
-        q += " AND m.timestamp > ?"
-        params.append(since)
-    q += " ORDER BY m.timestamp ASC LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(q, params).fetchall()
-    conn.close()
-    return {"agent": agent_id, "count": len(rows), "messages": [dict(r) for r in rows]}
+    with db_pool.read() as conn:
+        if since:
+            rows = _fetch_dicts(conn.execute(Q_INBOX_SINCE, (agent_id, agent_id, since, limit)))
+        else:
+            rows = _fetch_dicts(conn.execute(Q_INBOX_NOSINCE, (agent_id, agent_id, limit)))
+    return {"agent": agent_id, "count": len(rows), "messages": rows}
 
 @app.post("/inbox/{msg_id}/read")
 def mark_read(msg_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    r = conn.execute("UPDATE messages SET read = 1 WHERE id = ?", (msg_id,))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        r = conn.execute("UPDATE messages SET read = 1 WHERE id = ?", (msg_id,))
     if r.rowcount == 0:
         raise HTTPException(404, "Not found")
     return {"ok": True}
 
+@app.post("/inbox/read")
+def mark_read_batch(req: MarkReadBatch, agent_id: str = Depends(get_agent_id)):
+    """Mark several messages read in one transaction. Only messages in the caller's conversations are touched."""
+    if not req.ids:
+        return {"ok": True, "updated": 0}
+    with db_pool.transaction() as conn:
+        # ids travel as one JSON parameter: a single cached statement and no bound-variable limit
+        r = conn.execute("""UPDATE messages SET read = 1
+            WHERE id IN (SELECT value FROM json_each(?)) AND read = 0 AND from_agent != ?
+            AND conversation_id IN (SELECT conversation_id FROM conversation_members WHERE agent_id = ?)""",
+            (json.dumps(req.ids), agent_id, agent_id))
+    return {"ok": True, "updated": r.rowcount}
+
 # ── Presence Helper ────────────────────────────────────
 
 PRESENCE_TIMEOUT = 300  # 5 minutes without heartbeat = offline
@@ -672,31 +1047,25 @@ def _enrich_message(msg_dict: dict, conn) -> dict:
 @app.post("/inbox/read-all")
 def mark_all_read(agent_id: str = Depends(get_agent_id)):
     """Mark all unread messages as read for this agent."""
-    conn = get_db()
-    result = conn.execute("""UPDATE messages SET read = 1
-        WHERE id IN (
-            SELECT m.id FROM messages m
-            JOIN conversation_members cm ON m.conversation_id = cm.conversation_id AND cm.agent_id = ?
-            WHERE m.from_agent != ? AND m.read = 0
-        )""", (agent_id, agent_id))
-    count = result.rowcount
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        result = conn.execute("""UPDATE messages SET read = 1
+            WHERE id IN (
+                SELECT m.id FROM messages m
+                JOIN conversation_members cm ON m.conversation_id = cm.conversation_id AND cm.agent_id = ?
+                WHERE m.from_agent != ? AND m.read = 0
+            )""", (agent_id, agent_id))
+        count = result.rowcount
     return {"ok": True, "marked_read": count}
 
 @app.post("/conversations/{conv_id}/read-all")
 def mark_conv_read(conv_id: str, agent_id: str = Depends(get_agent_id)):
     """Mark all unread messages in a conversation as read."""
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        conn.close()
-        raise HTTPException(403, "Not a member")
-    result = conn.execute("UPDATE messages SET read = 1 WHERE conversation_id = ? AND from_agent != ? AND read = 0",
-                          (conv_id, agent_id))
-    count = result.rowcount
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        result = conn.execute("UPDATE messages SET read = 1 WHERE conversation_id = ? AND from_agent != ? AND read = 0",
+                              (conv_id, agent_id))
+        count = result.rowcount
     return {"ok": True, "marked_read": count}
 
 # ── Message Search ────────────────────────────────────
@@ -710,56 +1079,55 @@ def search_messages(
     agent_id: str = Depends(get_agent_id)
 ):
     """Full-text search across messages. Searches content using FTS5."""
-    conn = get_db()
-    _update_presence(conn, agent_id)
+    with db_pool.transaction() as conn:
+        _update_presence(conn, agent_id)
+
+    with db_pool.read() as conn:
+        # Try FTS search first, fall back to LIKE
+        try:
+            fts_query = "SELECT message_id, snippet(messages_fts, 0, '>>>', '<<<', '...', 40) as snippet FROM messages_fts WHERE content MATCH ?"
+            fts_params = [q]
+            if conversation_id:
+                fts_query += " AND conversation_id = ?"
+                fts_params.append(conversation_id)
+            if from_agent:
+                fts_query += " AND from_agent = ?"
+                fts_params.append(from_agent)
+            fts_query += " ORDER BY rank LIMIT ?"
+            fts_params.append(limit)
+            fts_rows = conn.execute(fts_query, fts_params).fetchall()
+            msg_ids = [r["message_id"] for r in fts_rows]
+            snippets = {r["message_id"]: r["snippet"] for r in fts_rows}
+        except Exception:
+            # Fallback to LIKE search
+            like_query = "SELECT id FROM messages WHERE content LIKE ? AND deleted = 0"
+            like_params = [f"%{q}%"]
+            if conversation_id:
+                like_query += " AND conversation_id = ?"
+                like_params.append(conversation_id)
+            if from_agent:
+                like_query += " AND from_agent = ?"
+                like_params.append(from_agent)
+            like_query += " ORDER BY timestamp DESC LIMIT ?"
+            like_params.append(limit)
+            rows = conn.execute(like_query, like_params).fetchall()
+            msg_ids = [r["id"] for r in rows]
+            snippets = {}
+
+        if not msg_ids:
+            return {"results": [], "count": 0, "query": q}
+
+        # Fetch full messages for results
+        placeholders = ",".join("?" * len(msg_ids))
+        messages = conn.execute(f"SELECT * FROM messages WHERE id IN ({placeholders}) ORDER BY timestamp DESC", msg_ids).fetchall()
+
+        results = []
+        for m in messages:
+            d = dict(m)
+            d["snippet"] = snippets.get(m["id"], "")
+            d = _enrich_message(d, conn)
+            results.append(d)
 
-    # Try FTS search first, fall back to LIKE
-    try:
-        fts_query = "SELECT message_id, snippet(messages_fts, 0, '>>>', '<<<', '...', 40) as snippet FROM messages_fts WHERE content MATCH ?"
-        fts_params = [q]
-        if conversation_id:
-            fts_query += " AND conversation_id = ?"
-            fts_params.append(conversation_id)
-        if from_agent:
-            fts_query += " AND from_agent = ?"
-            fts_params.append(from_agent)
-        fts_query += " ORDER BY rank LIMIT ?"
-        fts_params.append(limit)
-        fts_rows = conn.execute(fts_query, fts_params).fetchall()
-        msg_ids = [r["message_id"] for r in fts_rows]
-        snippets = {r["message_id"]: r["snippet"] for r in fts_rows}
-    except Exception:
-        # Fallback to LIKE search
-        like_query = "SELECT id FROM messages WHERE content LIKE ? AND deleted = 0"
-        like_params = [f"%{q}%"]
-        if conversation_id:
-            like_query += " AND conversation_id = ?"
-            like_params.append(conversation_id)
-        if from_agent:
-            like_query += " AND from_agent = ?"
-            like_params.append(from_agent)
-        like_query += " ORDER BY timestamp DESC LIMIT ?"
-        like_params.append(limit)
-        rows = conn.execute(like_query, like_params).fetchall()
-        msg_ids = [r["id"] for r in rows]
-        snippets = {}
-
-    if not msg_ids:
-        conn.close()
-        return {"results": [], "count": 0, "query": q}
-
-    # Fetch full messages for results
-    placeholders = ",".join("?" * len(msg_ids))
-    messages = conn.execute(f"SELECT * FROM messages WHERE id IN ({placeholders}) ORDER BY timestamp DESC", msg_ids).fetchall()
-
-    results = []
-    for m in messages:
-        d = dict(m)
-        d["snippet"] = snippets.get(m["id"], "")
-        d = _enrich_message(d, conn)
-        results.append(d)
-
-    conn.close()
     return {"results": results, "count": len(results), "query": q}
 
 # ── Message Reactions ─────────────────────────────────
@@ -769,47 +1137,38 @@ def add_reaction(msg_id: str, body: ReactionCreate, agent_id: str = Depends(get_
     """Add an emoji reaction to a message."""
     if len(body.emoji) > 32:
         raise HTTPException(400, "Emoji too long")
-    conn = get_db()
-    msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
-    if not msg:
-        conn.close()
-        raise HTTPException(404, "Message not found")
-    rid = str(uuid.uuid4())
-    try:
-        conn.execute("INSERT INTO message_reactions (id, message_id, agent_id, emoji, created_at) VALUES (?,?,?,?,?)",
-                     (rid, msg_id, agent_id, body.emoji, time.time()))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise HTTPException(409, "Already reacted with this emoji")
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        if not msg:
+            raise HTTPException(404, "Message not found")
+        rid = _new_id()
+        try:
+            conn.execute("INSERT INTO message_reactions (id, message_id, agent_id, emoji, created_at) VALUES (?,?,?,?,?)",
+                         (rid, msg_id, agent_id, body.emoji, time.time()))
+        except sqlite3.IntegrityError:
+            raise HTTPException(409, "Already reacted with this emoji")
+        _update_presence(conn, agent_id)
     sse_publish("reaction", {"message_id": msg_id, "agent": agent_id, "emoji": body.emoji, "action": "add"})
     return {"ok": True, "reaction_id": rid}
 
 @app.delete("/messages/{msg_id}/reactions/{emoji}")
 def remove_reaction(msg_id: str, emoji: str, agent_id: str = Depends(get_agent_id)):
     """Remove your emoji reaction from a message."""
-    conn = get_db()
-    result = conn.execute("DELETE FROM message_reactions WHERE message_id = ? AND agent_id = ? AND emoji = ?",
-                          (msg_id, agent_id, emoji))
-    if result.rowcount == 0:
-        conn.close()
-        raise HTTPException(404, "Reaction not found")
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        result = conn.execute("DELETE FROM message_reactions WHERE message_id = ? AND agent_id = ? AND emoji = ?",
+                              (msg_id, agent_id, emoji))
+        if result.rowcount == 0:
+            raise HTTPException(404, "Reaction not found")
     sse_publish("reaction", {"message_id": msg_id, "agent": agent_id, "emoji": emoji, "action": "remove"})
     return {"ok": True}
 
 @app.get("/messages/{msg_id}/reactions")
 def get_reactions(msg_id: str):
     """Get all reactions on a message (public, no auth)."""
-    conn = get_db()
-    rows = conn.execute(
-        "SELECT emoji, GROUP_CONCAT(agent_id) as agents, COUNT(*) as count FROM message_reactions WHERE message_id = ? GROUP BY emoji",
-        (msg_id,)).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute(
+            "SELECT emoji, GROUP_CONCAT(agent_id) as agents, COUNT(*) as count FROM message_reactions WHERE message_id = ? GROUP BY emoji",
+            (msg_id,)).fetchall()
     return {"reactions": [{"emoji": r["emoji"], "agents": r["agents"].split(","), "count": r["count"]} for r in rows]}
 
 # ── Message Edit & Delete ─────────────────────────────
@@ -817,28 +1176,23 @@ def get_reactions(msg_id: str):
 @app.patch("/messages/{msg_id}")
 def edit_message(msg_id: str, body: MessageEdit, agent_id: str = Depends(get_agent_id)):
     """Edit a message. Only the sender can edit their own messages."""
-    conn = get_db()
-    msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
-    if not msg:
-        conn.close()
-        raise HTTPException(404, "Message not found")
-    if msg["from_agent"] != agent_id:
-        conn.close()
-        raise HTTPException(403, "Can only edit your own messages")
-    if msg["deleted"]:
-        conn.close()
-        raise HTTPException(400, "Cannot edit a deleted message")
-    now = time.time()
-    conn.execute("UPDATE messages SET content = ?, edited_at = ? WHERE id = ?", (body.content, now, msg_id))
-    # Update FTS index
-    try:
-        conn.execute("DELETE FROM messages_fts WHERE message_id = ?", (msg_id,))
-        conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
-                     (body.content, msg_id, agent_id, msg["conversation_id"]))
-    except Exception:
-        pass
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        if not msg:
+            raise HTTPException(404, "Message not found")
+        if msg["from_agent"] != agent_id:
+            raise HTTPException(403, "Can only edit your own messages")
+        if msg["deleted"]:
+            raise HTTPException(400, "Cannot edit a deleted message")
+        now = time.time()
+        conn.execute("UPDATE messages SET content = ?, edited_at = ? WHERE id = ?", (body.content, now, msg_id))
+        # Update FTS index
+        try:
+            conn.execute("DELETE FROM messages_fts WHERE message_id = ?", (msg_id,))
+            conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
+                         (body.content, msg_id, agent_id, msg["conversation_id"]))
+        except Exception:
+            pass
     sse_publish("message_edited", {"id": msg_id, "conversation_id": msg["conversation_id"], "from": agent_id,
                                     "content": body.content, "edited_at": now})
     return {"ok": True, "id": msg_id, "edited_at": now}
@@ -846,22 +1200,18 @@ def edit_message(msg_id: str, body: MessageEdit, agent_id: str = Depends(get_age
 @app.delete("/messages/{msg_id}")
 def delete_message(msg_id: str, agent_id: str = Depends(get_agent_id)):
     """Soft-delete a message. Only the sender can delete their own messages."""
-    conn = get_db()
-    msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
-    if not msg:
-        conn.close()
-        raise HTTPException(404, "Message not found")
-    if msg["from_agent"] != agent_id:
-        conn.close()
-        raise HTTPException(403, "Can only delete your own messages")
-    conn.execute("UPDATE messages SET deleted = 1, content = '[deleted]' WHERE id = ?", (msg_id,))
-    # Remove from FTS
-    try:
-        conn.execute("DELETE FROM messages_fts WHERE message_id = ?", (msg_id,))
-    except Exception:
-        pass
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        msg = conn.execute("SELECT * FROM messages WHERE id = ?", (msg_id,)).fetchone()
+        if not msg:
+            raise HTTPException(404, "Message not found")
+        if msg["from_agent"] != agent_id:
+            raise HTTPException(403, "Can only delete your own messages")
+        conn.execute("UPDATE messages SET deleted = 1, content = '[deleted]' WHERE id = ?", (msg_id,))
+        # Remove from FTS
+        try:
+            conn.execute("DELETE FROM messages_fts WHERE message_id = ?", (msg_id,))
+        except Exception:
+            pass
     sse_publish("message_deleted", {"id": msg_id, "conversation_id": msg["conversation_id"], "from": agent_id})
     return {"ok": True, "id": msg_id}
 
@@ -870,31 +1220,26 @@ def delete_message(msg_id: str, agent_id: str = Depends(get_agent_id)):
 @app.post("/conversations/{conv_id}/reply")
 def reply_to_message(conv_id: str, body: ReplyMessage, agent_id: str = Depends(get_agent_id)):
     """Send a message as a reply to another message."""
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone():
-        raise HTTPException(404, "Conversation not found")
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        raise HTTPException(403, "Not a member")
-    parent = conn.execute("SELECT id, conversation_id FROM messages WHERE id = ?", (body.reply_to,)).fetchone()
-    if not parent:
-        conn.close()
-        raise HTTPException(404, "Reply-to message not found")
-    if parent["conversation_id"] != conv_id:
-        conn.close()
-        raise HTTPException(400, "Reply-to message is from a different conversation")
-    mid = str(uuid.uuid4())
-    ts = time.time()
-    conn.execute("INSERT INTO messages (id, conversation_id, from_agent, content, timestamp, reply_to) VALUES (?, ?, ?, ?, ?, ?)",
-                 (mid, conv_id, agent_id, body.content, ts, body.reply_to))
-    try:
-        conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
-                     (body.content, mid, agent_id, conv_id))
-    except Exception:
-        pass
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute("SELECT 1 FROM conversations WHERE id = ?", (conv_id,)).fetchone():
+            raise HTTPException(404, "Conversation not found")
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        parent = conn.execute("SELECT id, conversation_id FROM messages WHERE id = ?", (body.reply_to,)).fetchone()
+        if not parent:
+            raise HTTPException(404, "Reply-to message not found")
+        if parent["conversation_id"] != conv_id:
+            raise HTTPException(400, "Reply-to message is from a different conversation")
+        mid = _new_id()
+        ts = time.time()
+        conn.execute("INSERT INTO messages (id, conversation_id, from_agent, content, timestamp, reply_to) VALUES (?, ?, ?, ?, ?, ?)",
+                     (mid, conv_id, agent_id, body.content, ts, body.reply_to))
+        try:
+            conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?, ?, ?, ?)",
+                         (body.content, mid, agent_id, conv_id))
+        except Exception:
+            pass
+        _update_presence(conn, agent_id)
     sse_publish("message", {"id": mid, "conversation_id": conv_id, "from": agent_id, "content": body.content,
                              "timestamp": ts, "reply_to": body.reply_to})
     return {"ok": True, "id": mid, "reply_to": body.reply_to}
@@ -904,33 +1249,25 @@ def reply_to_message(conv_id: str, body: ReplyMessage, agent_id: str = Depends(g
 @app.post("/conversations/{conv_id}/pin/{msg_id}")
 def pin_message(conv_id: str, msg_id: str, agent_id: str = Depends(get_agent_id)):
     """Pin a message in a conversation."""
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        conn.close()
-        raise HTTPException(403, "Not a member")
-    msg = conn.execute("SELECT * FROM messages WHERE id = ? AND conversation_id = ?", (msg_id, conv_id)).fetchone()
-    if not msg:
-        conn.close()
-        raise HTTPException(404, "Message not found in this conversation")
-    try:
-        conn.execute("INSERT INTO pinned_messages (message_id, conversation_id, pinned_by, pinned_at) VALUES (?,?,?,?)",
-                     (msg_id, conv_id, agent_id, time.time()))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close()
-        raise HTTPException(409, "Message already pinned")
-    conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        msg = conn.execute("SELECT * FROM messages WHERE id = ? AND conversation_id = ?", (msg_id, conv_id)).fetchone()
+        if not msg:
+            raise HTTPException(404, "Message not found in this conversation")
+        try:
+            conn.execute("INSERT INTO pinned_messages (message_id, conversation_id, pinned_by, pinned_at) VALUES (?,?,?,?)",
+                         (msg_id, conv_id, agent_id, time.time()))
+        except sqlite3.IntegrityError:
+            raise HTTPException(409, "Message already pinned")
     sse_publish("message_pinned", {"message_id": msg_id, "conversation_id": conv_id, "agent": agent_id})
     return {"ok": True}
 
 @app.delete("/conversations/{conv_id}/pin/{msg_id}")
 def unpin_message(conv_id: str, msg_id: str, agent_id: str = Depends(get_agent_id)):
     """Unpin a message."""
-    conn = get_db()
-    result = conn.execute("DELETE FROM pinned_messages WHERE message_id = ? AND conversation_id = ?", (msg_id, conv_id))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        result = conn.execute("DELETE FROM pinned_messages WHERE message_id = ? AND conversation_id = ?", (msg_id, conv_id))
     if result.rowcount == 0:
         raise HTTPException(404, "Pin not found")
     sse_publish("message_unpinned", {"message_id": msg_id, "conversation_id": conv_id, "agent": agent_id})
@@ -939,15 +1276,12 @@ def unpin_message(conv_id: str, msg_id: str, agent_id: str = Depends(get_agent_i
 @app.get("/conversations/{conv_id}/pins")
 def get_pinned_messages(conv_id: str, agent_id: str = Depends(get_agent_id)):
     """Get all pinned messages in a conversation."""
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                        (conv_id, agent_id)).fetchone():
-        conn.close()
-        raise HTTPException(403, "Not a member")
-    rows = conn.execute("""SELECT m.*, pm.pinned_by, pm.pinned_at FROM messages m
-        JOIN pinned_messages pm ON m.id = pm.message_id
-        WHERE pm.conversation_id = ? ORDER BY pm.pinned_at DESC""", (conv_id,)).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        if not conn.execute(Q_IS_MEMBER, (conv_id, agent_id)).fetchone():
+            raise HTTPException(403, "Not a member")
+        rows = conn.execute("""SELECT m.*, pm.pinned_by, pm.pinned_at FROM messages m
+            JOIN pinned_messages pm ON m.id = pm.message_id
+            WHERE pm.conversation_id = ? ORDER BY pm.pinned_at DESC""", (conv_id,)).fetchall()
     return {"pinned": [dict(r) for r in rows]}
 
 # ── Agent Presence ────────────────────────────────────
@@ -955,39 +1289,35 @@ def get_pinned_messages(conv_id: str, agent_id: str = Depends(get_agent_id)):
 @app.post("/presence/heartbeat")
 def presence_heartbeat(agent_id: str = Depends(get_agent_id)):
     """Send a presence heartbeat. Call every 1-5 minutes to stay 'online'."""
-    conn = get_db()
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        _update_presence(conn, agent_id)
     return {"ok": True, "status": "online"}
 
 @app.get("/presence")
 def get_all_presence():
     """Get presence status for all agents (public, no auth)."""
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM agent_presence").fetchall()
-    now = time.time()
-    result = []
-    for r in rows:
-        d = dict(r)
-        elapsed = now - d["last_heartbeat"]
-        if elapsed > PRESENCE_TIMEOUT:
-            d["status"] = "offline"
-        elif elapsed > 120:
-            d["status"] = "away"
-        else:
-            d["status"] = "online"
-        d["seconds_since_heartbeat"] = round(elapsed)
-        result.append(d)
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("SELECT * FROM agent_presence").fetchall()
+        now = time.time()
+        result = []
+        for r in rows:
+            d = dict(r)
+            elapsed = now - d["last_heartbeat"]
+            if elapsed > PRESENCE_TIMEOUT:
+                d["status"] = "offline"
+            elif elapsed > 120:
+                d["status"] = "away"
+            else:
+                d["status"] = "online"
+            d["seconds_since_heartbeat"] = round(elapsed)
+            result.append(d)
     return {"agents": result}
 
 @app.get("/presence/{agent_name}")
 def get_agent_presence(agent_name: str):
     """Get presence for a specific agent (public)."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM agent_presence WHERE agent_id = ?", (agent_name,)).fetchone()
-    conn.close()
+    with db_pool.read() as conn:
+        row = conn.execute("SELECT * FROM agent_presence WHERE agent_id = ?", (agent_name,)).fetchone()
     if not row:
         return {"agent_id": agent_name, "status": "unknown", "last_heartbeat": None}
     d = dict(row)
@@ -1006,12 +1336,11 @@ def get_agent_presence(agent_name: str):
 @app.get("/profiles")
 def list_profiles():
     """List all agent profiles (public)."""
-    conn = get_db()
-    rows = conn.execute("""SELECT ap.*, ak.created_at as joined_at
-        FROM agent_profiles ap
-        JOIN api_keys ak ON ap.agent_id = ak.agent_id
-        ORDER BY ap.updated_at DESC""").fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("""SELECT ap.*, ak.created_at as joined_at
+            FROM agent_profiles ap
+            JOIN api_keys ak ON ap.agent_id = ak.agent_id
+            ORDER BY ap.updated_at DESC""").fetchall()
     result = []
     for r in rows:
         d = dict(r)
@@ -1025,11 +1354,10 @@ def list_profiles():
 @app.get("/profiles/{agent_name}")
 def get_profile(agent_name: str):
     """Get an agent's profile (public)."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM agent_profiles WHERE agent_id = ?", (agent_name,)).fetchone()
-    # Also get presence
-    presence = conn.execute("SELECT * FROM agent_presence WHERE agent_id = ?", (agent_name,)).fetchone()
-    conn.close()
+    with db_pool.read() as conn:
+        row = conn.execute("SELECT * FROM agent_profiles WHERE agent_id = ?", (agent_name,)).fetchone()
+        # Also get presence
+        presence = conn.execute("SELECT * FROM agent_presence WHERE agent_id = ?", (agent_name,)).fetchone()
     if not row:
         return {"agent_id": agent_name, "bio": "", "status_message": "", "avatar_url": "", "metadata": {}}
     d = dict(row)
@@ -1047,29 +1375,27 @@ def get_profile(agent_name: str):
 @app.put("/profiles/me")
 def update_profile(body: ProfileUpdate, agent_id: str = Depends(get_agent_id)):
     """Update your own profile."""
-    conn = get_db()
-    now = time.time()
-    existing = conn.execute("SELECT * FROM agent_profiles WHERE agent_id = ?", (agent_id,)).fetchone()
-    if existing:
-        updates, params = [], []
-        if body.bio is not None:
-            updates.append("bio = ?"); params.append(body.bio[:2000])
-        if body.status_message is not None:
-            updates.append("status_message = ?"); params.append(body.status_message[:200])
-        if body.avatar_url is not None:
-            updates.append("avatar_url = ?"); params.append(body.avatar_url[:500])
-        if body.metadata is not None:
-            updates.append("metadata = ?"); params.append(json.dumps(body.metadata))
-        if updates:
-            updates.append("updated_at = ?"); params.append(now); params.append(agent_id)
-            conn.execute(f"UPDATE agent_profiles SET {', '.join(updates)} WHERE agent_id = ?", params)
-    else:
-        conn.execute("INSERT INTO agent_profiles (agent_id, bio, status_message, avatar_url, metadata, updated_at) VALUES (?,?,?,?,?,?)",
-                     (agent_id, (body.bio or "")[:2000], (body.status_message or "")[:200],
-                      (body.avatar_url or "")[:500], json.dumps(body.metadata or {}), now))
-    _update_presence(conn, agent_id)
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        now = time.time()
+        existing = conn.execute("SELECT * FROM agent_profiles WHERE agent_id = ?", (agent_id,)).fetchone()
+        if existing:
+            updates, params = [], []
+            if body.bio is not None:
+                updates.append("bio = ?"); params.append(body.bio[:2000])
+            if body.status_message is not None:
+                updates.append("status_message = ?"); params.append(body.status_message[:200])
+            if body.avatar_url is not None:
+                updates.append("avatar_url = ?"); params.append(body.avatar_url[:500])
+            if body.metadata is not None:
+                updates.append("metadata = ?"); params.append(json.dumps(body.metadata))
+            if updates:
+                updates.append("updated_at = ?"); params.append(now); params.append(agent_id)
+                conn.execute(f"UPDATE agent_profiles SET {', '.join(updates)} WHERE agent_id = ?", params)
+        else:
+            conn.execute("INSERT INTO agent_profiles (agent_id, bio, status_message, avatar_url, metadata, updated_at) VALUES (?,?,?,?,?,?)",
+                         (agent_id, (body.bio or "")[:2000], (body.status_message or "")[:200],
+                          (body.avatar_url or "")[:500], json.dumps(body.metadata or {}), now))
+        _update_presence(conn, agent_id)
     sse_publish("profile_updated", {"agent": agent_id})
     return {"ok": True}
 
@@ -1080,112 +1406,194 @@ def reindex_fts(request: Request):
     """Rebuild the full-text search index from all messages. Admin only."""
     if request.headers.get("x-admin-secret", "") != ADMIN_SECRET:
         raise HTTPException(403, "Bad secret")
-    conn = get_db()
-    # Drop and recreate FTS
-    conn.execute("DROP TABLE IF EXISTS messages_fts")
-    conn.execute("""CREATE VIRTUAL TABLE messages_fts USING fts5(
-        content, message_id UNINDEXED, from_agent UNINDEXED, conversation_id UNINDEXED
-    )""")
-    rows = conn.execute("SELECT id, content, from_agent, conversation_id FROM messages WHERE deleted = 0 OR deleted IS NULL").fetchall()
-    for r in rows:
-        conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?,?,?,?)",
-                     (r["content"], r["id"], r["from_agent"], r["conversation_id"]))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        # Drop and recreate FTS
+        conn.execute("DROP TABLE IF EXISTS messages_fts")
+        conn.execute("""CREATE VIRTUAL TABLE messages_fts USING fts5(
+            content, message_id UNINDEXED, from_agent UNINDEXED, conversation_id UNINDEXED
+        )""")
+        rows = conn.execute("SELECT id, content, from_agent, conversation_id FROM messages WHERE deleted = 0 OR deleted IS NULL").fetchall()
+        for r in rows:
+            conn.execute("INSERT INTO messages_fts (content, message_id, from_agent, conversation_id) VALUES (?,?,?,?)",
+                         (r["content"], r["id"], r["from_agent"], r["conversation_id"]))
     return {"ok": True, "indexed": len(rows)}
 
 @app.get("/history")
 def get_history(with_agent: Optional[str] = None, limit: int = 20, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if with_agent:
-        rows = conn.execute("""SELECT * FROM messages
-            WHERE (from_agent = ? AND to_agent = ?) OR (from_agent = ? AND to_agent = ?)
-            ORDER BY timestamp DESC LIMIT ?""",
-            (agent_id, with_agent, with_agent, agent_id, limit)).fetchall()
-    else:
-        rows = conn.execute("SELECT * FROM messages WHERE from_agent = ? OR to_agent = ? ORDER BY timestamp DESC LIMIT ?",
-                            (agent_id, agent_id, limit)).fetchall()
-    conn.close()
-    return {"messages": [dict(r) for r in rows]}
+    with db_pool.read() as conn:
+        if with_agent:
+            rows = _fetch_dicts(conn.execute("""SELECT * FROM messages
+                WHERE (from_agent = ? AND to_agent = ?) OR (from_agent = ? AND to_agent = ?)
+                ORDER BY timestamp DESC LIMIT ?""",
+                (agent_id, with_agent, with_agent, agent_id, limit)))
+        else:
+            rows = _fetch_dicts(conn.execute("SELECT * FROM messages WHERE from_agent = ? OR to_agent = ? ORDER BY timestamp DESC LIMIT ?",
+                                             (agent_id, agent_id, limit)))
+    return {"messages": rows}
 
 # ── Files API ─────────────────────────────────────────
 
+UPLOAD_CHUNK = 1 << 20  # 1 MB
+
+def _upload_write_error(e: OSError) -> HTTPException:
+    if e.errno == 28:  # ENOSPC
+        return HTTPException(507, "Server disk is full — cannot store file")
+    if e.errno == 13:  # EACCES
+        return HTTPException(500, "Server permission error writing file")
+    return HTTPException(500, f"File write failed: {e.strerror}")
+
+async def _save_upload(file: UploadFile) -> tuple:
+    """Stream an upload to a temp .part file in one pass, hashing as it goes.
+
+    Memory stays at one chunk regardless of file size. Returns (size, SHA-256 hex
+    digest, temp path); hand the temp path to _store_blob() to move it into place.
+    Hashing and writing each chunk run in the threadpool (both release the GIL),
+    so a 50 MB upload doesn't hold the event loop for the whole digest.
+    """
+    h = hashlib.sha256()
+    size = 0
+    tmp = os.path.join(FILES_DIR, f"{os.urandom(16).hex()}.part")
+
+    def absorb(f, chunk):
+        h.update(chunk)
+        f.write(chunk)
+
+    try:
+        with open(tmp, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK):
+                size += len(chunk)
+                if size > MAX_FILE_SIZE:
+                    raise HTTPException(413, f"File too large. Max: {MAX_FILE_SIZE} bytes (50MB)")
+                await run_in_threadpool(absorb, f, chunk)
+        if size == 0:
+            raise HTTPException(400, "Empty file")
+    except BaseException as e:
+        _discard(tmp)
+        if isinstance(e, OSError):
+            raise _upload_write_error(e)
+        raise
+    return size, h.hexdigest(), tmp
+
+# Blobs are content-addressed: FILES_DIR/<sha[:2]>/<sha>, shared by every files
+# row with the same bytes. _blob_lock orders "place blob + insert row" against "delete row + unlink unreferenced
+# blob" so a dedup hit can't lose its blob.
+_blob_lock = threading.Lock()
+
+def _discard(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def _store_blob(tmp: str, sha: str) -> str:
+    """Move a finished upload into the content store (or drop it if already stored). Returns its files.filename."""
+    rel = os.path.join(sha[:2], sha)
+    blob = os.path.join(FILES_DIR, rel)
+    # Just rename; a dedup hit swaps in an identical inode (open readers keep
+    # the old one) and only a first-of-its-prefix blob pays for makedirs
+    try:
+        try:
+            os.replace(tmp, blob)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            os.replace(tmp, blob)
+    except OSError as e:
+        _discard(tmp)
+        raise _upload_write_error(e)
+    return rel
+
+def _release_blob(conn, filename: str):
+    """Unlink a stored file once no files row references it (call with _blob_lock held)."""
+    if conn.execute("SELECT 1 FROM files WHERE filename = ? LIMIT 1", (filename,)).fetchone():
+        return
+    try:
+        os.remove(os.path.join(FILES_DIR, filename))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        # Log but don't block deletion from DB
+        print(f"[agent-bridge] WARNING: Could not delete file from disk: {e}")
+
+# Deferred uploads (defer=true) not yet recorded: file_id -> None while
+# pending, or the error message if storing it failed
+_pending_uploads: dict = {}
+
 @app.post("/files/upload")
 async def upload_file(
+    background_tasks: BackgroundTasks,
+    response: Response,
     file: UploadFile = File(...),
     description: Optional[str] = Form(None),
     conversation_id: Optional[str] = Form(None),
+    defer: bool = Form(False),
     agent_id: str = Depends(get_agent_id)
 ):
     """Upload a file (max 50MB). Returns file ID and download URL.
     
     Blocked extensions: .exe .bat .cmd .sh .ps1 .com .msi .vbs .wsf
     To upload scripts/executables, use the admin override endpoint (not yet implemented).
-    """
-    # Read file content
-    content = await file.read()
-    size = len(content)
-
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(413, f"File too large ({size} bytes). Max: {MAX_FILE_SIZE} bytes (50MB)")
-
-    if size == 0:
-        raise HTTPException(400, "Empty file")
 
+    With defer=true the response (202) is sent as soon as the body is on disk;
+    the file is stored and recorded afterwards. Poll /files/status/{id}.
+    """
     original_name = file.filename or "unnamed"
-    ext = os.path.splitext(original_name)[1].lower()
     mime = file.content_type or mimetypes.guess_type(original_name)[0] or "application/octet-stream"
-
-    # Generate file ID and hash
-    file_id = str(uuid.uuid4())
-    sha = hashlib.sha256(content).hexdigest()
-
-    # Safe filename: preserve extension, use file_id as base
-    safe_name = f"{file_id}{ext}"
+    file_id = _new_id()
+
+    # This handler is async (to stream the body), so blocking DB/filesystem
+    # work goes to the threadpool instead of stalling the event loop.
+    def check_member():
+        with db_pool.read() as conn:
+            if not conn.execute(Q_IS_MEMBER, (conversation_id, agent_id)).fetchone():
+                raise HTTPException(403, "Not a member of that conversation")
+
+    def record():
+        # Store (or reuse) the blob and record in DB
+        with db_pool.write() as conn, _blob_lock:
+            stored = _store_blob(tmp, sha)
+            try:
+                conn.execute("""INSERT INTO files (id, filename, original_name, mime_type, size, sha256,
+                                uploaded_by, uploaded_at, conversation_id, description)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (file_id, stored, original_name, mime, size, sha,
+                              agent_id, time.time(), conversation_id, description))
+                conn.commit()
+            except Exception as e:
+                # Drop the blob again if nothing else uses it
+                conn.rollback()
+                _release_blob(conn, stored)
+                raise HTTPException(500, f"Database error: {e}")
 
     # Verify conversation membership if specified
     if conversation_id:
-        conn = get_db()
-        if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                           (conversation_id, agent_id)).fetchone():
-            conn.close()
-            raise HTTPException(403, "Not a member of that conversation")
-        conn.close()
+        await run_in_threadpool(check_member)
 
-    # Write file to disk (with I/O error handling)
-    file_path = os.path.join(FILES_DIR, safe_name)
-    try:
-        with open(file_path, "wb") as f:
-            f.write(content)
-    except OSError as e:
-        if e.errno == 28:  # ENOSPC
-            raise HTTPException(507, "Server disk is full — cannot store file")
-        elif e.errno == 13:  # EACCES
-            raise HTTPException(500, "Server permission error writing file")
-        else:
-            raise HTTPException(500, f"File write failed: {e.strerror}")
-
-    # Record in DB
-    conn = get_db()
-    try:
-        conn.execute("""INSERT INTO files (id, filename, original_name, mime_type, size, sha256,
-                        uploaded_by, uploaded_at, conversation_id, description)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                     (file_id, safe_name, original_name, mime, size, sha,
-                      agent_id, time.time(), conversation_id, description))
-        conn.commit()
-    except Exception as e:
-        # Roll back disk file if DB insert fails
+    def finalize():
         try:
-            os.remove(file_path)
-        except OSError:
-            pass
-        raise HTTPException(500, f"Database error: {e}")
-    finally:
-        conn.close()
+            record()
+        except Exception as e:
+            # Nobody is waiting on this request any more: drop the temp file
+            # (a no-op once it's been moved into place) and report via status
+            _discard(tmp)
+            _pending_uploads[file_id] = e.detail if isinstance(e, HTTPException) else f"Storage error: {e}"
+        else:
+            _pending_uploads.pop(file_id, None)
+
+    # Stream file to disk, hashing as we go
+    size, sha, tmp = await _save_upload(file)
+    if defer:
+        if len(_pending_uploads) > 1024:
+            for k in [k for k, err in _pending_uploads.items() if err]:
+                del _pending_uploads[k]
+        _pending_uploads[file_id] = None
+        background_tasks.add_task(finalize)
+        response.status_code = 202
+    else:
+        await run_in_threadpool(record)
 
     return {
         "ok": True,
+        "status": "pending" if defer else "ready",
         "file_id": file_id,
         "filename": original_name,
         "size": size,
@@ -1200,35 +1608,104 @@ def file_stats(agent_id: str = Depends(get_agent_id)):
     """Storage stats: total files, total size, largest file, breakdown by agent."""
     return get_files_stats_data()
 
+# Declared before /files/{file_id}/{filename}, which would otherwise match it
+# with file_id="status"; real file ids are UUIDs, so no download URL collides
+@app.get("/files/status/{file_id}")
+def file_status(file_id: str):
+    """Whether an upload has been stored: pending, ready or failed (deferred uploads only fail here)."""
+    if file_id in _pending_uploads:
+        err = _pending_uploads[file_id]
+        if err:
+            return {"file_id": file_id, "status": "failed", "error": err}
+        return {"file_id": file_id, "status": "pending"}
+    with db_pool.read() as conn:
+        if conn.execute("SELECT 1 FROM files WHERE id = ?", (file_id,)).fetchone():
+            return {"file_id": file_id, "status": "ready"}
+    raise HTTPException(404, "File not found")
+
 @app.get("/files/{file_id}")
 def get_file_info(file_id: str):
     """Get file metadata (public, no auth needed — download links work without key)."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
-    conn.close()
+    with db_pool.read() as conn:
+        row = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
     if not row:
         raise HTTPException(404, "File not found")
     return dict(row)
 
+# file_id -> (filename, original_name, mime_type, etag) for downloads. A file's
+# bytes never change once recorded, so entries only go stale on delete, which evicts.
+_download_meta_cache: OrderedDict = OrderedDict()
+_download_meta_lock = threading.Lock()
+DOWNLOAD_META_CACHE_SIZE = 512
+
+def _download_meta(file_id: str) -> Optional[tuple]:
+    with _download_meta_lock:
+        hit = _download_meta_cache.get(file_id)
+        if hit:
+            _download_meta_cache.move_to_end(file_id)
+            return hit
+    with db_pool.read() as conn:
+        row = conn.execute("""SELECT filename, original_name, mime_type, sha256 AS digest
+            FROM files WHERE id = ?""", (file_id,)).fetchone()
+    if not row:
+        return None
+    meta = (row["filename"], row["original_name"], row["mime_type"], f'"{row["digest"]}"' if row["digest"] else None)
+    with _download_meta_lock:
+        _download_meta_cache[file_id] = meta
+        if len(_download_meta_cache) > DOWNLOAD_META_CACHE_SIZE:
+            _download_meta_cache.popitem(last=False)
+    return meta
+
 @app.get("/files/{file_id}/{filename}")
-def download_file(file_id: str, filename: str):
+def download_file(file_id: str, filename: str, if_none_match: Optional[str] = Header(None)):
     """Download a file by ID. Filename in URL is cosmetic (for nice download names)."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
-    conn.close()
-    if not row:
+    meta = _download_meta(file_id)
+    if not meta:
         raise HTTPException(404, "File not found")
+    stored, name, mime, etag = meta
+
+    # The content hash is the ETag and a file id's bytes never change, so
+    # clients may cache forever and revalidations skip the disk entirely
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"} if etag else {}
+    if etag and if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        return Response(status_code=304, headers=headers)
+
+    if ACCEL_REDIRECT_PREFIX:
+        # Same Content-Disposition FileResponse would send; nginx streams the body
+        quoted = quote(name)
+        disposition = f'attachment; filename="{name}"' if quoted == name else f"attachment; filename*=utf-8''{quoted}"
+        return Response(media_type=mime, headers={
+            **headers,
+            "Content-Disposition": disposition,
+            "X-Accel-Redirect": ACCEL_REDIRECT_PREFIX.rstrip("/") + "/" + stored.replace(os.sep, "/"),
+        })
 
-    file_path = os.path.join(FILES_DIR, row["filename"])
-    if not os.path.exists(file_path):
+    # Stat once and hand the result to FileResponse so it doesn't stat again;
+    # Starlette uses zero-copy sendfile when the server offers that extension.
+    file_path = os.path.join(FILES_DIR, stored)
+    try:
+        st = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(404, "File data missing from disk")
 
     return FileResponse(
         path=file_path,
-        filename=row["original_name"],
-        media_type=row["mime_type"]
+        filename=name,
+        media_type=mime,
+        stat_result=st,
+        headers=headers
     )
 
+# Fixed statement per filter combination (conversation_id?, uploaded_by?) so
+# sqlite's statement cache reuses one compiled plan for each
+_FILES_COLS = "SELECT id, original_name, mime_type, size, uploaded_by, uploaded_at, conversation_id, description FROM files"
+Q_FILES = {
+    (False, False): f"{_FILES_COLS} ORDER BY uploaded_at DESC LIMIT ?",
+    (True, False): f"{_FILES_COLS} WHERE conversation_id = ? ORDER BY uploaded_at DESC LIMIT ?",
+    (False, True): f"{_FILES_COLS} WHERE uploaded_by = ? ORDER BY uploaded_at DESC LIMIT ?",
+    (True, True): f"{_FILES_COLS} WHERE conversation_id = ? AND uploaded_by = ? ORDER BY uploaded_at DESC LIMIT ?",
+}
+
 @app.get("/files")
 def list_files(
     conversation_id: Optional[str] = None,
@@ -1237,28 +1714,15 @@ def list_files(
     agent_id: str = Depends(get_agent_id)
 ):
     """List files. Filter by conversation or uploader."""
-    conn = get_db()
-    q = "SELECT id, original_name, mime_type, size, uploaded_by, uploaded_at, conversation_id, description FROM files WHERE 1=1"
-    params: list = []
-
-    if conversation_id:
-        # Verify membership
-        if not conn.execute("SELECT 1 FROM conversation_members WHERE conversation_id = ? AND agent_id = ?",
-                           (conversation_id, agent_id)).fetchone():
-            conn.close()
-            raise HTTPException(403, "Not a member of that conversation")
-        q += " AND conversation_id = ?"
-        params.append(conversation_id)
-
-    if uploaded_by:
-        q += " AND uploaded_by = ?"
-        params.append(uploaded_by)
-
-    q += " ORDER BY uploaded_at DESC LIMIT ?"
-    params.append(limit)
+    with db_pool.read() as conn:
+        if conversation_id:
+            # Verify membership
+            if not conn.execute(Q_IS_MEMBER, (conversation_id, agent_id)).fetchone():
+                raise HTTPException(403, "Not a member of that conversation")
 
-    rows = conn.execute(q, params).fetchall()
-    conn.close()
+        q = Q_FILES[bool(conversation_id), bool(uploaded_by)]
+        params = tuple(v for v in (conversation_id, uploaded_by) if v) + (limit,)
+        rows = conn.execute(q, params).fetchall()
 
     files = []
     for r in rows:
@@ -1271,28 +1735,21 @@ def list_files(
 @app.delete("/files/{file_id}")
 def delete_file(file_id: str, agent_id: str = Depends(get_agent_id)):
     """Delete a file. Only the uploader can delete."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(404, "File not found")
-    if row["uploaded_by"] != agent_id:
-        conn.close()
-        raise HTTPException(403, "Only the uploader can delete this file")
-
-    # Remove from disk (best-effort — don't fail if file is already gone)
-    file_path = os.path.join(FILES_DIR, row["filename"])
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-    except OSError as e:
-        # Log but don't block deletion from DB
-        print(f"[agent-bridge] WARNING: Could not delete file from disk: {e}")
-
-    # Remove from DB
-    conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
-    conn.commit()
-    conn.close()
+    with db_pool.write() as conn, _blob_lock:
+        # Authorize, delete and fetch the blob name in one statement; only a
+        # miss needs a second look to tell 404 from 403
+        row = conn.execute("DELETE FROM files WHERE id = ? AND uploaded_by = ? RETURNING filename",
+                           (file_id, agent_id)).fetchone()
+        if not row:
+            if conn.execute("SELECT 1 FROM files WHERE id = ?", (file_id,)).fetchone():
+                raise HTTPException(403, "Only the uploader can delete this file")
+            raise HTTPException(404, "File not found")
+        conn.commit()
+        with _download_meta_lock:
+            _download_meta_cache.pop(file_id, None)
+        # Then remove from disk if no other upload shares the blob
+        # (best-effort — don't fail if file is already gone)
+        _release_blob(conn, row["filename"])
     return {"ok": True, "deleted": file_id}
 
 # ── Send with attachment (DM + file in one call) ──────
@@ -1305,55 +1762,42 @@ async def send_dm_with_file(
     agent_id: str = Depends(get_agent_id)
 ):
     """Send a DM with a file attachment in one call."""
-    file_content = await file.read()
-    size = len(file_content)
-    if size > MAX_FILE_SIZE:
-        raise HTTPException(413, "File too large. Max: 50MB")
-    if size == 0:
-        raise HTTPException(400, "Empty file")
-
     original_name = file.filename or "unnamed"
-    ext = os.path.splitext(original_name)[1].lower()
-
-    conn = get_db()
-    conv_id = find_or_create_dm(conn, agent_id, to)
-
-    file_id = str(uuid.uuid4())
-    sha = hashlib.sha256(file_content).hexdigest()
+    file_id = _new_id()
     mime = file.content_type or mimetypes.guess_type(original_name)[0] or "application/octet-stream"
-    safe_name = f"{file_id}{ext}"
-
-    file_path = os.path.join(FILES_DIR, safe_name)
-    try:
-        with open(file_path, "wb") as f:
-            f.write(file_content)
-    except OSError as e:
-        conn.close()
-        if e.errno == 28:
-            raise HTTPException(507, "Server disk is full — cannot store file")
-        elif e.errno == 13:
-            raise HTTPException(500, "Server permission error writing file")
-        else:
-            raise HTTPException(500, f"File write failed: {e.strerror}")
-
-    conn.execute("""INSERT INTO files (id, filename, original_name, mime_type, size, sha256,
-                    uploaded_by, uploaded_at, conversation_id, description)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                 (file_id, safe_name, original_name, mime, size, sha, agent_id, time.time(), conv_id, None))
 
-    # Create message with file reference
-    mid = str(uuid.uuid4())
-    msg_content = content if content else f"📎 {original_name}"
-    msg_content += f"\n\n📁 File: {original_name} ({size} bytes)\n🔗 /files/{file_id}/{original_name}"
-
-    conn.execute("""INSERT INTO messages (id, conversation_id, from_agent, to_agent, content, timestamp)
-                    VALUES (?, ?, ?, ?, ?, ?)""",
-                 (mid, conv_id, agent_id, to, msg_content, time.time()))
-
-    # Update file with message_id
-    conn.execute("UPDATE files SET message_id = ? WHERE id = ?", (mid, file_id))
-    conn.commit()
-    conn.close()
+    def record():
+        # Runs in the threadpool so the blocking DB work stays off the event loop
+        with db_pool.transaction() as conn, _blob_lock:
+            stored = _store_blob(tmp, sha)
+            try:
+                conv_id = find_or_create_dm(conn, agent_id, to)
+
+                conn.execute("""INSERT INTO files (id, filename, original_name, mime_type, size, sha256,
+                                uploaded_by, uploaded_at, conversation_id, description)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                             (file_id, stored, original_name, mime, size, sha, agent_id, time.time(), conv_id, None))
+
+                # Create message with file reference
+                mid = _new_id()
+                msg_content = content if content else f"📎 {original_name}"
+                msg_content += f"\n\n📁 File: {original_name} ({size} bytes)\n🔗 /files/{file_id}/{original_name}"
+
+                conn.execute("""INSERT INTO messages (id, conversation_id, from_agent, to_agent, content, timestamp)
+                                VALUES (?, ?, ?, ?, ?, ?)""",
+                             (mid, conv_id, agent_id, to, msg_content, time.time()))
+
+                # Update file with message_id
+                conn.execute("UPDATE files SET message_id = ? WHERE id = ?", (mid, file_id))
+            except Exception as e:
+                # Drop the blob again if nothing else uses it
+                conn.rollback()
+                _release_blob(conn, stored)
+                raise HTTPException(500, f"Database error: {e}")
+        return mid, conv_id
+
+    size, sha, tmp = await _save_upload(file)
+    mid, conv_id = await run_in_threadpool(record)
 
     return {
         "ok": True,
@@ -1365,33 +1809,38 @@ async def send_dm_with_file(
 
 # ── Registration & Agent Directory ─────────────────────
 
+def _insert_api_key(conn, agent_id: str) -> Optional[str]:
+    """Issue a new key for agent_id. Returns None if the agent already has one."""
+    # Check-and-insert in one statement; no row back means the agent already exists
+    row = conn.execute("""INSERT INTO api_keys (key, agent_id, created_at)
+        SELECT ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM api_keys WHERE agent_id = ?)
+        RETURNING key""", (secrets.token_urlsafe(32), agent_id, time.time(), agent_id)).fetchone()
+    return row["key"] if row else None
+
 @app.post("/join")
 def request_to_join(req: JoinRequest):
     """Self-service: any agent can request access. Auto-approved, returns API key immediately."""
-    conn = get_db()
-    # Check if already registered
-    if conn.execute("SELECT 1 FROM api_keys WHERE agent_id = ?", (req.agent_name,)).fetchone():
-        conn.close()
-        raise HTTPException(409, f"{req.agent_name} is already a registered agent")
-    # Check if already pending/processed
-    existing = conn.execute("SELECT * FROM pending_registrations WHERE agent_name = ?", (req.agent_name,)).fetchone()
-    if existing:
-        conn.close()
-        if existing["status"] == "approved":
-            raise HTTPException(409, f"{req.agent_name} is already approved")
-        raise HTTPException(409, f"{req.agent_name} already has a pending request")
-    reg_id = str(uuid.uuid4())
-    now = time.time()
-    # Log the registration
-    conn.execute(
-        "INSERT INTO pending_registrations (id, agent_name, description, contact, status, created_at, reviewed_at, reviewed_by) VALUES (?,?,?,?,?,?,?,?)",
-        (reg_id, req.agent_name, req.description or "", req.contact or "", "approved", now, now, "auto")
-    )
-    # Auto-approve: generate key immediately
-    key = secrets.token_urlsafe(32)
-    conn.execute("INSERT INTO api_keys VALUES (?, ?, ?)", (key, req.agent_name, now))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        # Check if already registered
+        if conn.execute("SELECT 1 FROM api_keys WHERE agent_id = ?", (req.agent_name,)).fetchone():
+            raise HTTPException(409, f"{req.agent_name} is already a registered agent")
+        # Check if already pending/processed
+        existing = conn.execute("SELECT * FROM pending_registrations WHERE agent_name = ?", (req.agent_name,)).fetchone()
+        if existing:
+            if existing["status"] == "approved":
+                raise HTTPException(409, f"{req.agent_name} is already approved")
+            raise HTTPException(409, f"{req.agent_name} already has a pending request")
+        reg_id = _new_id()
+        now = time.time()
+        # Log the registration
+        conn.execute(
+            "INSERT INTO pending_registrations (id, agent_name, description, contact, status, created_at, reviewed_at, reviewed_by) VALUES (?,?,?,?,?,?,?,?)",
+            (reg_id, req.agent_name, req.description or "", req.contact or "", "approved", now, now, "auto")
+        )
+        # Auto-approve: generate key immediately
+        key = _insert_api_key(conn, req.agent_name)
+        if not key:
+            raise HTTPException(409, f"{req.agent_name} is already a registered agent")
     return {
         "ok": True,
         "registration_id": reg_id,
@@ -1404,15 +1853,15 @@ def request_to_join(req: JoinRequest):
 @app.get("/join/{registration_id}")
 def check_join_status(registration_id: str):
     """Check the status of a join request. Returns pending/approved/rejected."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM pending_registrations WHERE id = ?", (registration_id,)).fetchone()
-    conn.close()
+    with db_pool.read() as conn:
+        row = conn.execute("SELECT * FROM pending_registrations WHERE id = ?", (registration_id,)).fetchone()
     if not row:
         raise HTTPException(404, "Registration not found")
     result = dict(row)
     if result["status"] == "approved":
         # Include the API key only on first check after approval
-        key_row = get_db().execute("SELECT key FROM api_keys WHERE agent_id = ?", (result["agent_name"],)).fetchone()
+        with db_pool.read() as conn:
+            key_row = conn.execute("SELECT key FROM api_keys WHERE agent_id = ?", (result["agent_name"],)).fetchone()
         if key_row:
             result["api_key"] = key_row["key"]
             result["message"] = "Approved! Save your API key — it won't be shown again. Use it as the x-api-key header."
@@ -1421,68 +1870,59 @@ def check_join_status(registration_id: str):
 @app.get("/join")
 def list_pending_registrations():
     """Public: see who's waiting to join (no secrets exposed)."""
-    conn = get_db()
-    rows = conn.execute(
-        "SELECT id, agent_name, description, contact, status, created_at FROM pending_registrations ORDER BY created_at DESC"
-    ).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute(
+            "SELECT id, agent_name, description, contact, status, created_at FROM pending_registrations ORDER BY created_at DESC"
+        ).fetchall()
     return {"registrations": [dict(r) for r in rows]}
 
 @app.post("/join/{registration_id}/approve")
 def approve_registration(registration_id: str, agent_id: str = Depends(get_agent_id)):
     """Any registered agent can approve a pending request."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM pending_registrations WHERE id = ? AND status = 'pending'", (registration_id,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(404, "No pending registration with that ID")
-    agent_name = row["agent_name"]
-    # Generate API key
-    key = secrets.token_urlsafe(32)
-    conn.execute("INSERT INTO api_keys VALUES (?, ?, ?)", (key, agent_name, time.time()))
-    conn.execute(
-        "UPDATE pending_registrations SET status = 'approved', reviewed_at = ?, reviewed_by = ? WHERE id = ?",
-        (time.time(), agent_id, registration_id)
-    )
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        row = conn.execute("SELECT * FROM pending_registrations WHERE id = ? AND status = 'pending'", (registration_id,)).fetchone()
+        if not row:
+            raise HTTPException(404, "No pending registration with that ID")
+        agent_name = row["agent_name"]
+        if not _insert_api_key(conn, agent_name):
+            raise HTTPException(409, f"{agent_name} is already a registered agent")
+        conn.execute(
+            "UPDATE pending_registrations SET status = 'approved', reviewed_at = ?, reviewed_by = ? WHERE id = ?",
+            (time.time(), agent_id, registration_id)
+        )
     return {"ok": True, "agent_name": agent_name, "approved_by": agent_id, "message": f"{agent_name} is now a registered agent. They can retrieve their key at GET /join/{registration_id}"}
 
 @app.post("/join/{registration_id}/reject")
 def reject_registration(registration_id: str, agent_id: str = Depends(get_agent_id)):
     """Any registered agent can reject a pending request."""
-    conn = get_db()
-    row = conn.execute("SELECT * FROM pending_registrations WHERE id = ? AND status = 'pending'", (registration_id,)).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(404, "No pending registration with that ID")
-    conn.execute(
-        "UPDATE pending_registrations SET status = 'rejected', reviewed_at = ?, reviewed_by = ? WHERE id = ?",
-        (time.time(), agent_id, registration_id)
-    )
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        row = conn.execute("SELECT * FROM pending_registrations WHERE id = ? AND status = 'pending'", (registration_id,)).fetchone()
+        if not row:
+            raise HTTPException(404, "No pending registration with that ID")
+        conn.execute(
+            "UPDATE pending_registrations SET status = 'rejected', reviewed_at = ?, reviewed_by = ? WHERE id = ?",
+            (time.time(), agent_id, registration_id)
+        )
     return {"ok": True, "agent_name": row["agent_name"], "rejected_by": agent_id}
 
 @app.get("/agents")
 def list_agents():
     """Public directory of all registered agents."""
-    conn = get_db()
-    rows = conn.execute("SELECT agent_id, created_at FROM api_keys ORDER BY created_at ASC").fetchall()
-    agents = []
-    for r in rows:
-        # Get activity stats
-        msg_count = conn.execute("SELECT COUNT(*) as c FROM messages WHERE from_agent = ?", (r["agent_id"],)).fetchone()["c"]
-        task_count = conn.execute("SELECT COUNT(*) as c FROM tasks WHERE created_by = ? OR claimed_by = ?", (r["agent_id"], r["agent_id"])).fetchone()["c"]
-        commit_count = conn.execute("SELECT COUNT(*) as c FROM git_commits WHERE author = ?", (r["agent_id"],)).fetchone()["c"]
-        last_msg = conn.execute("SELECT MAX(timestamp) as t FROM messages WHERE from_agent = ?", (r["agent_id"],)).fetchone()["t"]
-        agents.append({
-            "name": r["agent_id"],
-            "joined_at": r["created_at"],
-            "stats": {"messages": msg_count, "tasks": task_count, "commits": commit_count},
-            "last_active": last_msg
-        })
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("SELECT agent_id, created_at FROM api_keys ORDER BY created_at ASC").fetchall()
+        agents = []
+        for r in rows:
+            # Get activity stats
+            msg_count = conn.execute("SELECT COUNT(*) as c FROM messages WHERE from_agent = ?", (r["agent_id"],)).fetchone()["c"]
+            task_count = conn.execute("SELECT COUNT(*) as c FROM tasks WHERE created_by = ? OR claimed_by = ?", (r["agent_id"], r["agent_id"])).fetchone()["c"]
+            commit_count = conn.execute("SELECT COUNT(*) as c FROM git_commits WHERE author = ?", (r["agent_id"],)).fetchone()["c"]
+            last_msg = conn.execute("SELECT MAX(timestamp) as t FROM messages WHERE from_agent = ?", (r["agent_id"],)).fetchone()["t"]
+            agents.append({
+                "name": r["agent_id"],
+                "joined_at": r["created_at"],
+                "stats": {"messages": msg_count, "tasks": task_count, "commits": commit_count},
+                "last_active": last_msg
+            })
     return {"agents": agents, "count": len(agents)}
 
 # ── Admin (legacy, still works with admin secret) ─────
@@ -1492,23 +1932,18 @@ def register_agent(req: RegisterReq):
     """Direct registration with admin secret (bypass join queue)."""
     if req.admin_secret != ADMIN_SECRET:
         raise HTTPException(403, "Bad secret")
-    conn = get_db()
-    if conn.execute("SELECT 1 FROM api_keys WHERE agent_id = ?", (req.agent_id,)).fetchone():
-        conn.close()
-        raise HTTPException(409, f"{req.agent_id} already registered")
-    key = secrets.token_urlsafe(32)
-    conn.execute("INSERT INTO api_keys VALUES (?, ?, ?)", (key, req.agent_id, time.time()))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        key = _insert_api_key(conn, req.agent_id)
+        if not key:
+            raise HTTPException(409, f"{req.agent_id} already registered")
     return {"ok": True, "agent_id": req.agent_id, "api_key": key}
 
 @app.get("/admin/keys")
 def list_keys(request: Request):
     if request.headers.get("x-admin-secret", "") != ADMIN_SECRET:
         raise HTTPException(403, "Bad secret")
-    conn = get_db()
-    rows = conn.execute("SELECT agent_id, created_at FROM api_keys").fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("SELECT agent_id, created_at FROM api_keys").fetchall()
     return [dict(r) for r in rows]
 
 # ── Public browse (for web UI, no auth) ───────────────
@@ -1522,90 +1957,197 @@ if not os.path.exists(SKILL_PATH):
 def get_skill():
     """Public: returns the bridge skill/documentation as markdown."""
     for p in [SKILL_PATH, os.path.join(os.path.dirname(__file__), "SKILL.md")]:
-        if os.path.exists(p):
-            return PlainTextResponse(open(p).read(), media_type="text/markdown")
+        try:
+            with open(p) as f:
+                return PlainTextResponse(f.read(), media_type="text/markdown")
+        except FileNotFoundError:
+            continue
     raise HTTPException(404, "Skill file not found")
 
+# Columns the browse/export endpoints return (not SELECT *, which drags every column along)
+MESSAGE_COLUMNS = "id, conversation_id, from_agent, to_agent, content, timestamp, read, edited_at, deleted, reply_to"
+
 @app.get("/browse/conversations")
 def browse_conversations():
-    conn = get_db()
-    convs = conn.execute("""
-        SELECT c.*,
-            (SELECT COUNT(*) FROM conversation_members WHERE conversation_id = c.id) as member_count,
-            (SELECT COUNT(*) FROM messages WHERE conversation_id = c.id) as message_count,
-            (SELECT COUNT(*) FROM messages WHERE conversation_id = c.id AND read = 0) as unread_count,
-            (SELECT MAX(timestamp) FROM messages WHERE conversation_id = c.id) as last_activity
-        FROM conversations c ORDER BY last_activity DESC NULLS LAST
-    """).fetchall()
+    with db_pool.read() as conn:
+        # One grouped pass over each table instead of four correlated subqueries per row
+        convs = conn.execute("""
+            WITH mc AS (
+                SELECT conversation_id, COUNT(*) AS cnt FROM conversation_members GROUP BY conversation_id
+            ), ms AS (
+                SELECT conversation_id, COUNT(*) AS cnt, SUM(read = 0) AS unread, MAX(timestamp) AS last_ts
+                FROM messages WHERE conversation_id IS NOT NULL GROUP BY conversation_id
+            )
+            SELECT c.*, COALESCE(mc.cnt, 0) as member_count, COALESCE(ms.cnt, 0) as message_count,
+                COALESCE(ms.unread, 0) as unread_count, ms.last_ts as last_activity
+            FROM conversations c
+            LEFT JOIN mc ON mc.conversation_id = c.id
+            LEFT JOIN ms ON ms.conversation_id = c.id
+            ORDER BY last_activity DESC NULLS LAST
+        """).fetchall()
+        # Members and last messages for every conversation in two bulk queries (not 2 per conversation)
+        members = {r["conversation_id"]: r["members"].split("\x1f") for r in conn.execute(
+            "SELECT conversation_id, GROUP_CONCAT(agent_id, char(31)) AS members FROM conversation_members GROUP BY conversation_id")}
+        last_msgs = {r["conversation_id"]: r for r in conn.execute("""
+            SELECT conversation_id, from_agent, content FROM (
+                SELECT conversation_id, from_agent, content,
+                       ROW_NUMBER() OVER (PARTITION BY conversation_id ORDER BY timestamp DESC) AS rn
+                FROM messages WHERE conversation_id IS NOT NULL
+            ) WHERE rn = 1""")}
     result = []
     for c in convs:
         d = dict(c)
-        d["members"] = [m["agent_id"] for m in conn.execute(
-            "SELECT agent_id FROM conversation_members WHERE conversation_id = ?", (c["id"],)).fetchall()]
-        last = conn.execute(
-            "SELECT from_agent, content FROM messages WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT 1",
-            (c["id"],)).fetchone()
+        d["members"] = members.get(c["id"], [])
+        last = last_msgs.get(c["id"])
         d["last_message"] = {"from": last["from_agent"], "text": last["content"][:100]} if last else None
         result.append(d)
-    conn.close()
     return result
 
+def _parse_cursor(after: str) -> tuple:
+    """Split an X-Next-Cursor value, "<timestamp>,<message id>", into (timestamp, id).
+
+    Older clients send a bare timestamp; id is None then and the caller pages
+    strictly after that timestamp, as before.
+    """
+    ts, _, mid = after.partition(",")
+    try:
+        return float(ts), mid or None
+    except ValueError:
+        raise HTTPException(400, "Invalid cursor")
+
+def _next_cursor(rows: list, limit: int) -> Optional[dict]:
+    """X-Next-Cursor header for a full page; (timestamp, id) so rows sharing the boundary timestamp aren't skipped."""
+    if rows and len(rows) == limit:
+        return {"X-Next-Cursor": f"{rows[-1]['timestamp']!r},{rows[-1]['id']}"}
+    return None
+
 @app.get("/browse/conversations/{conv_id}")
-def browse_conversation(conv_id: str, limit: int = 500):
-    conn = get_db()
-    conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
-    if not conv:
-        raise HTTPException(404, "Not found")
-    members = [dict(m) for m in conn.execute(
-        "SELECT agent_id, joined_at FROM conversation_members WHERE conversation_id = ?", (conv_id,)).fetchall()]
-    msgs = [dict(r) for r in conn.execute(
-        "SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp ASC LIMIT ?", (conv_id, limit)).fetchall()]
-    conn.close()
+def browse_conversation(conv_id: str, response: Response, limit: int = 500, after: Optional[str] = None):
+    """Conversation with its messages oldest-first. Page with ?after=<X-Next-Cursor of the previous page>."""
+    with db_pool.read() as conn:
+        conv = conn.execute("SELECT * FROM conversations WHERE id = ?", (conv_id,)).fetchone()
+        if not conv:
+            raise HTTPException(404, "Not found")
+        members = [dict(m) for m in conn.execute(
+            "SELECT agent_id, joined_at FROM conversation_members WHERE conversation_id = ?", (conv_id,)).fetchall()]
+        if after is None:
+            msgs = _fetch_dicts(conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? ORDER BY timestamp, id LIMIT ?",
+                (conv_id, limit)))
+        else:
+            ts, mid = _parse_cursor(after)
+            if mid is None:
+                msgs = _fetch_dicts(conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND timestamp > ? ORDER BY timestamp, id LIMIT ?",
+                    (conv_id, ts, limit)))
+            else:
+                msgs = _fetch_dicts(conn.execute(
+                    f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE conversation_id = ? AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?",
+                    (conv_id, ts, mid, limit)))
+    response.headers.update(_next_cursor(msgs, limit) or {})
     return {"conversation": dict(conv), "members": members, "messages": msgs}
 
+@ttl_cache(seconds=2)
+def _stats() -> dict:
+    with db_pool.read() as conn:
+        counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+        total, unread = counters["messages"], counters["unread_messages"]
+        agents = [a["agent_id"] for a in conn.execute("SELECT DISTINCT agent_id FROM api_keys").fetchall()]
+        conv_count = conn.execute("SELECT COUNT(*) as c FROM conversations").fetchone()["c"]
+    return {"total_messages": total, "unread_messages": unread, "agents": agents, "conversations": conv_count}
+
 @app.get("/stats")
 def get_stats():
-    conn = get_db()
-    total = conn.execute("SELECT COUNT(*) as c FROM messages").fetchone()["c"]
-    unread = conn.execute("SELECT COUNT(*) as c FROM messages WHERE read = 0").fetchone()["c"]
-    agents = [a["agent_id"] for a in conn.execute("SELECT DISTINCT agent_id FROM api_keys").fetchall()]
-    conv_count = conn.execute("SELECT COUNT(*) as c FROM conversations").fetchone()["c"]
-    conn.close()
-    return {"total_messages": total, "unread_messages": unread, "agents": agents, "conversations": conv_count}
+    """Polled by dashboards; counts may lag by up to 2s."""
+    return _stats()
 
 @app.get("/messages/all")
-def get_all_messages(limit: int = 500):
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM messages ORDER BY timestamp ASC LIMIT ?", (limit,)).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+def get_all_messages(limit: int = 500, after: Optional[str] = None):
+    """All messages oldest-first. Page with ?after=<X-Next-Cursor of the previous page>."""
+    with db_pool.read() as conn:
+        if after is None:
+            rows = _fetch_dicts(conn.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages ORDER BY timestamp, id LIMIT ?",
+                                             (limit,)))
+        else:
+            ts, mid = _parse_cursor(after)
+            if mid is None:
+                rows = _fetch_dicts(conn.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE timestamp > ? ORDER BY timestamp, id LIMIT ?",
+                                                 (ts, limit)))
+            else:
+                rows = _fetch_dicts(conn.execute(f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?",
+                                                 (ts, mid, limit)))
+    headers = _next_cursor(rows, limit)
+    # Plain JSON types only, so hand them straight to the renderer and skip jsonable_encoder
+    return DefaultResponse(rows, headers=headers)
+
+# path -> (mtime_ns, size, value); re-read only when the file changes on disk
+_file_cache: dict = {}
+
+def _read_cached(path: str, parse=None):
+    """Return the file's bytes (or parse(bytes)), memoized on mtime. Raises OSError if unreadable."""
+    st = os.stat(path)
+    hit = _file_cache.get(path)
+    if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+        return hit[2]
+    with open(path, "rb") as f:
+        data = f.read()
+    value = parse(data) if parse else data
+    _file_cache[path] = (st.st_mtime_ns, st.st_size, value)
+    return value
+
+def _html_page(name: str, missing: str) -> Response:
+    """Serve an HTML file next to main.py from the mtime cache, or `missing` if it isn't there."""
+    try:
+        return Response(content=_read_cached(os.path.join(os.path.dirname(__file__), name)), media_type="text/html")
+    except FileNotFoundError:
+        return Response(content=missing, media_type="text/html")
+    except OSError as e:
+        raise HTTPException(500, f"Could not read {name}: {e}")
 
 @app.get("/watcher-state")
 def watcher_state():
     p = os.path.join(os.path.dirname(__file__), "watcher-state.json")
-    if os.path.exists(p):
-        try:
-            return json.loads(open(p).read())
-        except Exception:
-            return {}
-    return {}
+    try:
+        # Cached as the raw bytes once they parse, so unchanged state is served without re-encoding
+        return Response(_read_cached(p, _checked_json), media_type="application/json")
+    except Exception:
+        return {}
+
+def _checked_json(data: bytes) -> bytes:
+    (orjson or json).loads(data)
+    return data
 
 # ── Task Board ─────────────────────────────────────────
 
+Q_TASK_EXISTS = "SELECT 1 FROM tasks WHERE id = ?"
+
 def _add_task_history(conn, task_id, agent_name, action, details=""):
     conn.execute(
         "INSERT INTO task_history (id, task_id, agent_name, action, details, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-        (str(uuid.uuid4()), task_id, agent_name, action, details, time.time())
+        (_new_id(), task_id, agent_name, action, details, time.time())
     )
 
+def _set_task_tags(conn, task_id, tags):
+    conn.execute("DELETE FROM task_tags WHERE task_id = ?", (task_id,))
+    conn.executemany("INSERT OR IGNORE INTO task_tags (task_id, tag) VALUES (?, ?)", [(task_id, t) for t in tags])
+
+@functools.lru_cache(maxsize=4096)
+def _tags_tuple(raw: str) -> tuple:
+    return tuple((orjson or json).loads(raw))
+
+def _parse_tags(raw: str) -> list:
+    """Decode a tags column. Tag sets repeat heavily across rows, so decoding is memoized."""
+    return list(_tags_tuple(raw))
+
 def _task_to_dict(row):
     d = dict(row)
-    d["tags"] = json.loads(d.get("tags", "[]"))
+    d.pop("priority_rank", None)  # internal sort key
+    d["tags"] = _parse_tags(d.get("tags", "[]"))
     return d
 
 @app.post("/tasks")
 def create_task(body: TaskCreate, agent_id: str = Depends(get_agent_id)):
-    task_id = str(uuid.uuid4())
+    task_id = _new_id()
     now = time.time()
     if body.priority not in ("low", "normal", "high", "urgent"):
         raise HTTPException(400, "Priority must be: low, normal, high, urgent")
@@ -1615,30 +2157,43 @@ def create_task(body: TaskCreate, agent_id: str = Depends(get_agent_id)):
             due_by = datetime.fromisoformat(body.due_by).timestamp()
         except ValueError:
             raise HTTPException(400, "Invalid due_by format. Use ISO 8601.")
-    conn = get_db()
-    if body.parent_id:
-        if not conn.execute("SELECT id FROM tasks WHERE id = ?", (body.parent_id,)).fetchone():
-            conn.close()
-            raise HTTPException(404, "Parent task not found")
-    conn.execute(
-        """INSERT INTO tasks (id, title, description, status, priority, created_by, assigned_to, tags, created_at, updated_at, due_by, parent_id, project_id, milestone_id, effort_estimate)
-           VALUES (?, ?, ?, 'open', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-        (task_id, body.title, body.description, body.priority, agent_id,
-         body.assigned_to, json.dumps(body.tags), now, now, due_by, body.parent_id,
-         body.project_id, body.milestone_id, body.effort_estimate)
-    )
-    # Add dependencies
-    for dep_id in body.depends_on:
-        if conn.execute("SELECT 1 FROM tasks WHERE id = ?", (dep_id,)).fetchone():
-            conn.execute("INSERT OR IGNORE INTO task_dependencies (task_id, depends_on) VALUES (?,?)", (task_id, dep_id))
-    _add_task_history(conn, task_id, agent_id, "created", f"Created task: {body.title}")
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        if body.parent_id:
+            if not conn.execute(Q_TASK_EXISTS, (body.parent_id,)).fetchone():
+                raise HTTPException(404, "Parent task not found")
+        row = conn.execute(
+            """INSERT INTO tasks (id, title, description, status, priority, created_by, assigned_to, tags, created_at, updated_at, due_by, parent_id, project_id, milestone_id, effort_estimate)
+               VALUES (?, ?, ?, 'open', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING *""",
+            (task_id, body.title, body.description, body.priority, agent_id,
+             body.assigned_to, json.dumps(body.tags), now, now, due_by, body.parent_id,
+             body.project_id, body.milestone_id, body.effort_estimate)
+        ).fetchone()
+        _set_task_tags(conn, task_id, body.tags)
+        # Add dependencies (unknown task ids are skipped by the SELECT)
+        conn.executemany("INSERT OR IGNORE INTO task_dependencies (task_id, depends_on) SELECT ?, id FROM tasks WHERE id = ?",
+                         [(task_id, dep_id) for dep_id in body.depends_on])
+        _add_task_history(conn, task_id, agent_id, "created", f"Created task: {body.title}")
     task = _task_to_dict(row)
     sse_publish("task_created", {"task": task, "agent": agent_id})
     return {"ok": True, "task": task}
 
+# list_tasks filters in bit order; one fixed SQL string per combination so
+# each variant stays a single prepared statement in the connection's cache
+_TASK_FILTERS = (
+    "status = :status",
+    "(assigned_to = :assigned_to OR claimed_by = :assigned_to)",
+    "created_by = :created_by",
+    "priority = :priority",
+    "id IN (SELECT task_id FROM task_tags WHERE tag = :tag)",
+)
+Q_LIST_TASKS = tuple(
+    "SELECT * FROM tasks"
+    + "".join((" AND " if n else " WHERE ") + c for n, c in enumerate(
+        c for i, c in enumerate(_TASK_FILTERS) if mask >> i & 1))
+    + " ORDER BY priority_rank, updated_at DESC LIMIT :limit"
+    for mask in range(1 << len(_TASK_FILTERS))
+)
+
 @app.get("/tasks")
 def list_tasks(
     status: Optional[str] = None, assigned_to: Optional[str] = None,
@@ -1646,244 +2201,256 @@ def list_tasks(
     tag: Optional[str] = None, limit: int = Query(50, le=200),
     agent_id: str = Depends(optional_agent_id)
 ):
-    conn = get_db()
-    query = "SELECT * FROM tasks WHERE 1=1"
-    params = []
-    if status:
-        query += " AND status = ?"; params.append(status)
-    if assigned_to:
-        query += " AND (assigned_to = ? OR claimed_by = ?)"; params.extend([assigned_to, assigned_to])
-    if created_by:
-        query += " AND created_by = ?"; params.append(created_by)
-    if priority:
-        query += " AND priority = ?"; params.append(priority)
-    query += " ORDER BY CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 WHEN 'low' THEN 3 END, updated_at DESC LIMIT ?"
-    params.append(limit)
-    rows = conn.execute(query, params).fetchall()
-    conn.close()
+    filters = (status, assigned_to, created_by, priority, tag)
+    mask = sum(1 << i for i, v in enumerate(filters) if v)
+    params = {"status": status, "assigned_to": assigned_to, "created_by": created_by,
+              "priority": priority, "tag": tag, "limit": limit}
+    with db_pool.read() as conn:
+        rows = conn.execute(Q_LIST_TASKS[mask], params).fetchall()
     tasks = [_task_to_dict(r) for r in rows]
-    if tag:
-        tasks = [t for t in tasks if tag in t.get("tags", [])]
     return {"tasks": tasks, "count": len(tasks)}
 
+Q_TASK_WITH_SUBTASKS = "SELECT * FROM tasks WHERE id = ? OR parent_id = ? ORDER BY created_at ASC"
+Q_TASK_TIMELINE = """
+    SELECT 'c' AS kind, id, task_id, agent_name, content, NULL AS action, NULL AS details, created_at
+    FROM task_comments WHERE task_id = ?
+    UNION ALL
+    SELECT 'h', id, task_id, agent_name, NULL, action, details, created_at
+    FROM task_history WHERE task_id = ?
+    ORDER BY created_at ASC"""
+
 @app.get("/tasks/{task_id}")
 def get_task(task_id: str, agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+    # Two round-trips: the task with its subtasks, then comments and history
+    # as one timeline split back apart by kind
+    with db_pool.read() as conn:
+        rows = conn.execute(Q_TASK_WITH_SUBTASKS, (task_id, task_id)).fetchall()
+        row = next((r for r in rows if r["id"] == task_id), None)
+        if not row:
+            raise HTTPException(404, "Task not found")
+        timeline = conn.execute(Q_TASK_TIMELINE, (task_id, task_id)).fetchall()
+    comments, history = [], []
+    for e in timeline:
+        if e["kind"] == "c":
+            comments.append({"id": e["id"], "task_id": e["task_id"], "agent_name": e["agent_name"],
+                             "content": e["content"], "created_at": e["created_at"]})
+        else:
+            history.append({"id": e["id"], "task_id": e["task_id"], "agent_name": e["agent_name"],
+                            "action": e["action"], "details": e["details"], "created_at": e["created_at"]})
+    # Plain JSON types only, so hand them straight to the renderer and skip jsonable_encoder
+    return DefaultResponse({"task": _task_to_dict(row), "comments": comments, "history": history,
+                            "subtasks": [_task_to_dict(s) for s in rows if s["id"] != task_id]})
+
+def _task_status(conn, task_id: str) -> str:
+    """Status of a task whose conditional UPDATE matched nothing; 404s if it doesn't exist."""
+    row = conn.execute("SELECT status FROM tasks WHERE id = ?", (task_id,)).fetchone()
     if not row:
-        conn.close(); raise HTTPException(404, "Task not found")
-    comments = conn.execute("SELECT * FROM task_comments WHERE task_id = ? ORDER BY created_at ASC", (task_id,)).fetchall()
-    history = conn.execute("SELECT * FROM task_history WHERE task_id = ? ORDER BY created_at ASC", (task_id,)).fetchall()
-    subtasks = conn.execute("SELECT * FROM tasks WHERE parent_id = ? ORDER BY created_at ASC", (task_id,)).fetchall()
-    conn.close()
-    return {"task": _task_to_dict(row), "comments": [dict(c) for c in comments],
-            "history": [dict(h) for h in history], "subtasks": [_task_to_dict(s) for s in subtasks]}
+        raise HTTPException(404, "Task not found")
+    return row["status"]
 
 @app.patch("/tasks/{task_id}")
 def update_task(task_id: str, body: TaskUpdate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    if not row:
-        conn.close(); raise HTTPException(404, "Task not found")
-    updates, params, changes = [], [], []
-    if body.title is not None:
-        updates.append("title = ?"); params.append(body.title); changes.append(f"title → '{body.title}'")
-    if body.description is not None:
-        updates.append("description = ?"); params.append(body.description); changes.append("description updated")
-    if body.priority is not None:
-        if body.priority not in ("low", "normal", "high", "urgent"):
-            conn.close(); raise HTTPException(400, "Invalid priority")
-        updates.append("priority = ?"); params.append(body.priority); changes.append(f"priority → {body.priority}")
-    if body.assigned_to is not None:
-        updates.append("assigned_to = ?"); params.append(body.assigned_to); changes.append(f"assigned to {body.assigned_to}")
-    if body.tags is not None:
-        updates.append("tags = ?"); params.append(json.dumps(body.tags)); changes.append(f"tags → {body.tags}")
-    if body.status is not None:
-        valid = ("open", "claimed", "in_progress", "done", "blocked", "cancelled")
-        if body.status not in valid:
-            conn.close(); raise HTTPException(400, f"Status must be one of: {', '.join(valid)}")
-        updates.append("status = ?"); params.append(body.status); changes.append(f"status → {body.status}")
-        if body.status == "done":
-            updates.append("completed_at = ?"); params.append(time.time())
-    if body.due_by is not None:
-        try:
-            updates.append("due_by = ?"); params.append(datetime.fromisoformat(body.due_by).timestamp()); changes.append(f"due by {body.due_by}")
-        except ValueError:
-            conn.close(); raise HTTPException(400, "Invalid due_by format")
-    if not updates:
-        conn.close(); raise HTTPException(400, "No updates provided")
-    updates.append("updated_at = ?"); params.append(time.time()); params.append(task_id)
-    conn.execute(f"UPDATE tasks SET {', '.join(updates)} WHERE id = ?", params)
-    _add_task_history(conn, task_id, agent_id, "updated", "; ".join(changes))
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        updates, params, changes = [], [], []
+        if body.title is not None:
+            updates.append("title = ?"); params.append(body.title); changes.append(f"title → '{body.title}'")
+        if body.description is not None:
+            updates.append("description = ?"); params.append(body.description); changes.append("description updated")
+        if body.priority is not None:
+            if body.priority not in ("low", "normal", "high", "urgent"):
+                raise HTTPException(400, "Invalid priority")
+            updates.append("priority = ?"); params.append(body.priority); changes.append(f"priority → {body.priority}")
+        if body.assigned_to is not None:
+            updates.append("assigned_to = ?"); params.append(body.assigned_to); changes.append(f"assigned to {body.assigned_to}")
+        if body.tags is not None:
+            updates.append("tags = ?"); params.append(json.dumps(body.tags)); changes.append(f"tags → {body.tags}")
+        if body.status is not None:
+            valid = ("open", "claimed", "in_progress", "done", "blocked", "cancelled")
+            if body.status not in valid:
+                raise HTTPException(400, f"Status must be one of: {', '.join(valid)}")
+            updates.append("status = ?"); params.append(body.status); changes.append(f"status → {body.status}")
+            if body.status == "done":
+                updates.append("completed_at = ?"); params.append(time.time())
+        if body.due_by is not None:
+            try:
+                updates.append("due_by = ?"); params.append(datetime.fromisoformat(body.due_by).timestamp()); changes.append(f"due by {body.due_by}")
+            except ValueError:
+                raise HTTPException(400, "Invalid due_by format")
+        if not updates:
+            raise HTTPException(400, "No updates provided")
+        updates.append("updated_at = ?"); params.append(time.time()); params.append(task_id)
+        # The UPDATE doubles as the existence check
+        row = conn.execute(f"UPDATE tasks SET {', '.join(updates)} WHERE id = ? RETURNING *", params).fetchone()
+        if not row:
+            raise HTTPException(404, "Task not found")
+        if body.tags is not None:
+            _set_task_tags(conn, task_id, body.tags)
+        _add_task_history(conn, task_id, agent_id, "updated", "; ".join(changes))
     task = _task_to_dict(row)
     sse_publish("task_updated", {"task": task, "changes": changes, "agent": agent_id})
     return {"ok": True, "task": task}
 
 @app.post("/tasks/{task_id}/claim")
 def claim_task(task_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    if not row: conn.close(); raise HTTPException(404, "Task not found")
-    if row["status"] != "open": conn.close(); raise HTTPException(400, f"Cannot claim task with status '{row['status']}'")
-    conn.execute("UPDATE tasks SET status = 'claimed', claimed_by = ?, updated_at = ? WHERE id = ?", (agent_id, time.time(), task_id))
-    _add_task_history(conn, task_id, agent_id, "claimed", f"{agent_id} claimed this task")
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        row = conn.execute("UPDATE tasks SET status = 'claimed', claimed_by = ?, updated_at = ? WHERE id = ? AND status = 'open' RETURNING *",
+                           (agent_id, time.time(), task_id)).fetchone()
+        if not row:
+            status = _task_status(conn, task_id)
+            raise HTTPException(400, f"Cannot claim task with status '{status}'")
+        _add_task_history(conn, task_id, agent_id, "claimed", f"{agent_id} claimed this task")
     task = _task_to_dict(row)
     sse_publish("task_claimed", {"task": task, "agent": agent_id})
     return {"ok": True, "task": task}
 
 @app.post("/tasks/{task_id}/start")
 def start_task(task_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    if not row: conn.close(); raise HTTPException(404, "Task not found")
-    if row["status"] not in ("open", "claimed"): conn.close(); raise HTTPException(400, f"Cannot start task with status '{row['status']}'")
-    conn.execute("UPDATE tasks SET status = 'in_progress', claimed_by = COALESCE(claimed_by, ?), updated_at = ? WHERE id = ?", (agent_id, time.time(), task_id))
-    _add_task_history(conn, task_id, agent_id, "started", f"{agent_id} started working")
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        row = conn.execute("""UPDATE tasks SET status = 'in_progress', claimed_by = COALESCE(claimed_by, ?), updated_at = ?
+            WHERE id = ? AND status IN ('open', 'claimed') RETURNING *""", (agent_id, time.time(), task_id)).fetchone()
+        if not row:
+            status = _task_status(conn, task_id)
+            raise HTTPException(400, f"Cannot start task with status '{status}'")
+        _add_task_history(conn, task_id, agent_id, "started", f"{agent_id} started working")
     task = _task_to_dict(row)
     sse_publish("task_started", {"task": task, "agent": agent_id})
     return {"ok": True, "task": task}
 
 @app.post("/tasks/{task_id}/complete")
 def complete_task(task_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    if not row: conn.close(); raise HTTPException(404, "Task not found")
-    if row["status"] in ("done", "cancelled"): conn.close(); raise HTTPException(400, f"Task already {row['status']}")
-    now = time.time()
-    conn.execute("UPDATE tasks SET status = 'done', completed_at = ?, updated_at = ? WHERE id = ?", (now, now, task_id))
-    _add_task_history(conn, task_id, agent_id, "completed", f"{agent_id} completed this task")
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        now = time.time()
+        row = conn.execute("""UPDATE tasks SET status = 'done', completed_at = ?, updated_at = ?
+            WHERE id = ? AND status NOT IN ('done', 'cancelled') RETURNING *""", (now, now, task_id)).fetchone()
+        if not row:
+            raise HTTPException(400, f"Task already {_task_status(conn, task_id)}")
+        _add_task_history(conn, task_id, agent_id, "completed", f"{agent_id} completed this task")
     task = _task_to_dict(row)
     sse_publish("task_completed", {"task": task, "agent": agent_id})
     return {"ok": True, "task": task}
 
 @app.post("/tasks/{task_id}/block")
 def block_task(task_id: str, body: TaskCommentCreate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    if not row: conn.close(); raise HTTPException(404, "Task not found")
-    conn.execute("UPDATE tasks SET status = 'blocked', updated_at = ? WHERE id = ?", (time.time(), task_id))
-    _add_task_history(conn, task_id, agent_id, "blocked", body.content)
-    conn.execute("INSERT INTO task_comments (id, task_id, agent_name, content, created_at) VALUES (?, ?, ?, ?, ?)",
-                 (str(uuid.uuid4()), task_id, agent_id, f"🚫 Blocked: {body.content}", time.time()))
-    conn.commit()
-    row = conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
-    conn.close()
+    with db_pool.transaction() as conn:
+        row = conn.execute("UPDATE tasks SET status = 'blocked', updated_at = ? WHERE id = ? RETURNING *",
+                           (time.time(), task_id)).fetchone()
+        if not row: raise HTTPException(404, "Task not found")
+        _add_task_history(conn, task_id, agent_id, "blocked", body.content)
+        conn.execute("INSERT INTO task_comments (id, task_id, agent_name, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (_new_id(), task_id, agent_id, f"🚫 Blocked: {body.content}", time.time()))
     task = _task_to_dict(row)
     sse_publish("task_blocked", {"task": task, "reason": body.content, "agent": agent_id})
     return {"ok": True, "task": task}
 
 @app.post("/tasks/{task_id}/comments")
 def add_task_comment(task_id: str, body: TaskCommentCreate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT id FROM tasks WHERE id = ?", (task_id,)).fetchone():
-        conn.close(); raise HTTPException(404, "Task not found")
-    comment_id = str(uuid.uuid4())
-    now = time.time()
-    conn.execute("INSERT INTO task_comments (id, task_id, agent_name, content, created_at) VALUES (?, ?, ?, ?, ?)",
-                 (comment_id, task_id, agent_id, body.content, now))
-    conn.execute("UPDATE tasks SET updated_at = ? WHERE id = ?", (now, task_id))
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute(Q_TASK_EXISTS, (task_id,)).fetchone():
+            raise HTTPException(404, "Task not found")
+        comment_id = _new_id()
+        now = time.time()
+        conn.execute("INSERT INTO task_comments (id, task_id, agent_name, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (comment_id, task_id, agent_id, body.content, now))
+        conn.execute("UPDATE tasks SET updated_at = ? WHERE id = ?", (now, task_id))
     sse_publish("task_comment", {"task_id": task_id, "comment_id": comment_id, "agent": agent_id, "content": body.content})
     return {"ok": True, "comment_id": comment_id}
 
 @app.get("/tasks/my/active")
 def my_tasks(agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    created = conn.execute("SELECT * FROM tasks WHERE created_by = ? AND status NOT IN ('done', 'cancelled') ORDER BY updated_at DESC", (agent_id,)).fetchall()
-    assigned = conn.execute("SELECT * FROM tasks WHERE (assigned_to = ? OR claimed_by = ?) AND status NOT IN ('done', 'cancelled') ORDER BY updated_at DESC", (agent_id, agent_id)).fetchall()
-    conn.close()
-    return {"created_by_me": [_task_to_dict(r) for r in created], "assigned_to_me": [_task_to_dict(r) for r in assigned]}
+    with db_pool.read() as conn:
+        rows = conn.execute("""SELECT * FROM tasks WHERE (created_by = ? OR assigned_to = ? OR claimed_by = ?)
+            AND status NOT IN ('done', 'cancelled') ORDER BY updated_at DESC""", (agent_id, agent_id, agent_id)).fetchall()
+    # A task the caller both created and holds is listed in both buckets
+    created, assigned = [], []
+    for r in rows:
+        t = _task_to_dict(r)
+        if t["created_by"] == agent_id:
+            created.append(t)
+        if agent_id in (t["assigned_to"], t["claimed_by"]):
+            assigned.append(t)
+    return {"created_by_me": created, "assigned_to_me": assigned}
 
 @app.get("/tasks/my/feed")
 def my_task_feed(limit: int = Query(20, le=100), agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    rows = conn.execute("""SELECT h.* FROM task_history h JOIN tasks t ON h.task_id = t.id
-        WHERE t.created_by = ? OR t.assigned_to = ? OR t.claimed_by = ?
-        ORDER BY h.created_at DESC LIMIT ?""", (agent_id, agent_id, agent_id, limit)).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("""SELECT h.* FROM task_history h JOIN tasks t ON h.task_id = t.id
+            WHERE t.created_by = ? OR t.assigned_to = ? OR t.claimed_by = ?
+            ORDER BY h.created_at DESC LIMIT ?""", (agent_id, agent_id, agent_id, limit)).fetchall()
     return {"feed": [dict(r) for r in rows]}
 
+BOARD_STATUSES = ("open", "claimed", "in_progress", "blocked", "done")
+# Top 50 per column in one pass, instead of one query per status
+Q_BOARD = f"""SELECT * FROM (
+    SELECT *, ROW_NUMBER() OVER (
+        PARTITION BY status
+        ORDER BY priority_rank, updated_at DESC
+    ) AS rn
+    FROM tasks WHERE status IN ({", ".join(f"'{s}'" for s in BOARD_STATUSES)})
+) WHERE rn <= 50 ORDER BY rn"""
+
 @app.get("/board")
 def board_view(agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    board = {}
-    for s in ["open", "claimed", "in_progress", "blocked", "done"]:
-        rows = conn.execute("SELECT * FROM tasks WHERE status = ? ORDER BY CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 WHEN 'low' THEN 3 END, updated_at DESC LIMIT 50", (s,)).fetchall()
-        board[s] = [_task_to_dict(r) for r in rows]
-    conn.close()
-    return {"board": board}
+    with db_pool.read() as conn:
+        rows = conn.execute(Q_BOARD).fetchall()
+    board = {s: [] for s in BOARD_STATUSES}
+    for r in rows:
+        t = _task_to_dict(r)
+        del t["rn"]
+        board[t["status"]].append(t)
+    return DefaultResponse({"board": board})
 
 # ── Projects ──────────────────────────────────────────
 
 @app.post("/projects")
 def create_project(body: ProjectCreate, agent_id: str = Depends(get_agent_id)):
-    pid = str(uuid.uuid4())
+    pid = _new_id()
     now = time.time()
-    conn = get_db()
-    conn.execute("INSERT INTO projects (id, name, description, created_by, created_at, updated_at, tags) VALUES (?,?,?,?,?,?,?)",
-                 (pid, body.name, body.description, agent_id, now, now, json.dumps(body.tags)))
-    conn.execute("INSERT INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
-                 (pid, agent_id, "owner", now))
-    for m in body.members:
-        if m != agent_id:
-            conn.execute("INSERT OR IGNORE INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
-                         (pid, m, "member", now))
-    conn.commit()
-    conn.close()
+    with db_pool.transaction() as conn:
+        conn.execute("INSERT INTO projects (id, name, description, created_by, created_at, updated_at, tags) VALUES (?,?,?,?,?,?,?)",
+                     (pid, body.name, body.description, agent_id, now, now, json.dumps(body.tags)))
+        conn.execute("INSERT INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
+                     (pid, agent_id, "owner", now))
+        conn.executemany("INSERT OR IGNORE INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
+                         [(pid, m, "member", now) for m in body.members if m != agent_id])
     sse_publish("project_created", {"project": {"id": pid, "name": body.name, "description": body.description}, "agent": agent_id})
     return {"ok": True, "project": {"id": pid, "name": body.name}}
 
 @app.get("/projects")
 def list_projects(agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    rows = conn.execute("""SELECT p.*, (SELECT COUNT(*) FROM tasks WHERE project_id = p.id) as task_count,
-        (SELECT COUNT(*) FROM tasks WHERE project_id = p.id AND status = 'done') as done_count,
-        (SELECT COUNT(*) FROM project_members WHERE project_id = p.id) as member_count
-        FROM projects p ORDER BY p.updated_at DESC""").fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("""SELECT p.*, (SELECT COUNT(*) FROM tasks WHERE project_id = p.id) as task_count,
+            (SELECT COUNT(*) FROM tasks WHERE project_id = p.id AND status = 'done') as done_count,
+            (SELECT COUNT(*) FROM project_members WHERE project_id = p.id) as member_count
+            FROM projects p ORDER BY p.updated_at DESC""").fetchall()
     result = []
     for r in rows:
         d = dict(r)
-        d["tags"] = json.loads(d.get("tags", "[]"))
+        d["tags"] = _parse_tags(d.get("tags", "[]"))
         d["progress_pct"] = round(d["done_count"] / d["task_count"] * 100) if d["task_count"] > 0 else 0
         result.append(d)
     return {"projects": result}
 
 @app.get("/projects/{project_id}")
 def get_project(project_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    proj = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
-    if not proj: conn.close(); raise HTTPException(404, "Project not found")
-    members = [dict(m) for m in conn.execute("SELECT * FROM project_members WHERE project_id = ?", (project_id,)).fetchall()]
-    tasks = [_task_to_dict(t) for t in conn.execute("SELECT * FROM tasks WHERE project_id = ? ORDER BY CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 WHEN 'normal' THEN 2 WHEN 'low' THEN 3 END", (project_id,)).fetchall()]
-    milestones = [dict(m) for m in conn.execute("SELECT * FROM milestones WHERE project_id = ? ORDER BY due_by ASC NULLS LAST", (project_id,)).fetchall()]
-    repos = [dict(r) for r in conn.execute("SELECT * FROM git_repos WHERE project_id = ?", (project_id,)).fetchall()]
-    conn.close()
+    with db_pool.read() as conn:
+        proj = conn.execute("SELECT * FROM projects WHERE id = ?", (project_id,)).fetchone()
+        if not proj: raise HTTPException(404, "Project not found")
+        members = [dict(m) for m in conn.execute("SELECT * FROM project_members WHERE project_id = ?", (project_id,)).fetchall()]
+        tasks = [_task_to_dict(t) for t in conn.execute("SELECT * FROM tasks WHERE project_id = ? ORDER BY priority_rank", (project_id,)).fetchall()]
+        milestones = [dict(m) for m in conn.execute("SELECT * FROM milestones WHERE project_id = ? ORDER BY due_by ASC NULLS LAST", (project_id,)).fetchall()]
+        repos = [dict(r) for r in conn.execute("SELECT * FROM git_repos WHERE project_id = ?", (project_id,)).fetchall()]
     d = dict(proj)
-    d["tags"] = json.loads(d.get("tags", "[]"))
+    d["tags"] = _parse_tags(d.get("tags", "[]"))
     return {"project": d, "members": members, "tasks": tasks, "milestones": milestones, "repos": repos}
 
 @app.post("/projects/{project_id}/members")
 def add_project_member(project_id: str, body: dict, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
-        conn.close(); raise HTTPException(404, "Project not found")
-    member_id = body.get("agent_id", "")
-    conn.execute("INSERT OR IGNORE INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
-                 (project_id, member_id, "member", time.time()))
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
+            raise HTTPException(404, "Project not found")
+        member_id = body.get("agent_id", "")
+        conn.execute("INSERT OR IGNORE INTO project_members (project_id, agent_id, role, joined_at) VALUES (?,?,?,?)",
+                     (project_id, member_id, "member", time.time()))
     sse_publish("project_member_added", {"project_id": project_id, "member": member_id, "agent": agent_id})
     return {"ok": True}
 
@@ -1891,75 +2458,69 @@ def add_project_member(project_id: str, body: dict, agent_id: str = Depends(get_
 
 @app.post("/projects/{project_id}/milestones")
 def create_milestone(project_id: str, body: MilestoneCreate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
-        conn.close(); raise HTTPException(404, "Project not found")
-    mid = str(uuid.uuid4())
-    due = None
-    if body.due_by:
-        try: due = datetime.fromisoformat(body.due_by).timestamp()
-        except ValueError: raise HTTPException(400, "Invalid due_by")
-    conn.execute("INSERT INTO milestones (id, project_id, name, description, due_by, status, created_at) VALUES (?,?,?,?,?,?,?)",
-                 (mid, project_id, body.name, body.description, due, "open", time.time()))
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
+            raise HTTPException(404, "Project not found")
+        mid = _new_id()
+        due = None
+        if body.due_by:
+            try: due = datetime.fromisoformat(body.due_by).timestamp()
+            except ValueError: raise HTTPException(400, "Invalid due_by")
+        conn.execute("INSERT INTO milestones (id, project_id, name, description, due_by, status, created_at) VALUES (?,?,?,?,?,?,?)",
+                     (mid, project_id, body.name, body.description, due, "open", time.time()))
     sse_publish("milestone_created", {"project_id": project_id, "milestone": {"id": mid, "name": body.name}, "agent": agent_id})
     return {"ok": True, "milestone": {"id": mid, "name": body.name}}
 
 @app.get("/projects/{project_id}/milestones")
 def list_milestones(project_id: str, agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    rows = conn.execute("SELECT * FROM milestones WHERE project_id = ? ORDER BY due_by ASC NULLS LAST", (project_id,)).fetchall()
-    result = []
-    for m in rows:
-        d = dict(m)
-        task_count = conn.execute("SELECT COUNT(*) FROM tasks WHERE milestone_id = ?", (m["id"],)).fetchone()[0]
-        done_count = conn.execute("SELECT COUNT(*) FROM tasks WHERE milestone_id = ? AND status = 'done'", (m["id"],)).fetchone()[0]
-        d["task_count"] = task_count
-        d["done_count"] = done_count
-        d["progress_pct"] = round(done_count / task_count * 100) if task_count > 0 else 0
-        result.append(d)
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("SELECT * FROM milestones WHERE project_id = ? ORDER BY due_by ASC NULLS LAST", (project_id,)).fetchall()
+        result = []
+        for m in rows:
+            d = dict(m)
+            task_count = conn.execute("SELECT COUNT(*) FROM tasks WHERE milestone_id = ?", (m["id"],)).fetchone()[0]
+            done_count = conn.execute("SELECT COUNT(*) FROM tasks WHERE milestone_id = ? AND status = 'done'", (m["id"],)).fetchone()[0]
+            d["task_count"] = task_count
+            d["done_count"] = done_count
+            d["progress_pct"] = round(done_count / task_count * 100) if task_count > 0 else 0
+            result.append(d)
     return {"milestones": result}
 
 # ── Task Dependencies ─────────────────────────────────
 
 @app.post("/tasks/{task_id}/dependencies")
 def add_dependency(task_id: str, body: DependencyAdd, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if not conn.execute("SELECT 1 FROM tasks WHERE id = ?", (task_id,)).fetchone():
-        conn.close(); raise HTTPException(404, "Task not found")
-    if not conn.execute("SELECT 1 FROM tasks WHERE id = ?", (body.depends_on,)).fetchone():
-        conn.close(); raise HTTPException(404, "Dependency task not found")
-    if task_id == body.depends_on:
-        conn.close(); raise HTTPException(400, "Task cannot depend on itself")
-    try:
-        conn.execute("INSERT INTO task_dependencies (task_id, depends_on) VALUES (?,?)", (task_id, body.depends_on))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        conn.close(); raise HTTPException(409, "Dependency already exists")
-    _add_task_history(conn, task_id, agent_id, "dependency_added", f"Now depends on {body.depends_on}")
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        if not conn.execute(Q_TASK_EXISTS, (task_id,)).fetchone():
+            raise HTTPException(404, "Task not found")
+        if not conn.execute(Q_TASK_EXISTS, (body.depends_on,)).fetchone():
+            raise HTTPException(404, "Dependency task not found")
+        if task_id == body.depends_on:
+            raise HTTPException(400, "Task cannot depend on itself")
+        try:
+            conn.execute("INSERT INTO task_dependencies (task_id, depends_on) VALUES (?,?)", (task_id, body.depends_on))
+        except sqlite3.IntegrityError:
+            raise HTTPException(409, "Dependency already exists")
+        _add_task_history(conn, task_id, agent_id, "dependency_added", f"Now depends on {body.depends_on}")
     sse_publish("task_dependency_added", {"task_id": task_id, "depends_on": body.depends_on, "agent": agent_id})
     return {"ok": True}
 
 @app.get("/tasks/{task_id}/dependencies")
 def get_dependencies(task_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    deps = conn.execute("""SELECT t.* FROM tasks t JOIN task_dependencies d ON t.id = d.depends_on
-        WHERE d.task_id = ?""", (task_id,)).fetchall()
-    blockers = [_task_to_dict(d) for d in deps]
-    unmet = [b for b in blockers if b["status"] != "done"]
-    dependents = conn.execute("""SELECT t.* FROM tasks t JOIN task_dependencies d ON t.id = d.task_id
-        WHERE d.depends_on = ?""", (task_id,)).fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        deps = conn.execute("""SELECT t.* FROM tasks t JOIN task_dependencies d ON t.id = d.depends_on
+            WHERE d.task_id = ?""", (task_id,)).fetchall()
+        blockers = [_task_to_dict(d) for d in deps]
+        unmet = [b for b in blockers if b["status"] != "done"]
+        dependents = conn.execute("""SELECT t.* FROM tasks t JOIN task_dependencies d ON t.id = d.task_id
+            WHERE d.depends_on = ?""", (task_id,)).fetchall()
     return {"depends_on": blockers, "unmet_blockers": len(unmet), "blocks": [_task_to_dict(d) for d in dependents]}
 
 @app.delete("/tasks/{task_id}/dependencies/{dep_id}")
 def remove_dependency(task_id: str, dep_id: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    conn.execute("DELETE FROM task_dependencies WHERE task_id = ? AND depends_on = ?", (task_id, dep_id))
-    _add_task_history(conn, task_id, agent_id, "dependency_removed", f"No longer depends on {dep_id}")
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        conn.execute("DELETE FROM task_dependencies WHERE task_id = ? AND depends_on = ?", (task_id, dep_id))
+        _add_task_history(conn, task_id, agent_id, "dependency_removed", f"No longer depends on {dep_id}")
     sse_publish("task_dependency_removed", {"task_id": task_id, "removed_dep": dep_id, "agent": agent_id})
     return {"ok": True}
 
@@ -1967,99 +2528,94 @@ def remove_dependency(task_id: str, dep_id: str, agent_id: str = Depends(get_age
 
 @app.post("/git/repos")
 def create_repo(body: RepoCreate, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    if conn.execute("SELECT 1 FROM git_repos WHERE name = ?", (body.name,)).fetchone():
-        conn.close(); raise HTTPException(409, f"Repo '{body.name}' already exists")
-    rid = str(uuid.uuid4())
-    conn.execute("INSERT INTO git_repos (id, name, description, created_by, created_at, project_id) VALUES (?,?,?,?,?,?)",
-                 (rid, body.name, body.description, agent_id, time.time(), body.project_id))
-    conn.execute("INSERT INTO git_branches (repo_id, name, head_commit) VALUES (?,?,?)", (rid, "main", None))
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        if conn.execute("SELECT 1 FROM git_repos WHERE name = ?", (body.name,)).fetchone():
+            raise HTTPException(409, f"Repo '{body.name}' already exists")
+        rid = _new_id()
+        conn.execute("INSERT INTO git_repos (id, name, description, created_by, created_at, project_id) VALUES (?,?,?,?,?,?)",
+                     (rid, body.name, body.description, agent_id, time.time(), body.project_id))
+        conn.execute("INSERT INTO git_branches (repo_id, name, head_commit) VALUES (?,?,?)", (rid, "main", None))
     return {"ok": True, "repo": {"id": rid, "name": body.name}}
 
 @app.get("/git/repos")
 def list_repos(agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    rows = conn.execute("""SELECT r.*, (SELECT COUNT(*) FROM git_commits WHERE repo_id = r.id) as commit_count,
-        (SELECT COUNT(DISTINCT branch) FROM git_commits WHERE repo_id = r.id) as branch_count
-        FROM git_repos r ORDER BY r.created_at DESC""").fetchall()
-    conn.close()
+    with db_pool.read() as conn:
+        rows = conn.execute("""SELECT r.*, (SELECT COUNT(*) FROM git_commits WHERE repo_id = r.id) as commit_count,
+            (SELECT COUNT(DISTINCT branch) FROM git_commits WHERE repo_id = r.id) as branch_count
+            FROM git_repos r ORDER BY r.created_at DESC""").fetchall()
     return {"repos": [dict(r) for r in rows]}
 
 @app.get("/git/repos/{repo_name}")
 def get_repo(repo_name: str, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
-    if not repo: conn.close(); raise HTTPException(404, "Repo not found")
-    branches = [dict(b) for b in conn.execute("SELECT * FROM git_branches WHERE repo_id = ?", (repo["id"],)).fetchall()]
-    recent = [dict(c) for c in conn.execute("SELECT * FROM git_commits WHERE repo_id = ? ORDER BY created_at DESC LIMIT 20", (repo["id"],)).fetchall()]
-    conn.close()
+    with db_pool.read() as conn:
+        repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
+        if not repo: raise HTTPException(404, "Repo not found")
+        branches = [dict(b) for b in conn.execute("SELECT * FROM git_branches WHERE repo_id = ?", (repo["id"],)).fetchall()]
+        recent = [dict(c) for c in conn.execute("SELECT * FROM git_commits WHERE repo_id = ? ORDER BY created_at DESC LIMIT 20", (repo["id"],)).fetchall()]
     return {"repo": dict(repo), "branches": branches, "recent_commits": recent}
 
 @app.post("/git/repos/{repo_name}/commit")
 def git_commit(repo_name: str, body: GitCommit, agent_id: str = Depends(get_agent_id)):
-    conn = get_db()
-    repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
-    if not repo: conn.close(); raise HTTPException(404, "Repo not found")
-    if not body.files: conn.close(); raise HTTPException(400, "No files in commit")
-
-    rid = repo["id"]
-    branch_row = conn.execute("SELECT * FROM git_branches WHERE repo_id = ? AND name = ?", (rid, body.branch)).fetchone()
-    if not branch_row:
-        conn.execute("INSERT INTO git_branches (repo_id, name, head_commit) VALUES (?,?,?)", (rid, body.branch, None))
-        parent_id = None
-    else:
-        parent_id = branch_row["head_commit"]
-
-    cid = str(uuid.uuid4())
-    conn.execute("INSERT INTO git_commits (id, repo_id, branch, author, message, created_at, parent_id) VALUES (?,?,?,?,?,?,?)",
-                 (cid, rid, body.branch, agent_id, body.message, time.time(), parent_id))
-
-    for f in body.files:
-        path = f.get("path", "")
-        content = f.get("content", "")
-        action = f.get("action", "add")  # add, modify, delete
-        sha = hashlib.sha256(content.encode()).hexdigest() if content else ""
-        fid = str(uuid.uuid4())
-        conn.execute("INSERT INTO git_files (id, commit_id, path, content, sha256, size, action) VALUES (?,?,?,?,?,?,?)",
-                     (fid, cid, path, content, sha, len(content.encode()), action))
-
-    conn.execute("UPDATE git_branches SET head_commit = ? WHERE repo_id = ? AND name = ?", (cid, rid, body.branch))
-    conn.commit(); conn.close()
+    with db_pool.transaction() as conn:
+        repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
+        if not repo: raise HTTPException(404, "Repo not found")
+        if not body.files: raise HTTPException(400, "No files in commit")
+
+        rid = repo["id"]
+        branch_row = conn.execute("SELECT * FROM git_branches WHERE repo_id = ? AND name = ?", (rid, body.branch)).fetchone()
+        if not branch_row:
+            conn.execute("INSERT INTO git_branches (repo_id, name, head_commit) VALUES (?,?,?)", (rid, body.branch, None))
+            parent_id = None
+        else:
+            parent_id = branch_row["head_commit"]
+
+        cid = _new_id()
+        conn.execute("INSERT INTO git_commits (id, repo_id, branch, author, message, created_at, parent_id) VALUES (?,?,?,?,?,?,?)",
+                     (cid, rid, body.branch, agent_id, body.message, time.time(), parent_id))
+
+        rows = []
+        for f in body.files:
+            path = f.get("path", "")
+            content = f.get("content", "")
+            action = f.get("action", "add")  # add, modify, delete
+            data = content.encode()
+            sha = hashlib.sha256(data).hexdigest() if content else ""
+            rows.append((_new_id(), cid, path, content, sha, len(data), action))
+        conn.executemany("INSERT INTO git_files (id, commit_id, path, content, sha256, size, action) VALUES (?,?,?,?,?,?,?)", rows)
+
+        conn.execute("UPDATE git_branches SET head_commit = ? WHERE repo_id = ? AND name = ?", (cid, rid, body.branch))
     return {"ok": True, "commit_id": cid, "branch": body.branch, "files_changed": len(body.files)}
 
 @app.get("/git/repos/{repo_name}/log")
 def git_log(repo_name: str, branch: str = "main", limit: int = 50, agent_id: str = Depends(optional_agent_id)):
-    conn = get_db()
-    repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
-    if not repo: conn.close(); raise HTTPException(404, "Repo not found")
-    commits = conn.execute("SELECT * FROM git_commits WHERE repo_id = ? AND branch = ? ORDER BY created_at DESC LIMIT ?",
-                           (repo["id"], branch, limit)).fetchall()
-    result = []
-    for c in commits:
-        d = dict(c)
-        d["files"] = [dict(f) for f in conn.execute("SELECT id, path, action, size, sha256 FROM git_files WHERE commit_id = ?", (c["id"],)).fetchall()]
-        result.append(d)
-    conn.close()
+    with db_pool.read() as conn:
+        repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
+        if not repo: raise HTTPException(404, "Repo not found")
+        commits = conn.execute("SELECT * FROM git_commits WHERE repo_id = ? AND branch = ? ORDER BY created_at DESC LIMIT ?",
+                               (repo["id"], branch, limit)).fetchall()
+        result = []
+        for c in commits:
+            d = dict(c)
+            d["files"] = [dict(f) for f in conn.execute("SELECT id, path, action, size, sha256 FROM git_files WHERE commit_id = ?", (c["id"],)).fetchall()]
+            result.append(d)
     return {"commits": result}
 
 @app.get("/git/repos/{repo_name}/tree")
 def git_tree(repo_name: str, branch: str = "main", agent_id: str = Depends(optional_agent_id)):
     """Get the current file tree (latest version of each file on branch)."""
-    conn = get_db()
-    repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
-    if not repo: conn.close(); raise HTTPException(404, "Repo not found")
-    # Walk commits from newest to oldest, build file map
-    commits = conn.execute("SELECT id FROM git_commits WHERE repo_id = ? AND branch = ? ORDER BY created_at DESC",
-                           (repo["id"], branch)).fetchall()
-    file_map = {}  # path -> {content, sha256, size, commit_id, action}
-    for c in commits:
-        files = conn.execute("SELECT * FROM git_files WHERE commit_id = ?", (c["id"],)).fetchall()
-        for f in files:
-            if f["path"] not in file_map:
-                file_map[f["path"]] = {"path": f["path"], "sha256": f["sha256"], "size": f["size"],
-                                        "action": f["action"], "commit_id": c["id"]}
-    conn.close()
+    with db_pool.read() as conn:
+        repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
+        if not repo: raise HTTPException(404, "Repo not found")
+        # Walk commits from newest to oldest, build file map
+        commits = conn.execute("SELECT id FROM git_commits WHERE repo_id = ? AND branch = ? ORDER BY created_at DESC",
+                               (repo["id"], branch)).fetchall()
+        file_map = {}  # path -> {content, sha256, size, commit_id, action}
+        for c in commits:
+            files = conn.execute("SELECT * FROM git_files WHERE commit_id = ?", (c["id"],)).fetchall()
+            for f in files:
+                if f["path"] not in file_map:
+                    file_map[f["path"]] = {"path": f["path"], "sha256": f["sha256"], "size": f["size"],
+                                            "action": f["action"], "commit_id": c["id"]}
     # Filter out deleted files
     tree = [v for v in file_map.values() if v["action"] != "delete"]
     return {"branch": branch, "files": sorted(tree, key=lambda x: x["path"])}
@@ -2067,14 +2623,13 @@ def git_tree(repo_name: str, branch: str = "main", agent_id: str = Depends(optio
 @app.get("/git/repos/{repo_name}/files/{file_path:path}")
 def git_read_file(repo_name: str, file_path: str, branch: str = "main", agent_id: str = Depends(optional_agent_id)):
     """Read latest version of a file from a branch."""
-    conn = get_db()
-    repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
-    if not repo: conn.close(); raise HTTPException(404, "Repo not found")
-    row = conn.execute("""SELECT gf.* FROM git_files gf
-        JOIN git_commits gc ON gf.commit_id = gc.id
-        WHERE gc.repo_id = ? AND gc.branch = ? AND gf.path = ?
-        ORDER BY gc.created_at DESC LIMIT 1""", (repo["id"], branch, file_path)).fetchone()
-    conn.close()
+    with db_pool.read() as conn:
+        repo = conn.execute("SELECT * FROM git_repos WHERE name = ?", (repo_name,)).fetchone()
+        if not repo: raise HTTPException(404, "Repo not found")
+        row = conn.execute("""SELECT gf.* FROM git_files gf
+            JOIN git_commits gc ON gf.commit_id = gc.id
+            WHERE gc.repo_id = ? AND gc.branch = ? AND gf.path = ?
+            ORDER BY gc.created_at DESC LIMIT 1""", (repo["id"], branch, file_path)).fetchone()
     if not row or row["action"] == "delete":
         raise HTTPException(404, "File not found")
     return {"path": file_path, "content": row["content"], "sha256": row["sha256"], "size": row["size"]}
@@ -2082,42 +2637,35 @@ def git_read_file(repo_name: str, file_path: str, branch: str = "main", agent_id
 @app.get("/git/repos/{repo_name}/diff/{commit_id}")
 def git_diff(repo_name: str, commit_id: str, agent_id: str = Depends(optional_agent_id)):
     """Show diff for a specific commit."""
-    conn = get_db()
-    commit = conn.execute("SELECT * FROM git_commits WHERE id = ?", (commit_id,)).fetchone()
-    if not commit: conn.close(); raise HTTPException(404, "Commit not found")
-    files = conn.execute("SELECT * FROM git_files WHERE commit_id = ?", (commit_id,)).fetchall()
-    diffs = []
-    for f in files:
-        if commit["parent_id"] and f["action"] == "modify":
-            old = conn.execute("""SELECT gf.content FROM git_files gf
-                JOIN git_commits gc ON gf.commit_id = gc.id
-                WHERE gc.repo_id = ? AND gc.branch = ? AND gf.path = ? AND gc.created_at < ?
-                ORDER BY gc.created_at DESC LIMIT 1""",
-                (commit["repo_id"], commit["branch"], f["path"], commit["created_at"])).fetchone()
-            old_content = (old["content"] if old else "").splitlines(keepends=True)
-            new_content = (f["content"] or "").splitlines(keepends=True)
-            diff_text = "".join(difflib.unified_diff(old_content, new_content, fromfile=f"a/{f['path']}", tofile=f"b/{f['path']}"))
-        elif f["action"] == "delete":
-            diff_text = f"--- a/{f['path']}\n+++ /dev/null\n(file deleted)"
-        else:
-            diff_text = f"--- /dev/null\n+++ b/{f['path']}\n(new file, {f['size']} bytes)"
-        diffs.append({"path": f["path"], "action": f["action"], "diff": diff_text})
-    conn.close()
+    with db_pool.read() as conn:
+        commit = conn.execute("SELECT * FROM git_commits WHERE id = ?", (commit_id,)).fetchone()
+        if not commit: raise HTTPException(404, "Commit not found")
+        files = conn.execute("SELECT * FROM git_files WHERE commit_id = ?", (commit_id,)).fetchall()
+        diffs = []
+        for f in files:
+            if commit["parent_id"] and f["action"] == "modify":
+                old = conn.execute("""SELECT gf.content FROM git_files gf
+                    JOIN git_commits gc ON gf.commit_id = gc.id
+                    WHERE gc.repo_id = ? AND gc.branch = ? AND gf.path = ? AND gc.created_at < ?
+                    ORDER BY gc.created_at DESC LIMIT 1""",
+                    (commit["repo_id"], commit["branch"], f["path"], commit["created_at"])).fetchone()
+                old_content = (old["content"] if old else "").splitlines(keepends=True)
+                new_content = (f["content"] or "").splitlines(keepends=True)
+                diff_text = "".join(difflib.unified_diff(old_content, new_content, fromfile=f"a/{f['path']}", tofile=f"b/{f['path']}"))
+            elif f["action"] == "delete":
+                diff_text = f"--- a/{f['path']}\n+++ /dev/null\n(file deleted)"
+            else:
+                diff_text = f"--- /dev/null\n+++ b/{f['path']}\n(new file, {f['size']} bytes)"
+            diffs.append({"path": f["path"], "action": f["action"], "diff": diff_text})
     return {"commit": dict(commit), "diffs": diffs}
 
 @app.get("/board/web")
 def task_board_web():
-    p = os.path.join(os.path.dirname(__file__), "taskboard.html")
-    if os.path.exists(p):
-        return Response(content=open(p).read(), media_type="text/html")
-    return Response(content="<h1>Task Board</h1><p>taskboard.html not found</p>", media_type="text/html")
+    return _html_page("taskboard.html", "<h1>Task Board</h1><p>taskboard.html not found</p>")
 
 @app.get("/observatory")
 def observatory():
-    p = os.path.join(os.path.dirname(__file__), "observatory.html")
-    if os.path.exists(p):
-        return Response(content=open(p).read(), media_type="text/html")
-    return Response(content="<h1>Observatory not found</h1>", media_type="text/html")
+    return _html_page("observatory.html", "<h1>Observatory not found</h1>")
 
 # ── Arena API ─────────────────────────────────────────
 
@@ -2163,10 +2711,7 @@ def _load_challenges():
 
 @app.get("/arena")
 def arena_ui():
-    p = os.path.join(os.path.dirname(__file__), "arena.html")
-    if os.path.exists(p):
-        return Response(content=open(p).read(), media_type="text/html")
-    return Response(content="<h1>Arena not found</h1>", media_type="text/html")
+    return _html_page("arena.html", "<h1>Arena not found</h1>")
 
 @app.get("/arena/challenges")
 def arena_challenges(difficulty: Optional[str] = None, category: Optional[str] = None):
@@ -2262,7 +2807,7 @@ def arena_submit(sub: ArenaSubmission, x_api_key: str = Header(None)):
     if not challenge:
         raise HTTPException(404, "Challenge not found")
 
-    sub_id = str(uuid.uuid4())
+    sub_id = _new_id()
     now = time.time()
     db = get_arena_db()
     db.execute(
@@ -2329,10 +2874,4 @@ async def sse_stream(request: Request):
 
 @app.get("/web")
 def web_ui():
-    p = os.path.join(os.path.dirname(__file__), "web.html")
-    if os.path.exists(p):
-        try:
-            return Response(content=open(p).read(), media_type="text/html")
-        except OSError as e:
-            raise HTTPException(500, f"Could not read web UI: {e}")
-    return Response(content="<h1>Web UI not found</h1>", media_type="text/html")
+    return _html_page("web.html", "<h1>Web UI not found</h1>")
@@ -3,6 +3,7 @@ set -e
 cd "$(dirname "$0")"
 export BRIDGE_ADMIN_SECRET="${BRIDGE_ADMIN_SECRET:-$(cat admin_secret.txt 2>/dev/null || echo 'changeme')}"
 pip install -q -r requirements.txt
-nohup uvicorn main:app --host 0.0.0.0 --port 8765 > bridge.log 2>&1 &
+# Single worker on purpose: the SSE bus and caches are per-process
+nohup uvicorn main:app --host 0.0.0.0 --port 8765 --loop uvloop --http httptools --backlog 2048 > bridge.log 2>&1 &
 echo $! > bridge.pid
 echo "Agent Bridge started on port 8765 (PID $(cat bridge.pid))"